@@ -1,3 +1,23 @@
 from django.contrib import admin
+from .models import InventoryPerformance
 
-# Register your models here.
+
+class InventoryPerformanceAdmin(admin.ModelAdmin):
+    """✅ Отчёт об оборачиваемости и ABC-классах (только чтение, пересчитывается задачей Celery)."""
+    list_display = [
+        "product", "sales_point", "abc_class", "on_hand", "units_sold", "sell_through",
+        "days_of_cover", "turnover", "revenue_share", "computed_at",
+    ]
+    search_fields = ["product__name", "sales_point__name"]
+    list_filter = ["abc_class", "sales_point"]
+    list_select_related = ["product", "sales_point"]
+    ordering = ["sales_point", "-revenue"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(InventoryPerformance, InventoryPerformanceAdmin)
@@ -0,0 +1,145 @@
+import hashlib
+import time
+from functools import partial
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = "analytics:version:{scope}"
+ENTRY_KEY = "analytics:entry:{role}:{scope}:{version}:{digest}"
+
+# Query parameters that are folded into the normalized scope and window of the key.
+NORMALIZED_PARAMS = {"start_date", "end_date", "time_filter", "sales_point_id"}
+
+
+def _scope(sales_point_id):
+    return f"sp{sales_point_id}" if sales_point_id else "all"
+
+
+def _initial_version():
+    # Millisecond clock: a stamp recreated after eviction never matches an older entry.
+    return time.time_ns() // 1_000_000
+
+
+def get_version(sales_point_id=None):
+    """Current version stamp of a scope (one sales point, or `all` for unscoped reports)."""
+    key = VERSION_KEY.format(scope=_scope(sales_point_id))
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_versions(sales_point_ids):
+    """
+    Invalidates the cached reports that may include data of the given sales
+    points: their own scopes plus the unscoped `all` reports. Old entries are
+    never deleted, they simply stop being looked up and expire on their own.
+    The bump happens once the current transaction commits, so a report built
+    in the meantime is stored under the old version and never served after it.
+    """
+    transaction.on_commit(partial(_bump_versions, set(sales_point_ids)))
+
+
+def _bump_versions(sales_point_ids):
+    scopes = {_scope(sales_point_id) for sales_point_id in sales_point_ids if sales_point_id}
+    scopes.add(_scope(None))
+    for scope in scopes:
+        key = VERSION_KEY.format(scope=scope)
+        try:
+            cache.incr(key)
+        except ValueError:  # never read or evicted: a fresh stamp invalidates just as well
+            cache.add(key, _initial_version(), None)
+
+
+def build_key(role, sales_point_id, window, query_params):
+    """Cache key for one report: role, effective sales point, time window and remaining filters."""
+    extra = sorted(
+        (name, value)
+        for name, values in query_params.lists()
+        if name not in NORMALIZED_PARAMS
+        for value in values
+    )
+    digest = hashlib.md5(repr((window, extra, get_bucket_generation())).encode(), usedforsecurity=False).hexdigest()
+    return ENTRY_KEY.format(
+        role=role,
+        scope=_scope(sales_point_id),
+        version=get_version(sales_point_id),
+        digest=digest,
+    )
+
+
+def get_report(key):
+    return cache.get(key)
+
+
+def set_report(key, data):
+    cache.set(key, data, settings.ANALYTICS_CACHE_TIMEOUT)
+
+
+BUCKET_GENERATION_KEY = "analytics:buckets:generation"
+BUCKET_KEY = "analytics:bucket:{generation}:{kind}:{scope}:{granularity}:{start}"
+
+
+def get_bucket_generation():
+    generation = cache.get(BUCKET_GENERATION_KEY)
+    if generation is None:
+        cache.add(BUCKET_GENERATION_KEY, _initial_version(), None)
+        generation = cache.get(BUCKET_GENERATION_KEY)
+    return generation
+
+
+def reset_buckets():
+    """Orphans every cached bucket at once, e.g. after the fact table was rebuilt."""
+    try:
+        cache.incr(BUCKET_GENERATION_KEY)
+    except ValueError:
+        cache.add(BUCKET_GENERATION_KEY, _initial_version(), None)
+
+
+def bucket_key(generation, kind, sales_point_id, granularity, start):
+    return BUCKET_KEY.format(
+        generation=generation,
+        kind=kind,
+        scope=_scope(sales_point_id),
+        granularity=granularity,
+        start=start.isoformat(),
+    )
+
+
+def get_buckets(keys):
+    return cache.get_many(keys)
+
+
+def set_buckets(entries):
+    """
+    Closed buckets are kept for ANALYTICS_BUCKET_TIMEOUT; late writes to their
+    days delete them earlier (see invalidate_buckets).
+    """
+    cache.set_many(entries, settings.ANALYTICS_BUCKET_TIMEOUT)
+
+
+def invalidate_buckets(kind, days, sales_point_ids):
+    """
+    Drops the cached buckets of every granularity that contain one of `days`
+    once the current transaction commits: deleted earlier, a concurrent report
+    could store them again from the data as it was before the write. A report
+    that read before the commit and stores after it can still cache the old
+    data; the bucket timeout bounds how long that is served.
+    """
+    transaction.on_commit(partial(_delete_buckets, kind, set(days), set(sales_point_ids)))
+
+
+def _delete_buckets(kind, days, sales_point_ids):
+    from analytics.timeseries import CACHED_GRANULARITIES, bucket_start
+
+    generation = get_bucket_generation()
+    scopes = {sales_point_id for sales_point_id in sales_point_ids if sales_point_id}
+    scopes.add(None)
+    cache.delete_many([
+        bucket_key(generation, kind, sales_point_id, granularity, bucket_start(day, granularity))
+        for day in days
+        for granularity in CACHED_GRANULARITIES
+        for sales_point_id in scopes
+    ])
@@ -0,0 +1,108 @@
+"""
+Monthly acquisition cohorts: retention, repeat-purchase rate and lifetime value.
+
+A customer belongs to the cohort of the local month of their first sale (per
+sales point when the report is scoped). The matrix only covers closed months,
+so it is cached per scope and latest closed month like the closed buckets of
+the time series; late sales in a closed month drop it (see invalidate_cohorts).
+"""
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db.models import DecimalField, F, Sum
+from django.utils import timezone
+from orders.models import OrderItem
+from analytics import cache as analytics_cache
+from analytics.models import SALES_STATUSES
+from analytics.optional import require
+from analytics.timeseries import analytics_timezone, bucket_start, local_day
+
+
+def last_closed_month():
+    """First day of the latest month that has fully ended in the analytics time zone."""
+    return bucket_start(bucket_start(local_day(timezone.now()), "month") - timedelta(days=1), "month")
+
+
+def _cohort_key(sales_point_id, through):
+    generation = analytics_cache.get_bucket_generation()
+    return analytics_cache.bucket_key(generation, "cohorts", sales_point_id, "month", through)
+
+
+def _order_revenues(sales_point_id, until):
+    """(order_id, user_id, created_at, revenue) of every sale before `until`, in one grouped query."""
+    items = OrderItem.objects.filter(order__status__in=SALES_STATUSES, order__created_at__lt=until)
+    if sales_point_id:
+        items = items.filter(sales_point_id=sales_point_id)
+    return items.values_list("order_id", "order__user_id", "order__created_at").annotate(
+        revenue=Sum(F("quantity") * F("price"), output_field=DecimalField())
+    ).order_by()
+
+
+def compute_cohorts(rows, through):
+    """
+    Cohort matrix of the given order rows, computed with pandas grouping.
+    Each cohort lists its retention (% of the cohort buying in month N after
+    acquisition) and cumulative revenue per customer up to `through`.
+    """
+    pd = require("pandas")
+    np = require("numpy")
+
+    frame = pd.DataFrame.from_records(rows, columns=["order_id", "user_id", "created_at", "revenue"])
+    if frame.empty:
+        return []
+    frame["revenue"] = frame["revenue"].astype(float)
+    local = pd.to_datetime(frame["created_at"], utc=True).dt.tz_convert(settings.ANALYTICS_TIME_ZONE)
+    frame["month"] = local.dt.year * 12 + local.dt.month - 1
+    frame["cohort"] = frame.groupby("user_id")["month"].transform("min")
+    frame["offset"] = frame["month"] - frame["cohort"]
+
+    width = through.year * 12 + through.month - 1 - int(frame["cohort"].min()) + 1
+    active = frame.pivot_table(index="cohort", columns="offset", values="user_id", aggfunc="nunique", fill_value=0)
+    active = active.reindex(columns=range(width), fill_value=0)
+    revenue = frame.pivot_table(index="cohort", columns="offset", values="revenue", aggfunc="sum", fill_value=0)
+    revenue = revenue.reindex(index=active.index, columns=range(width), fill_value=0)
+
+    sizes = active[0].to_numpy(dtype=float)
+    retention = active.to_numpy(dtype=float) / sizes[:, None] * 100
+    ltv = np.cumsum(revenue.to_numpy(dtype=float), axis=1) / sizes[:, None]
+    orders_per_customer = frame.groupby(["cohort", "user_id"])["order_id"].nunique()
+    repeat_rate = (orders_per_customer >= 2).groupby(level="cohort").mean().reindex(active.index) * 100
+    # Months observed per cohort: the rest of each row lies after `through`.
+    observed = through.year * 12 + through.month - active.index.to_numpy()
+
+    cohorts = []
+    for row, (cohort, months) in enumerate(zip(active.index, observed)):
+        year, month = divmod(int(cohort), 12)
+        cohorts.append({
+            "cohort": f"{year:04d}-{month + 1:02d}",
+            "customers": int(sizes[row]),
+            "repeat_rate": round(float(repeat_rate.iloc[row]), 2),
+            "ltv": round(float(ltv[row, months - 1]), 2),
+            "retention": [round(float(value), 2) for value in retention[row, :months]],
+            "ltv_curve": [round(float(value), 2) for value in ltv[row, :months]],
+        })
+    return cohorts
+
+
+def cohort_report(sales_point_id=None):
+    """Cohorts up to the latest closed month, read from the cache or computed and stored as a closed bucket."""
+    through = last_closed_month()
+    key = _cohort_key(sales_point_id, through)
+    cached = analytics_cache.get_buckets([key])
+    if key in cached:
+        return cached[key]
+
+    until = timezone.make_aware(datetime.combine(bucket_start(local_day(timezone.now()), "month"), time.min),
+                                analytics_timezone())
+    report = {
+        "through": through.strftime("%Y-%m"),
+        "cohorts": compute_cohorts(list(_order_revenues(sales_point_id, until)), through),
+    }
+    analytics_cache.set_buckets({key: report})
+    return report
+
+
+def invalidate_cohorts(days, sales_point_ids):
+    """Sales written late into a closed month change the cached matrix of the latest closed month (dropped on commit)."""
+    current_month = bucket_start(local_day(timezone.now()), "month")
+    if any(day < current_month for day in days):
+        analytics_cache.invalidate_buckets("cohorts", [last_closed_month()], sales_point_ids)
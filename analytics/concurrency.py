@@ -0,0 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection, connections
+from django.utils import timezone
+
+
+def run_concurrently(tasks):
+    """
+    Runs independent zero-argument callables and returns their results in order.
+
+    Up to ANALYTICS_QUERY_WORKERS threads are used, each with its own database
+    connection (closed when the task ends) and the caller's active time zone.
+    Inside a transaction the tasks run one after another on the caller's
+    connection instead, since other connections cannot see its uncommitted rows.
+    """
+    workers = min(settings.ANALYTICS_QUERY_WORKERS, len(tasks))
+    if workers <= 1 or connection.in_atomic_block:
+        return [task() for task in tasks]
+
+    current_timezone = timezone.get_current_timezone()
+
+    def run(task):
+        try:
+            with timezone.override(current_timezone):
+                return task()
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, tasks))
@@ -0,0 +1,72 @@
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from .timeseries import analytics_timezone
+
+# (column, OrderItem lookup) pairs of the line-level sales export, in output order.
+EXPORT_COLUMNS = (
+    ("created_at", "order__created_at"),
+    ("order_id", "order_id"),
+    ("customer", "order__user__username"),
+    ("product_id", "product_id"),
+    ("product", "product__name"),
+    ("sales_point_id", "sales_point_id"),
+    ("sales_point", "sales_point__name"),
+    ("quantity", "quantity"),
+    ("price", "price"),
+    ("cost_price", "cost_price"),
+)
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it (for csv.writer)."""
+
+    def write(self, value):
+        return value
+
+
+def _localize(row):
+    tz = analytics_timezone()
+    return (timezone.localtime(row[0], tz).isoformat(),) + tuple(row[1:])
+
+
+def _encode_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([column for column, _ in EXPORT_COLUMNS])
+    for row in rows:
+        yield writer.writerow(_localize(row))
+
+
+def _encode_ndjson(rows):
+    columns = [column for column, _ in EXPORT_COLUMNS]
+    for row in rows:
+        yield json.dumps(dict(zip(columns, _localize(row))), cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+def stream_order_items(items_qs, file_format, chunk_size):
+    """
+    Yields the export of `items_qs` in `file_format`, one chunk of
+    `chunk_size` lines at a time. Rows are read through a server-side cursor
+    (`iterator(chunk_size=...)`), so memory use does not depend on the size of
+    the export and the first bytes leave before the query is exhausted.
+    """
+    rows = (
+        items_qs.order_by("order__created_at", "id")
+        .values_list(*(lookup for _, lookup in EXPORT_COLUMNS))
+        .iterator(chunk_size=chunk_size)
+    )
+    encode = _encode_csv if file_format == "csv" else _encode_ndjson
+    buffer = []
+    for line in encode(rows):
+        buffer.append(line)
+        if len(buffer) >= chunk_size:
+            yield "".join(buffer)
+            buffer = []
+    if buffer:
+        yield "".join(buffer)
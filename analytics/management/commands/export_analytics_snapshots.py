@@ -0,0 +1,20 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from analytics.snapshots import export_closed_days
+
+
+class Command(BaseCommand):
+    help = "Exporta los días cerrados de órdenes y facturas a Parquet para la analítica histórica."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=date.fromisoformat, help="Primer día a exportar (AAAA-MM-DD).")
+        parser.add_argument("--end", type=date.fromisoformat, help="Último día a exportar (AAAA-MM-DD).")
+        parser.add_argument("--force", action="store_true", help="Reescribe también los días ya exportados.")
+
+    def handle(self, *args, **options):
+        start, end = options.get("start"), options.get("end")
+        if start and end and start > end:
+            raise CommandError("--start no puede ser posterior a --end.")
+
+        days = export_closed_days(start, end, force=options["force"])
+        self.stdout.write(self.style.SUCCESS(f"Días exportados: {len(days)}."))
@@ -0,0 +1,28 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from analytics import cache as analytics_cache
+from analytics.models import DailySalesFact
+
+
+class Command(BaseCommand):
+    help = "Recalcula la tabla DailySalesFact a partir de los artículos de las órdenes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=date.fromisoformat, help="Primer día a recalcular (AAAA-MM-DD).")
+        parser.add_argument("--end", type=date.fromisoformat, help="Último día a recalcular (AAAA-MM-DD).")
+
+    def handle(self, *args, **options):
+        start, end = options.get("start"), options.get("end")
+        if bool(start) != bool(end):
+            raise CommandError("--start y --end deben indicarse juntos.")
+        if start and start > end:
+            raise CommandError("--start no puede ser posterior a --end.")
+
+        days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)] if start else None
+        with transaction.atomic():
+            DailySalesFact.objects.refresh(days)
+        # Cached closed-day buckets were computed from the old facts.
+        analytics_cache.reset_buckets()
+        scope = f"{start} – {end}" if start else "todo el historial"
+        self.stdout.write(self.style.SUCCESS(f"Ventas diarias recalculadas para {scope}."))
@@ -0,0 +1,71 @@
+# Generated by Django 5.2 on 2026-10-17 23:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_daily_sales_facts(apps, schema_editor):
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    DailySalesFact = apps.get_model('analytics', 'DailySalesFact')
+    rows = (
+        OrderItem.objects.filter(order__status__in=['en_proceso', 'enviado'])
+        .annotate(day=TruncDate('order__created_at'))
+        .values('day', 'sales_point_id', 'product_id')
+        .annotate(
+            total_quantity=Sum('quantity'),
+            total_revenue=Sum(F('quantity') * F('price')),
+            total_cogs=Sum(F('quantity') * F('cost_price')),
+            total_orders=Count('order_id', distinct=True),
+        )
+        .order_by()
+    )
+    DailySalesFact.objects.bulk_create(
+        [
+            DailySalesFact(
+                day=row['day'],
+                sales_point_id=row['sales_point_id'],
+                product_id=row['product_id'],
+                quantity=row['total_quantity'],
+                revenue=row['total_revenue'],
+                cogs=row['total_cogs'],
+                order_count=row['total_orders'],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('inventory', '0004_productavailability'),
+        ('orders', '0012_order_reservation_expires_at'),
+        ('store', '0007_delete_stockmovement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Día')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='Cantidad vendida')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Ingresos')),
+                ('cogs', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Costo de ventas')),
+                ('order_count', models.PositiveIntegerField(default=0, verbose_name='Cantidad de órdenes')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='store.product', verbose_name='Producto')),
+                ('sales_point', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='inventory.salespoint', verbose_name='Punto de venta')),
+            ],
+            options={
+                'verbose_name': 'Venta diaria',
+                'verbose_name_plural': 'Ventas diarias',
+                'indexes': [models.Index(fields=['day', 'sales_point'], name='daily_sales_day_sp_idx'), models.Index(fields=['product', 'day'], name='daily_sales_product_day_idx')],
+            },
+        ),
+        migrations.RunPython(populate_daily_sales_facts, migrations.RunPython.noop),
+    ]
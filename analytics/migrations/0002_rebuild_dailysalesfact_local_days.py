@@ -0,0 +1,49 @@
+from zoneinfo import ZoneInfo
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def rebuild_in_analytics_time_zone(apps, schema_editor):
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    DailySalesFact = apps.get_model('analytics', 'DailySalesFact')
+    DailySalesFact.objects.all().delete()
+    rows = (
+        OrderItem.objects.filter(order__status__in=['en_proceso', 'enviado'])
+        .annotate(day=TruncDate('order__created_at', tzinfo=ZoneInfo(settings.ANALYTICS_TIME_ZONE)))
+        .values('day', 'sales_point_id', 'product_id')
+        .annotate(
+            total_quantity=Sum('quantity'),
+            total_revenue=Sum(F('quantity') * F('price')),
+            total_cogs=Sum(F('quantity') * F('cost_price')),
+            total_orders=Count('order_id', distinct=True),
+        )
+        .order_by()
+    )
+    DailySalesFact.objects.bulk_create(
+        [
+            DailySalesFact(
+                day=row['day'],
+                sales_point_id=row['sales_point_id'],
+                product_id=row['product_id'],
+                quantity=row['total_quantity'],
+                revenue=row['total_revenue'],
+                cogs=row['total_cogs'],
+                order_count=row['total_orders'],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0001_dailysalesfact'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_in_analytics_time_zone, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-17 23:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0002_rebuild_dailysalesfact_local_days'),
+        ('inventory', '0004_productavailability'),
+        ('store', '0007_delete_stockmovement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryPerformance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_days', models.PositiveIntegerField(verbose_name='Días analizados')),
+                ('on_hand', models.PositiveIntegerField(default=0, verbose_name='Stock actual')),
+                ('units_sold', models.PositiveIntegerField(default=0, verbose_name='Unidades vendidas')),
+                ('units_received', models.PositiveIntegerField(default=0, verbose_name='Unidades recibidas')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Ingresos')),
+                ('cogs', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Costo de ventas')),
+                ('sell_through', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True, verbose_name='Sell-through (%)')),
+                ('days_of_cover', models.DecimalField(blank=True, decimal_places=1, max_digits=10, null=True, verbose_name='Días de cobertura')),
+                ('turnover', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Rotación')),
+                ('revenue_share', models.DecimalField(decimal_places=2, default=0, max_digits=5, verbose_name='Participación en ingresos (%)')),
+                ('abc_class', models.CharField(choices=[('A', 'A'), ('B', 'B'), ('C', 'C')], max_length=1, verbose_name='Clase ABC')),
+                ('computed_at', models.DateTimeField(verbose_name='Calculado el')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_performance', to='store.product', verbose_name='Producto')),
+                ('sales_point', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_performance', to='inventory.salespoint', verbose_name='Punto de venta')),
+            ],
+            options={
+                'verbose_name': 'Rendimiento de inventario',
+                'verbose_name_plural': 'Rendimiento de inventario',
+                'indexes': [models.Index(fields=['sales_point', 'abc_class'], name='inventory_perf_sp_abc_idx')],
+                'constraints': [models.UniqueConstraint(fields=('sales_point', 'product'), name='inventory_performance_sp_product')],
+            },
+        ),
+    ]
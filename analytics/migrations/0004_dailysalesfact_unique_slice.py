@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 00:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0003_inventoryperformance'),
+        ('inventory', '0004_productavailability'),
+        ('store', '0007_delete_stockmovement'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='dailysalesfact',
+            constraint=models.UniqueConstraint(fields=('day', 'sales_point', 'product'), name='daily_sales_unique_slice', nulls_distinct=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 00:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_dailysalesfact_unique_slice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleSnapshotDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True, verbose_name='Día')),
+                ('marked_at', models.DateTimeField(verbose_name='Marcado el')),
+            ],
+            options={
+                'verbose_name': 'Día de snapshot desactualizado',
+                'verbose_name_plural': 'Días de snapshot desactualizados',
+            },
+        ),
+    ]
@@ -1,3 +1,284 @@
-from django.db import models
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Count, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Window
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from inventory.models import SalesPoint, Stock
+from orders.models import OrderItem
+from purchases.models import InvoiceItem
+from store.models import Product
+from .timeseries import analytics_timezone, local_day
 
-# Create your models here.
+# Order statuses that count as a sale in analytics.
+SALES_STATUSES = ('en_proceso', 'enviado')
+# First key of the per-day advisory locks of DailySalesFact refreshes; slice
+# locks use (day ordinal, product id), which never starts with a negative number.
+DAY_LOCK_NAMESPACE = -1
+
+
+class DailySalesFactManager(models.Manager):
+    def _aggregate(self, items):
+        return (
+            items.annotate(day=TruncDate('order__created_at'))
+            .values('day', 'sales_point_id', 'product_id')
+            .annotate(
+                total_quantity=Sum('quantity'),
+                total_revenue=Sum(F('quantity') * F('price')),
+                total_cogs=Sum(F('quantity') * F('cost_price')),
+                total_orders=Count('order_id', distinct=True),
+            )
+            .order_by()
+        )
+
+    def refresh(self, days=None, product_ids=None):
+        """
+        Recomputes the facts of the given days (and products) from OrderItem;
+        with no arguments the whole table is rebuilt. Each slice is deleted and
+        re-inserted under a lock (see `_lock`), so concurrent refreshes of the
+        same slice run one after another and never double count. Days are cut
+        in ANALYTICS_TIME_ZONE.
+        """
+        with timezone.override(analytics_timezone()), transaction.atomic():
+            self._refresh(days, product_ids)
+
+    def _lock(self, days, product_ids):
+        """
+        Serializes writers of overlapping slices until the transaction ends: a
+        full rebuild locks the table, a whole-day refresh takes an exclusive
+        advisory lock on the day, and a (day, product) refresh shares the day
+        lock and holds the slice exclusively. Taken in sorted order, so two
+        refreshes cannot deadlock. Once a lock is granted, the writer that held
+        it has committed, and the aggregate below sees its order items.
+        """
+        with connection.cursor() as cursor:
+            if days is None:
+                cursor.execute(f'LOCK TABLE {self.model._meta.db_table} IN EXCLUSIVE MODE')
+                return
+            day_keys = sorted(day.toordinal() for day in days)
+            if product_ids is None:
+                for day_key in day_keys:
+                    cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [DAY_LOCK_NAMESPACE, day_key])
+                return
+            for day_key in day_keys:
+                cursor.execute('SELECT pg_advisory_xact_lock_shared(%s, %s)', [DAY_LOCK_NAMESPACE, day_key])
+            for day_key in day_keys:
+                for product_id in sorted(product_ids):
+                    cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [day_key, product_id])
+
+    def _refresh(self, days, product_ids):
+        facts = self.all()
+        items = OrderItem.objects.filter(order__status__in=SALES_STATUSES)
+        if days is not None:
+            days = set(days)
+            if not days:
+                return
+            facts = facts.filter(day__in=days)
+            items = items.filter(order__created_at__date__in=days)
+        if product_ids is not None:
+            product_ids = set(product_ids)
+            if not product_ids:
+                return
+            facts = facts.filter(product_id__in=product_ids)
+            items = items.filter(product_id__in=product_ids)
+
+        self._lock(days, product_ids)
+        facts.delete()
+        batch = []
+        for row in self._aggregate(items).iterator(chunk_size=2000):
+            batch.append(self.model(
+                day=row['day'],
+                sales_point_id=row['sales_point_id'],
+                product_id=row['product_id'],
+                quantity=row['total_quantity'],
+                revenue=row['total_revenue'],
+                cogs=row['total_cogs'],
+                order_count=row['total_orders'],
+            ))
+            if len(batch) >= 1000:
+                self.bulk_create(batch)
+                batch = []
+        if batch:
+            self.bulk_create(batch)
+
+
+class DailySalesFact(models.Model):
+    """Sales rolled up per day, sales point and product; the source of AnalyticsView."""
+    day = models.DateField(verbose_name="Día")
+    sales_point = models.ForeignKey(SalesPoint, on_delete=models.CASCADE, null=True, blank=True, related_name="daily_sales", verbose_name="Punto de venta")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="daily_sales", verbose_name="Producto")
+    quantity = models.PositiveIntegerField(default=0, verbose_name="Cantidad vendida")
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Ingresos")
+    cogs = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Costo de ventas")
+    order_count = models.PositiveIntegerField(default=0, verbose_name="Cantidad de órdenes")
+
+    objects = DailySalesFactManager()
+
+    def __str__(self):
+        return f"{self.day} - {self.product_id} @ {self.sales_point_id}: {self.quantity}"
+
+    class Meta:
+        verbose_name = "Venta diaria"
+        verbose_name_plural = "Ventas diarias"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "sales_point", "product"], name="daily_sales_unique_slice", nulls_distinct=False,
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["day", "sales_point"], name="daily_sales_day_sp_idx"),
+            models.Index(fields=["product", "day"], name="daily_sales_product_day_idx"),
+        ]
+
+
+def _sum_subquery(queryset, expression, output_field):
+    """Correlated SUM(expression) of `queryset`, 0 when it has no rows."""
+    total = queryset.order_by().values('product_id').annotate(total=Sum(expression)).values('total')
+    return Coalesce(Subquery(total, output_field=output_field), 0, output_field=output_field)
+
+
+class InventoryPerformanceManager(models.Manager):
+    def _rows(self, start_day, end_day):
+        """
+        One pass over Stock: sales of the window come from the DailySalesFact
+        rollup and receipts from processed invoices (correlated sums), and the
+        revenue total and running revenue of each sales point from window sums.
+        """
+        tz = analytics_timezone()
+        start = timezone.make_aware(datetime.combine(start_day, time.min), tz)
+        end = timezone.make_aware(datetime.combine(end_day + timedelta(days=1), time.min), tz)
+        money = DecimalField(max_digits=14, decimal_places=2)
+        facts = DailySalesFact.objects.filter(
+            sales_point_id=OuterRef('sales_point_id'), product_id=OuterRef('product_id'),
+            day__range=(start_day, end_day),
+        )
+        receipts = InvoiceItem.objects.filter(
+            invoice__sales_point_id=OuterRef('sales_point_id'), product_id=OuterRef('product_id'),
+            invoice__status='procesada', invoice__created_at__gte=start, invoice__created_at__lt=end,
+        )
+        return (
+            Stock.objects.annotate(
+                units_sold=_sum_subquery(facts, 'quantity', IntegerField()),
+                sales_revenue=_sum_subquery(facts, 'revenue', money),
+                sales_cogs=_sum_subquery(facts, 'cogs', money),
+                units_received=_sum_subquery(receipts, 'quantity', IntegerField()),
+            )
+            .annotate(
+                sales_point_revenue=Window(Sum('sales_revenue'), partition_by=[F('sales_point_id')]),
+                running_revenue=Window(
+                    Sum('sales_revenue'),
+                    partition_by=[F('sales_point_id')],
+                    order_by=[F('sales_revenue').desc(), F('product_id').asc()],
+                ),
+            )
+            .values(
+                'sales_point_id', 'product_id', 'quantity', 'units_sold', 'units_received',
+                'sales_revenue', 'sales_cogs', 'sales_point_revenue', 'running_revenue',
+            )
+            .order_by()
+        )
+
+    def _build(self, row, window_days, computed_at):
+        a_share, b_share = settings.ANALYTICS_ABC_THRESHOLDS
+        on_hand, sold, received = row['quantity'], row['units_sold'], row['units_received']
+        revenue, total = row['sales_revenue'], row['sales_point_revenue']
+        # Stock at the start of the window, ignoring returns and manual adjustments
+        opening = max(on_hand + sold - received, 0)
+        average_stock = Decimal(opening + on_hand) / 2
+        # Share of revenue ranked before this product: A while it is under the first threshold
+        ranked_before = (row['running_revenue'] - revenue) * 100 / total if total else None
+        if not revenue or ranked_before is None or ranked_before >= b_share:
+            abc_class = 'C'
+        else:
+            abc_class = 'A' if ranked_before < a_share else 'B'
+        return self.model(
+            sales_point_id=row['sales_point_id'],
+            product_id=row['product_id'],
+            window_days=window_days,
+            on_hand=on_hand,
+            units_sold=sold,
+            units_received=received,
+            revenue=revenue,
+            cogs=row['sales_cogs'],
+            sell_through=round(Decimal(sold) * 100 / (sold + on_hand), 2) if sold + on_hand else None,
+            days_of_cover=round(Decimal(on_hand) * window_days / sold, 1) if sold else None,
+            turnover=round(sold / average_stock, 2) if average_stock else None,
+            revenue_share=round(revenue * 100 / total, 2) if total else Decimal('0'),
+            abc_class=abc_class,
+            computed_at=computed_at,
+        )
+
+    def refresh(self, window_days=None):
+        """
+        Rebuilds the whole report from the last `window_days` closed days
+        (ANALYTICS_INVENTORY_WINDOW_DAYS) and current stock. The table is
+        replaced in one transaction, so readers see either the old or the new
+        report.
+        """
+        window_days = window_days or settings.ANALYTICS_INVENTORY_WINDOW_DAYS
+        computed_at = timezone.now()
+        end_day = local_day(computed_at) - timedelta(days=1)
+        start_day = end_day - timedelta(days=window_days - 1)
+        rows = [self._build(row, window_days, computed_at) for row in self._rows(start_day, end_day)]
+        # Ids follow the report order, so the API pages it by primary key.
+        rows.sort(key=lambda row: (row.sales_point_id, -row.revenue, row.product_id))
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+
+class InventoryPerformance(models.Model):
+    """Sell-through, days of cover, turnover and ABC class per product and sales point (a precomputed report)."""
+    ABC_CLASSES = [
+        ('A', 'A'),
+        ('B', 'B'),
+        ('C', 'C'),
+    ]
+
+    sales_point = models.ForeignKey(SalesPoint, on_delete=models.CASCADE, related_name="inventory_performance", verbose_name="Punto de venta")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="inventory_performance", verbose_name="Producto")
+    window_days = models.PositiveIntegerField(verbose_name="Días analizados")
+    on_hand = models.PositiveIntegerField(default=0, verbose_name="Stock actual")
+    units_sold = models.PositiveIntegerField(default=0, verbose_name="Unidades vendidas")
+    units_received = models.PositiveIntegerField(default=0, verbose_name="Unidades recibidas")
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Ingresos")
+    cogs = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Costo de ventas")
+    sell_through = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, verbose_name="Sell-through (%)")
+    days_of_cover = models.DecimalField(max_digits=10, decimal_places=1, null=True, blank=True, verbose_name="Días de cobertura")
+    turnover = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Rotación")
+    revenue_share = models.DecimalField(max_digits=5, decimal_places=2, default=0, verbose_name="Participación en ingresos (%)")
+    abc_class = models.CharField(max_length=1, choices=ABC_CLASSES, verbose_name="Clase ABC")
+    computed_at = models.DateTimeField(verbose_name="Calculado el")
+
+    objects = InventoryPerformanceManager()
+
+    def __str__(self):
+        return f"{self.product_id} @ {self.sales_point_id}: {self.abc_class}"
+
+    class Meta:
+        verbose_name = "Rendimiento de inventario"
+        verbose_name_plural = "Rendimiento de inventario"
+        constraints = [
+            models.UniqueConstraint(fields=["sales_point", "product"], name="inventory_performance_sp_product"),
+        ]
+        indexes = [
+            models.Index(fields=["sales_point", "abc_class"], name="inventory_perf_sp_abc_idx"),
+        ]
+
+
+class StaleSnapshotDay(models.Model):
+    """
+    A closed day whose rows changed after its Parquet snapshot was written; the
+    nightly export writes it again (see analytics.snapshots.mark_days_stale).
+    """
+    day = models.DateField(unique=True, verbose_name="Día")
+    marked_at = models.DateTimeField(verbose_name="Marcado el")
+
+    def __str__(self):
+        return f"{self.day} ({self.marked_at})"
+
+    class Meta:
+        verbose_name = "Día de snapshot desactualizado"
+        verbose_name_plural = "Días de snapshot desactualizados"
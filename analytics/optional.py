@@ -0,0 +1,16 @@
+import importlib
+from django.core.exceptions import ImproperlyConfigured
+
+
+def require(module):
+    """
+    Imports an optional analytics dependency (pyarrow, duckdb, pandas) on first
+    use, so the rest of the app runs without it. Raises ImproperlyConfigured
+    when it is missing; views answer 503.
+    """
+    try:
+        return importlib.import_module(module)
+    except ImportError as exc:
+        raise ImproperlyConfigured(
+            f"This analytics report needs the '{module.split('.')[0]}' package (see requirements.txt)."
+        ) from exc
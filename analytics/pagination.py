@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class InventoryPerformanceCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the inventory performance report.
+
+    InventoryPerformance.objects.refresh inserts the rows by sales point and
+    descending revenue, so paging by the primary key walks the report in that
+    order with one index range scan per page.
+    """
+    ordering = "id"
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 500
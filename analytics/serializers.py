@@ -0,0 +1,29 @@
+from rest_framework import serializers
+from .models import InventoryPerformance
+
+
+class InventoryPerformanceSerializer(serializers.ModelSerializer):
+    """Serializer for InventoryPerformance report rows"""
+    product_name = serializers.CharField(source="product.name", read_only=True)
+    sales_point_name = serializers.CharField(source="sales_point.name", read_only=True)
+
+    class Meta:
+        model = InventoryPerformance
+        fields = [
+            "product",
+            "product_name",
+            "sales_point",
+            "sales_point_name",
+            "window_days",
+            "on_hand",
+            "units_sold",
+            "units_received",
+            "revenue",
+            "cogs",
+            "sell_through",
+            "days_of_cover",
+            "turnover",
+            "revenue_share",
+            "abc_class",
+            "computed_at",
+        ]
@@ -0,0 +1,72 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from orders.models import Order, OrderItem
+from purchases.models import Invoice, InvoiceItem
+from analytics.cache import bump_versions, invalidate_buckets
+from analytics.cohorts import invalidate_cohorts
+from analytics.models import DailySalesFact, SALES_STATUSES
+from analytics.snapshots import mark_days_stale
+from analytics.timeseries import local_day
+
+
+@receiver(post_save, sender=Order)
+def refresh_sales_facts_on_order_save(sender, instance, created, update_fields=None, **kwargs):
+    """
+    ✅ Пересчитывает `DailySalesFact` заказа при смене статуса (вход в продажи или выход из них)
+    и сбрасывает кэш аналитики затронутых точек продаж.
+    """
+    if created and instance.status not in SALES_STATUSES:
+        return
+    if update_fields is not None and "status" not in update_fields:
+        return
+    items = list(instance.items.all())
+    day = local_day(instance.created_at)
+    sales_point_ids = {item.sales_point_id for item in items}
+    DailySalesFact.objects.refresh([day], {item.product_id for item in items})
+    invalidate_buckets("sales", [day], sales_point_ids)
+    invalidate_cohorts([day], sales_point_ids)
+    mark_days_stale([day])
+    bump_versions(sales_point_ids)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def refresh_sales_facts_on_item_change(sender, instance, **kwargs):
+    """
+    ✅ Пересчитывает день и товар позиции, если она относится к уже учтённому заказу.
+    """
+    order = instance.order
+    if order.status in SALES_STATUSES:
+        day = local_day(order.created_at)
+        DailySalesFact.objects.refresh([day], [instance.product_id])
+        invalidate_buckets("sales", [day], [instance.sales_point_id])
+        invalidate_cohorts([day], [instance.sales_point_id])
+        mark_days_stale([day])
+        bump_versions([instance.sales_point_id])
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def invalidate_analytics_on_invoice_change(sender, instance, **kwargs):
+    """
+    ✅ Обработка, аннулирование или удаление счёта меняет закупки и остатки в аналитике.
+    """
+    day = local_day(instance.created_at)
+    invalidate_buckets("purchases", [day], [instance.sales_point_id])
+    mark_days_stale([day])
+    bump_versions([instance.sales_point_id])
+
+
+@receiver(post_save, sender=InvoiceItem)
+@receiver(post_delete, sender=InvoiceItem)
+def invalidate_analytics_on_invoice_item_change(sender, instance, origin=None, **kwargs):
+    """
+    ✅ Позиции обработанного счёта входят в расходы на закупки (каскадное удаление покрывает сам счёт).
+    """
+    if isinstance(origin, Invoice) or getattr(origin, "model", None) is Invoice:
+        return
+    invoice = instance.invoice
+    day = local_day(invoice.created_at)
+    invalidate_buckets("purchases", [day], [invoice.sales_point_id])
+    mark_days_stale([day])
+    bump_versions([invoice.sales_point_id])
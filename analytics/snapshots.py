@@ -0,0 +1,296 @@
+"""
+Columnar snapshots of closed analytics days.
+
+Order, order line and invoice line rows are written once per local day as
+hive-style Parquet partitions under ANALYTICS_SNAPSHOT_DIR:
+
+    <dir>/<table>/day=YYYY-MM-DD/data.parquet
+
+Long-horizon reports (multi-year trends, product mix) are answered from these
+files with DuckDB instead of the OLTP database. pyarrow and duckdb are only
+imported when a snapshot is written or queried, so web workers that never touch
+them do not need them installed.
+"""
+import os
+import shutil
+import tempfile
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+from orders.models import Order, OrderItem
+from purchases.models import Invoice, InvoiceItem
+from analytics.models import SALES_STATUSES, StaleSnapshotDay
+from analytics.optional import require
+from analytics.timeseries import analytics_timezone, iter_bucket_starts, local_day
+
+# table -> (model, datetime lookup that assigns the row to a day, ((column, lookup, type), ...))
+SNAPSHOT_TABLES = {
+    "orders": (Order, "created_at", (
+        ("order_id", "id", "int64"),
+        ("user_id", "user_id", "int64"),
+        ("status", "status", "string"),
+        ("payment_method", "payment_method", "string"),
+        ("total_price", "total_price", "decimal"),
+        ("total_cost_price", "total_cost_price", "decimal"),
+        ("created_at", "created_at", "timestamp"),
+    )),
+    "order_items": (OrderItem, "order__created_at", (
+        ("item_id", "id", "int64"),
+        ("order_id", "order_id", "int64"),
+        ("user_id", "order__user_id", "int64"),
+        ("status", "order__status", "string"),
+        ("product_id", "product_id", "int64"),
+        ("sales_point_id", "sales_point_id", "int64"),
+        ("quantity", "quantity", "int64"),
+        ("price", "price", "decimal"),
+        ("cost_price", "cost_price", "decimal"),
+        ("created_at", "order__created_at", "timestamp"),
+    )),
+    "invoice_items": (InvoiceItem, "invoice__created_at", (
+        ("item_id", "id", "int64"),
+        ("invoice_id", "invoice_id", "int64"),
+        ("status", "invoice__status", "string"),
+        ("product_id", "product_id", "int64"),
+        ("sales_point_id", "invoice__sales_point_id", "int64"),
+        ("quantity", "quantity", "int64"),
+        ("cost_per_item", "cost_per_item", "decimal"),
+        ("created_at", "invoice__created_at", "timestamp"),
+    )),
+}
+
+# Column types as DuckDB spells them; used for the empty views of tables with no partitions yet.
+_DUCKDB_TYPES = {
+    "int64": "BIGINT",
+    "string": "VARCHAR",
+    "decimal": "DECIMAL(12, 2)",
+    "timestamp": "TIMESTAMPTZ",
+}
+
+HISTORY_GRANULARITIES = ("day", "week", "month")
+_SALES_PLACEHOLDERS = ", ".join("?" for _ in SALES_STATUSES)
+
+
+def _arrow_type(pa, kind):
+    if kind == "decimal":
+        return pa.decimal128(12, 2)
+    if kind == "timestamp":
+        return pa.timestamp("us", tz="UTC")
+    return pa.int64() if kind == "int64" else pa.string()
+
+
+def partition_path(table, day):
+    return os.path.join(settings.ANALYTICS_SNAPSHOT_DIR, table, f"day={day.isoformat()}")
+
+
+def is_exported(day):
+    return all(os.path.isdir(partition_path(table, day)) for table in SNAPSHOT_TABLES)
+
+
+def _day_bounds(day):
+    tz = analytics_timezone()
+    start = timezone.make_aware(datetime.combine(day, time.min), tz)
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min), tz)
+    return start, end
+
+
+def _replace_dir(staging, target):
+    """Swaps the freshly written partition in, so readers never see a half-written day."""
+    if os.path.isdir(target):
+        retired = f"{staging}.old"
+        os.rename(target, retired)
+        os.rename(staging, target)
+        shutil.rmtree(retired)
+    else:
+        os.rename(staging, target)
+
+
+def export_day(day):
+    """Writes every snapshot table for one local day, replacing any previous export of it."""
+    pa = require("pyarrow")
+    pq = require("pyarrow.parquet")
+    chunk_size = settings.ANALYTICS_EXPORT_CHUNK_SIZE
+    start, end = _day_bounds(day)
+
+    for table, (model, date_lookup, columns) in SNAPSHOT_TABLES.items():
+        schema = pa.schema([(name, _arrow_type(pa, kind)) for name, _, kind in columns])
+        rows = (
+            model._default_manager.filter(**{f"{date_lookup}__gte": start, f"{date_lookup}__lt": end})
+            .order_by("id")
+            .values_list(*(lookup for _, lookup, _ in columns))
+            .iterator(chunk_size=chunk_size)
+        )
+        target = partition_path(table, day)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=os.path.dirname(target))
+        try:
+            with pq.ParquetWriter(os.path.join(staging, "data.parquet"), schema) as writer:
+                batch = []
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) >= chunk_size:
+                        writer.write_batch(_record_batch(pa, schema, batch))
+                        batch = []
+                if batch:
+                    writer.write_batch(_record_batch(pa, schema, batch))
+            _replace_dir(staging, target)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+
+def _record_batch(pa, schema, rows):
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+        schema=schema,
+    )
+
+
+def _first_day():
+    firsts = [
+        value for value in (
+            Order.objects.aggregate(first=Min("created_at"))["first"],
+            Invoice.objects.aggregate(first=Min("created_at"))["first"],
+        ) if value
+    ]
+    return local_day(min(firsts)) if firsts else None
+
+
+def export_closed_days(start=None, end=None, force=False):
+    """
+    Exports every closed day in [start, end] (defaults: first order or
+    invoice, yesterday) that has no complete snapshot yet or was marked stale
+    by a late write, or all of them with `force`. Returns the exported days.
+    """
+    yesterday = local_day(timezone.now()) - timedelta(days=1)
+    end = min(end or yesterday, yesterday)
+    start = start or _first_day()
+    exported = []
+    if start is None:
+        return exported
+    stale = set(StaleSnapshotDay.objects.filter(day__range=(start, end)).values_list("day", flat=True))
+    day = start
+    while day <= end:
+        if force or day in stale or not is_exported(day):
+            _export_marked_day(day)
+            exported.append(day)
+        day += timedelta(days=1)
+    return exported
+
+
+def _export_marked_day(day):
+    # The mark is cleared before the export reads the day: a write that marked
+    # the day in a still-open transaction makes this DELETE wait for its commit,
+    # and one that marks it afterwards leaves the day stale for the next run.
+    StaleSnapshotDay.objects.filter(day=day).delete()
+    try:
+        export_day(day)
+    except BaseException:
+        mark_days_stale([day])
+        raise
+
+
+def mark_days_stale(days):
+    """
+    Marks the snapshots of closed days whose rows changed after they were
+    exported (late status changes, edited invoices) for the next nightly
+    export. The mark is a row written in the caller's transaction, so a rollback
+    drops it too, and no files are touched while the request runs. Until the
+    export, history reports still read the previous snapshot of those days.
+    """
+    today = local_day(timezone.now())
+    marked_at = timezone.now()
+    StaleSnapshotDay.objects.bulk_create(
+        [StaleSnapshotDay(day=day, marked_at=marked_at) for day in set(days) if day < today],
+        update_conflicts=True, unique_fields=["day"], update_fields=["marked_at"],
+    )
+
+
+def connect():
+    """In-memory DuckDB connection with one view per snapshot table (plus its `day` partition column)."""
+    duckdb = require("duckdb")
+    connection = duckdb.connect()
+    for table, (_, _, columns) in SNAPSHOT_TABLES.items():
+        table_dir = os.path.join(settings.ANALYTICS_SNAPSHOT_DIR, table)
+        if os.path.isdir(table_dir) and any(entry.name.startswith("day=") for entry in os.scandir(table_dir)):
+            pattern = os.path.join(table_dir, "day=*", "*.parquet").replace("'", "''")
+            source = f"read_parquet('{pattern}', hive_partitioning = true, hive_types = {{'day': DATE}})"
+        else:
+            typed = ", ".join(f"CAST(NULL AS {_DUCKDB_TYPES[kind]}) AS {name}" for name, _, kind in columns)
+            source = f"(SELECT {typed}, CAST(NULL AS DATE) AS day WHERE false)"
+        connection.execute(f"CREATE VIEW {table} AS SELECT * FROM {source}")
+    return connection
+
+
+def _scope_clause(sales_point_id, params):
+    if sales_point_id is None:
+        return ""
+    params.append(int(sales_point_id))
+    return " AND sales_point_id = ?"
+
+
+def history_series(start_day, end_day, granularity="month", sales_point_id=None):
+    """
+    Gap-filled sales, purchases and profit per bucket over the snapshots, in
+    the same shape as AnalyticsView's `time_series`.
+    """
+    if granularity not in HISTORY_GRANULARITIES:
+        raise ValueError(f"granularity must be one of {HISTORY_GRANULARITIES}")
+    connection = connect()
+    try:
+        params = [start_day, end_day, *SALES_STATUSES]
+        scope = _scope_clause(sales_point_id, params)
+        sales = {
+            bucket: (revenue, profit)
+            for bucket, revenue, profit in connection.execute(f"""
+                SELECT CAST(date_trunc('{granularity}', day) AS DATE),
+                       SUM(quantity * price), SUM(quantity * (price - cost_price))
+                FROM order_items
+                WHERE day BETWEEN ? AND ? AND status IN ({_SALES_PLACEHOLDERS}){scope}
+                GROUP BY 1
+            """, params).fetchall()
+        }
+        params = [start_day, end_day]
+        scope = _scope_clause(sales_point_id, params)
+        purchases = dict(connection.execute(f"""
+            SELECT CAST(date_trunc('{granularity}', day) AS DATE), SUM(quantity * cost_per_item)
+            FROM invoice_items
+            WHERE day BETWEEN ? AND ? AND status = 'procesada'{scope}
+            GROUP BY 1
+        """, params).fetchall())
+    finally:
+        connection.close()
+
+    buckets = list(iter_bucket_starts(start_day, end_day, granularity))
+    zero = (0, 0)
+    return {
+        "granularity": granularity,
+        "timestamps": [bucket.isoformat() for bucket in buckets],
+        "sales": [sales.get(bucket, zero)[0] for bucket in buckets],
+        "purchases": [purchases.get(bucket, 0) for bucket in buckets],
+        "profit": [sales.get(bucket, zero)[1] for bucket in buckets],
+    }
+
+
+def product_mix(start_day, end_day, sales_point_id=None, limit=20):
+    """Products ranked by revenue over the snapshots, with their share of the total revenue."""
+    connection = connect()
+    try:
+        params = [start_day, end_day, *SALES_STATUSES]
+        scope = _scope_clause(sales_point_id, params)
+        params.append(limit)
+        rows = connection.execute(f"""
+            SELECT product_id, SUM(quantity), SUM(quantity * price) AS revenue,
+                   SUM(quantity * price) * 100 / SUM(SUM(quantity * price)) OVER () AS share
+            FROM order_items
+            WHERE day BETWEEN ? AND ? AND status IN ({_SALES_PLACEHOLDERS}){scope}
+            GROUP BY product_id
+            ORDER BY revenue DESC, product_id
+            LIMIT ?
+        """, params).fetchall()
+    finally:
+        connection.close()
+    return [
+        {"product_id": product_id, "quantity": int(quantity), "revenue": revenue, "share_pct": round(share, 2)}
+        for product_id, quantity, revenue, share in rows
+    ]
@@ -0,0 +1,20 @@
+from celery import shared_task
+
+
+@shared_task
+def export_analytics_snapshots():
+    """
+    Writes the Parquet snapshots of every closed day that is not exported yet
+    (new days plus days marked stale by late writes). Returns the number of days written.
+    """
+    from .snapshots import export_closed_days
+
+    return len(export_closed_days())
+
+
+@shared_task
+def refresh_inventory_performance():
+    """Rebuilds the InventoryPerformance report from current stock and recent sales. Returns the number of rows."""
+    from .models import InventoryPerformance
+
+    return InventoryPerformance.objects.refresh()
@@ -0,0 +1,512 @@
+import pytest
+import json
+import threading
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from django.core.management import call_command
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from analytics import snapshots
+from analytics.cache import bump_versions, reset_buckets
+from analytics.cohorts import last_closed_month
+from analytics.concurrency import run_concurrently
+from analytics.models import DailySalesFact, InventoryPerformance, StaleSnapshotDay
+from analytics.timeseries import analytics_timezone, local_day, split_buckets
+from inventory.models import SalesPoint, Stock
+from orders.models import Order, OrderItem
+from store.models import Product
+from users.models import CustomUser
+
+
+@pytest.fixture
+def sales_point(db):
+    return SalesPoint.objects.create(name="Analytics Store")
+
+
+@pytest.fixture
+def products(db):
+    return [Product.objects.create(name=f"Analytics Product {i}", price=100) for i in range(2)]
+
+
+@pytest.fixture
+def customer(db):
+    return CustomUser.objects.create_user(username="analytics_customer", password="pass1234")
+
+
+def make_order(user, sales_point, lines, status="pendiente"):
+    order = Order.objects.create(user=user, total_price=0, status="pendiente")
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, sales_point=sales_point, quantity=quantity, price=price, cost_price=cost)
+        for product, quantity, price, cost in lines
+    ])
+    if status != "pendiente":
+        order.status = status
+        order.save()
+    return order
+
+
+@pytest.mark.django_db
+def test_sales_facts_follow_order_status(customer, sales_point, products):
+    """✅ DailySalesFact se actualiza cuando la orden entra o sale de los estados de venta"""
+    order = make_order(customer, sales_point, [(products[0], 2, Decimal("100"), Decimal("60"))])
+    facts = DailySalesFact.objects.filter(sales_point=sales_point)
+    assert not facts.exists()
+
+    order.status = "en_proceso"
+    order.save()
+    make_order(customer, sales_point, [(products[0], 1, Decimal("100"), Decimal("60")),
+                                       (products[1], 3, Decimal("50"), Decimal("20"))], status="enviado")
+
+    fact = facts.get(product=products[0])
+    assert fact.day == local_day(timezone.now())
+    assert fact.quantity == 3
+    assert fact.revenue == Decimal("300")
+    assert fact.cogs == Decimal("180")
+    assert fact.order_count == 2
+    assert facts.get(product=products[1]).revenue == Decimal("150")
+
+    order.status = "cancelado"
+    order.save()
+    assert facts.get(product=products[0]).quantity == 1
+
+
+@pytest.mark.django_db
+def test_rebuild_daily_sales_facts_command(customer, sales_point, products):
+    """✅ El comando reconstruye los hechos a partir de las órdenes"""
+    make_order(customer, sales_point, [(products[0], 4, Decimal("10"), Decimal("5"))], status="en_proceso")
+    DailySalesFact.objects.filter(sales_point=sales_point).delete()
+
+    today = local_day(timezone.now()).isoformat()
+    call_command("rebuild_daily_sales_facts", "--start", today, "--end", today)
+
+    fact = DailySalesFact.objects.get(sales_point=sales_point, product=products[0])
+    assert (fact.quantity, fact.revenue, fact.order_count) == (4, Decimal("40"), 1)
+
+
+@pytest.mark.django_db
+def test_analytics_view_reads_sales_facts(customer, sales_point, products):
+    """✅ KPIs, series y rankings de AnalyticsView salen de DailySalesFact"""
+    make_order(customer, sales_point, [(products[0], 2, Decimal("100"), Decimal("60")),
+                                       (products[1], 1, Decimal("50"), Decimal("10"))], status="en_proceso")
+    admin = CustomUser.objects.create_user(username="analytics_admin", password="pass1234", role=CustomUser.Role.ADMIN)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+
+    response = client.get(reverse("analytics"), {"sales_point_id": sales_point.id, "time_filter": "month"})
+
+    assert response.status_code == 200
+    kpis = response.data["kpis"]
+    assert kpis["total_revenue"]["value"] == Decimal("250")
+    assert kpis["total_cost_of_goods_sold"]["value"] == Decimal("130")
+    assert kpis["total_orders"]["value"] == 1
+    series = response.data["time_series"]
+    assert series["granularity"] == "day"
+    assert len(series["timestamps"]) == len(series["sales"]) == len(series["profit"]) == 31
+    assert series["timestamps"][-1] == local_day(timezone.now()).isoformat()
+    assert series["sales"][-1] == Decimal("250")
+    assert series["profit"][-1] == Decimal("120")
+    assert sum(series["sales"][:-1]) == 0
+    assert response.data["top_lists"]["sold_products"][0] == {"product__name": products[0].name, "total_quantity": 2}
+    assert response.data["top_lists"]["profitable_products"][0]["total_profit"] == Decimal("80")
+
+
+@pytest.mark.django_db
+def test_analytics_cache_is_scoped_and_follows_writes(
+    customer, sales_point, products, django_capture_on_commit_callbacks,
+):
+    """✅ El caché separa los alcances por rol/punto de venta y se invalida con los cambios de órdenes"""
+    other_point = SalesPoint.objects.create(name="Other Analytics Store")
+    make_order(customer, sales_point, [(products[0], 1, Decimal("100"), Decimal("60"))], status="en_proceso")
+    make_order(customer, other_point, [(products[1], 1, Decimal("40"), Decimal("10"))], status="en_proceso")
+
+    admin = CustomUser.objects.create_user(username="analytics_admin", password="pass1234", role=CustomUser.Role.ADMIN)
+    store_admin = CustomUser.objects.create_user(
+        username="analytics_store_admin", password="pass1234",
+        role=CustomUser.Role.STORE_ADMIN, sales_point=other_point,
+    )
+    url = reverse("analytics")
+    params = {"sales_point_id": sales_point.id, "time_filter": "week"}
+
+    def revenue(user):
+        client = APIClient()
+        client.force_authenticate(user=user)
+        response = client.get(url, params)
+        assert response.status_code == 200
+        return response.data["kpis"]["total_revenue"]["value"]
+
+    # Same URL, different effective scope: a store admin only ever sees their own sales point.
+    assert revenue(admin) == Decimal("100")
+    assert revenue(store_admin) == Decimal("40")
+
+    order = make_order(customer, sales_point, [(products[0], 2, Decimal("100"), Decimal("60"))])
+    assert revenue(admin) == Decimal("100")
+    order.status = "en_proceso"
+    with django_capture_on_commit_callbacks(execute=True):
+        order.save()
+    assert revenue(admin) == Decimal("300")
+    assert revenue(store_admin) == Decimal("40")
+
+
+def test_split_buckets_keeps_open_and_partial_buckets_live():
+    """✅ Solo los periodos cerrados y completos dentro del rango se cachean"""
+    monday = date(2026, 3, 2)
+    closed, live = split_buckets(monday, monday + timedelta(days=13), "week", today=monday + timedelta(days=10))
+    assert closed == [monday]
+    assert live == [(monday + timedelta(days=7), monday + timedelta(days=13))]
+
+    closed, live = split_buckets(date(2026, 1, 15), date(2026, 3, 31), "month", today=date(2026, 6, 1))
+    assert closed == [date(2026, 2, 1), date(2026, 3, 1)]
+    assert live == [(date(2026, 1, 15), date(2026, 1, 31))]
+
+
+@pytest.mark.django_db
+def test_closed_day_buckets_are_cached_until_their_day_changes(
+    customer, sales_point, products, django_capture_on_commit_callbacks,
+):
+    """✅ Los días cerrados se leen del caché y se invalidan cuando cambia una orden de ese día"""
+    order = make_order(customer, sales_point, [(products[0], 1, Decimal("100"), Decimal("60"))], status="en_proceso")
+    yesterday = local_day(timezone.now()) - timedelta(days=1)
+    Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=1))
+    DailySalesFact.objects.refresh([yesterday, local_day(timezone.now())], [products[0].id])
+
+    admin = CustomUser.objects.create_user(username="analytics_admin", password="pass1234", role=CustomUser.Role.ADMIN)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    params = {
+        "sales_point_id": sales_point.id,
+        "start_date": (yesterday - timedelta(days=3)).isoformat(),
+        "end_date": local_day(timezone.now()).isoformat(),
+    }
+
+    def sales():
+        series = client.get(reverse("analytics"), params).data["time_series"]
+        return {day: value for day, value in zip(series["timestamps"], series["sales"]) if value}
+
+    assert sales() == {yesterday.isoformat(): Decimal("100")}
+
+    # A silent change to a closed day is not seen: the bucket is served from the cache.
+    DailySalesFact.objects.filter(sales_point=sales_point, day=yesterday).update(revenue=Decimal("999"))
+    with django_capture_on_commit_callbacks(execute=True):
+        bump_versions([sales_point.id])
+    assert sales() == {yesterday.isoformat(): Decimal("100")}
+
+    order.refresh_from_db()
+    order.status = "cancelado"
+    with django_capture_on_commit_callbacks(execute=True):
+        order.save()
+        # Nothing is invalidated before the write commits, so no reader can cache the old data again
+        assert sales() == {yesterday.isoformat(): Decimal("100")}
+    assert sales() == {}
+
+
+@pytest.mark.django_db
+def test_analytics_granularity_fills_gaps_in_local_time(customer, sales_point, products):
+    """✅ granularity=hour|week|month devuelve todos los periodos, vacíos incluidos, en hora de Buenos Aires"""
+    make_order(customer, sales_point, [(products[0], 1, Decimal("100"), Decimal("60"))], status="en_proceso")
+    admin = CustomUser.objects.create_user(username="analytics_admin", password="pass1234", role=CustomUser.Role.ADMIN)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    today = local_day(timezone.now())
+
+    def series(**params):
+        response = client.get(reverse("analytics"), {"sales_point_id": sales_point.id, **params})
+        assert response.status_code == 200
+        return response.data["time_series"]
+
+    monthly = series(granularity="month", start_date=date(today.year - 1, today.month, 1).isoformat(), end_date=today.isoformat())
+    assert len(monthly["timestamps"]) == 13
+    assert monthly["timestamps"][-1] == today.replace(day=1).isoformat()
+    assert monthly["sales"] == [0] * 12 + [Decimal("100")]
+
+    weekly = series(granularity="week", start_date=(today - timedelta(days=20)).isoformat(), end_date=today.isoformat())
+    assert weekly["timestamps"][-1] == (today - timedelta(days=today.weekday())).isoformat()
+    assert weekly["sales"][-1] == Decimal("100")
+
+    hourly = series(granularity="hour", start_date=today.isoformat(), end_date=today.isoformat())
+    assert len(hourly["timestamps"]) == 24
+    assert hourly["timestamps"][0] == f"{today.isoformat()}T00:00:00-03:00"
+    assert sum(hourly["sales"]) == Decimal("100")
+
+    assert client.get(reverse("analytics"), {"granularity": "minute"}).status_code == 400
+    assert client.get(reverse("analytics"), {"granularity": "hour", "start_date": "2025-01-01", "end_date": "2025-12-31"}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_analytics_report_query_count_does_not_grow_with_range(sales_point, products, django_assert_num_queries):
+    """✅ Benchmark: un informe sin caché hace 6 consultas agrupadas (antes 9), sea de 1 día o de 12 meses, comparación incluida"""
+    today = local_day(timezone.now())
+    DailySalesFact.objects.bulk_create([
+        DailySalesFact(day=today - timedelta(days=offset), sales_point=sales_point, product=product,
+                       quantity=1, revenue=Decimal("10"), cogs=Decimal("4"), order_count=1)
+        for offset in range(400)
+        for product in products
+    ])
+    admin = CustomUser.objects.create_user(username="analytics_admin", password="pass1234", role=CustomUser.Role.ADMIN)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+
+    for start in (today, today - timedelta(days=364)):
+        reset_buckets()  # cold bucket cache: every bucket is computed
+        with django_assert_num_queries(6):
+            response = client.get(reverse("analytics"), {
+                "sales_point_id": sales_point.id, "start_date": start.isoformat(), "end_date": today.isoformat(),
+            })
+        days = (today - start).days + 1
+        assert response.data["kpis"]["total_revenue"]["value"] == Decimal("20") * days
+        assert sum(response.data["time_series"]["sales"]) == Decimal("20") * days
+
+
+def test_run_concurrently_keeps_task_order_and_time_zone(settings):
+    """✅ Las tareas independientes corren en hilos, conservan el orden y la zona horaria activa"""
+    settings.ANALYTICS_QUERY_WORKERS = 3
+    with timezone.override(analytics_timezone()):
+        results = run_concurrently([
+            lambda: 1,
+            lambda: timezone.get_current_timezone_name(),
+            lambda: threading.current_thread() is not threading.main_thread(),
+        ])
+    assert results == [1, "America/Argentina/Buenos_Aires", True]
+
+
+@pytest.mark.django_db
+def test_analytics_kpis_compare_with_previous_window(customer, sales_point, products):
+    """✅ Cada KPI trae el valor del periodo anterior equivalente y la variación porcentual"""
+    today = local_day(timezone.now())
+    DailySalesFact.objects.bulk_create([
+        DailySalesFact(day=today - timedelta(days=1), sales_point=sales_point, product=products[0],
+                       quantity=3, revenue=Decimal("150"), cogs=Decimal("90"), order_count=1),
+        # Previous window (the 2 days before): only products[1] sold
+        DailySalesFact(day=today - timedelta(days=3), sales_point=sales_point, product=products[1],
+                       quantity=1, revenue=Decimal("100"), cogs=Decimal("40"), order_count=1),
+    ])
+    admin = CustomUser.objects.create_user(username="analytics_admin", password="pass1234", role=CustomUser.Role.ADMIN)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+
+    response = client.get(reverse("analytics"), {
+        "sales_point_id": sales_point.id,
+        "start_date": (today - timedelta(days=1)).isoformat(),
+        "end_date": today.isoformat(),
+    })
+
+    kpis = response.data["kpis"]
+    assert kpis["total_revenue"] == {"value": Decimal("150"), "previous": Decimal("100"), "delta_pct": Decimal("50.00")}
+    assert kpis["net_profit"] == {"value": Decimal("60"), "previous": Decimal("60"), "delta_pct": Decimal("0.00")}
+    assert kpis["total_orders"] == {"value": 0, "previous": 0, "delta_pct": None}
+    assert kpis["low_stock_count"] == {"value": 0, "previous": None, "delta_pct": None}
+    # Low stock is read live, next to the cached report
+    Stock.objects.create(product=products[0], sales_point=sales_point, quantity=1, low_stock_threshold=5)
+    cached = client.get(reverse("analytics"), {
+        "sales_point_id": sales_point.id,
+        "start_date": (today - timedelta(days=1)).isoformat(),
+        "end_date": today.isoformat(),
+    })
+    assert cached.data["kpis"]["total_revenue"] == kpis["total_revenue"]
+    assert cached.data["kpis"]["low_stock_count"]["value"] == 1
+    # products[1] only sold in the previous window, so it is not ranked
+    assert [row["product__name"] for row in response.data["top_lists"]["sold_products"]] == [products[0].name]
+    assert [row["product__name"] for row in response.data["top_lists"]["profitable_products"]] == [products[0].name]
+
+
+@pytest.mark.django_db
+def test_analytics_export_streams_scoped_order_lines(customer, sales_point, products, settings):
+    """✅ La exportación transmite las líneas de venta del alcance del usuario en CSV o NDJSON"""
+    settings.ANALYTICS_EXPORT_CHUNK_SIZE = 1
+    other_point = SalesPoint.objects.create(name="Other Analytics Store")
+    order = make_order(customer, sales_point, [(products[0], 2, Decimal("100"), Decimal("60")),
+                                               (products[1], 1, Decimal("50"), Decimal("10"))], status="en_proceso")
+    make_order(customer, other_point, [(products[1], 5, Decimal("40"), Decimal("10"))], status="en_proceso")
+    make_order(customer, sales_point, [(products[1], 7, Decimal("40"), Decimal("10"))])
+    store_admin = CustomUser.objects.create_user(
+        username="analytics_store_admin", password="pass1234",
+        role=CustomUser.Role.STORE_ADMIN, sales_point=sales_point,
+    )
+    client = APIClient()
+    client.force_authenticate(user=store_admin)
+    url = reverse("analytics_export")
+
+    response = client.get(url, {"time_filter": "week", "sales_point_id": other_point.id})
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/csv")
+    assert response["Content-Disposition"].startswith('attachment; filename="ventas_')
+    rows = b"".join(response.streaming_content).decode().splitlines()
+    assert rows[0] == "created_at,order_id,customer,product_id,product,sales_point_id,sales_point,quantity,price,cost_price"
+    # Store admins are pinned to their own sales point; pending orders are not sales
+    assert len(rows) == 3
+    assert rows[1].split(",")[1:] == [str(order.id), customer.username, str(products[0].id), products[0].name,
+                                      str(sales_point.id), sales_point.name, "2", "100.00", "60.00"]
+
+    response = client.get(url, {"time_filter": "week", "file_format": "ndjson"})
+    lines = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+    assert [line["quantity"] for line in lines] == [2, 1]
+    assert lines[0]["created_at"] == timezone.localtime(order.created_at, analytics_timezone()).isoformat()
+    assert lines[1]["price"] == "50.00"
+
+    assert client.get(url, {"file_format": "xlsx"}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_late_writes_mark_closed_day_snapshots_stale(customer, sales_point, products, settings, tmp_path):
+    """✅ Un cambio tardío en un día cerrado lo marca para que la exportación nocturna lo vuelva a escribir"""
+    pytest.importorskip("pyarrow")
+    settings.ANALYTICS_SNAPSHOT_DIR = str(tmp_path)
+    order = make_order(customer, sales_point, [(products[0], 1, Decimal("100"), Decimal("60"))])
+    Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=3))
+    order.refresh_from_db()
+    day = local_day(order.created_at)
+    assert day in snapshots.export_closed_days(start=day)
+    assert snapshots.export_closed_days(start=day) == []
+
+    # A rolled back write leaves the snapshot alone
+    with pytest.raises(RuntimeError), transaction.atomic():
+        order.status = "en_proceso"
+        order.save()
+        raise RuntimeError
+    assert not StaleSnapshotDay.objects.filter(day=day).exists()
+
+    order.status = "en_proceso"
+    order.save()
+
+    assert snapshots.is_exported(day)
+    assert StaleSnapshotDay.objects.filter(day=day).exists()
+    assert snapshots.export_closed_days(start=day) == [day]
+    assert not StaleSnapshotDay.objects.filter(day=day).exists()
+
+
+@pytest.mark.django_db
+def test_history_is_answered_from_snapshots(customer, sales_point, products, settings, tmp_path):
+    """✅ La analítica histórica lee las particiones Parquet de los días cerrados, no la base de datos"""
+    pytest.importorskip("pyarrow")
+    pytest.importorskip("duckdb")
+    settings.ANALYTICS_SNAPSHOT_DIR = str(tmp_path)
+    order = make_order(customer, sales_point, [(products[0], 2, Decimal("100"), Decimal("60")),
+                                               (products[1], 1, Decimal("50"), Decimal("10"))], status="en_proceso")
+    Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=2))
+    make_order(customer, sales_point, [(products[1], 9, Decimal("50"), Decimal("10"))], status="en_proceso")
+    day = local_day(timezone.now()) - timedelta(days=2)
+
+    exported = snapshots.export_closed_days(start=day)
+    assert exported == [day, day + timedelta(days=1)]
+    assert snapshots.export_closed_days(start=day) == []
+    # Once exported, the database is no longer read for the closed days
+    OrderItem.objects.filter(order=order).update(quantity=100)
+
+    admin = CustomUser.objects.create_user(username="analytics_admin", password="pass1234", role=CustomUser.Role.ADMIN)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    response = client.get(reverse("analytics_history"), {
+        "start_date": day.isoformat(), "granularity": "day", "sales_point_id": sales_point.id,
+    })
+
+    assert response.status_code == 200
+    series = response.data["time_series"]
+    assert series["timestamps"] == [day.isoformat(), (day + timedelta(days=1)).isoformat()]
+    assert series["sales"] == [Decimal("250"), 0]
+    assert series["profit"] == [Decimal("120"), 0]
+    mix = response.data["product_mix"]
+    assert [(row["product__name"], row["quantity"]) for row in mix] == [(products[0].name, 2), (products[1].name, 1)]
+    assert mix[0]["share_pct"] == 80
+
+
+@pytest.mark.django_db
+def test_cohorts_track_retention_and_follow_late_sales(
+    customer, sales_point, products, django_capture_on_commit_callbacks,
+):
+    """✅ Cohortes mensuales: retención, recompra y LTV; el caché del mes cerrado cae con ventas tardías"""
+    pytest.importorskip("pandas")
+    reset_buckets()
+    closed = last_closed_month()
+    previous = closed.replace(day=1) - timedelta(days=1)
+    tz = analytics_timezone()
+
+    def sale(user, day, price):
+        order = make_order(user, sales_point, [(products[0], 1, Decimal(price), Decimal("1"))])
+        Order.objects.filter(id=order.id).update(
+            created_at=timezone.make_aware(datetime.combine(day.replace(day=15), time(12)), tz)
+        )
+        order.refresh_from_db()
+        order.status = "en_proceso"
+        order.save()
+        return order
+
+    other = CustomUser.objects.create_user(username="analytics_other", password="pass1234")
+    sale(customer, previous, "100")
+    sale(customer, closed, "50")
+    sale(other, closed, "30")
+    sale(other, closed, "30")
+    make_order(customer, sales_point, [(products[0], 1, Decimal("999"), Decimal("1"))], status="en_proceso")
+
+    admin = CustomUser.objects.create_user(username="analytics_admin", password="pass1234", role=CustomUser.Role.ADMIN)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    response = client.get(reverse("analytics_cohorts"), {"sales_point_id": sales_point.id})
+
+    assert response.status_code == 200
+    assert response.data["through"] == closed.strftime("%Y-%m")
+    first, second = response.data["cohorts"]
+    assert first == {"cohort": previous.strftime("%Y-%m"), "customers": 1, "repeat_rate": 100.0, "ltv": 150.0,
+                     "retention": [100.0, 100.0], "ltv_curve": [100.0, 150.0]}
+    assert second == {"cohort": closed.strftime("%Y-%m"), "customers": 1, "repeat_rate": 100.0, "ltv": 60.0,
+                      "retention": [100.0], "ltv_curve": [60.0]}
+
+    # Served from the cache: writes that bypass signals are not seen...
+    OrderItem.objects.filter(order__user=other).update(price=Decimal("1000"))
+    assert client.get(reverse("analytics_cohorts"), {"sales_point_id": sales_point.id}).data["cohorts"][1]["ltv"] == 60.0
+    # ...but a late sale in a closed month recomputes the matrix
+    late = CustomUser.objects.create_user(username="analytics_late", password="pass1234")
+    with django_capture_on_commit_callbacks(execute=True):
+        sale(late, previous, "10")
+    first = client.get(reverse("analytics_cohorts"), {"sales_point_id": sales_point.id, "months": 2}).data["cohorts"][0]
+    assert first["customers"] == 2
+    assert first["retention"] == [100.0, 50.0]
+    assert first["repeat_rate"] == 50.0
+
+
+@pytest.mark.django_db
+def test_inventory_performance_report(sales_point, products, settings):
+    """✅ El informe de inventario calcula sell-through, cobertura, rotación y clase ABC por punto de venta"""
+    settings.ANALYTICS_INVENTORY_WINDOW_DAYS = 10
+    products = products + [Product.objects.create(name=f"Analytics Product {i}", price=100) for i in range(2, 4)]
+    for product, quantity in zip(products, (10, 5, 5, 7)):
+        Stock.objects.create(product=product, sales_point=sales_point, quantity=quantity)
+    yesterday = local_day(timezone.now()) - timedelta(days=1)
+    DailySalesFact.objects.bulk_create([
+        DailySalesFact(day=yesterday, sales_point=sales_point, product=products[0],
+                       quantity=20, revenue=Decimal("800"), cogs=Decimal("400"), order_count=4),
+        DailySalesFact(day=yesterday, sales_point=sales_point, product=products[1],
+                       quantity=3, revenue=Decimal("150"), cogs=Decimal("90"), order_count=1),
+        DailySalesFact(day=yesterday, sales_point=sales_point, product=products[2],
+                       quantity=1, revenue=Decimal("50"), cogs=Decimal("20"), order_count=1),
+        # Outside the window: older than 10 closed days, or today (still open)
+        DailySalesFact(day=yesterday - timedelta(days=10), sales_point=sales_point, product=products[3],
+                       quantity=9, revenue=Decimal("900"), cogs=Decimal("1"), order_count=1),
+        DailySalesFact(day=yesterday + timedelta(days=1), sales_point=sales_point, product=products[3],
+                       quantity=9, revenue=Decimal("900"), cogs=Decimal("1"), order_count=1),
+    ])
+
+    InventoryPerformance.objects.refresh()
+
+    rows = {row.product_id: row for row in InventoryPerformance.objects.filter(sales_point=sales_point)}
+    assert len(rows) == 4
+    top = rows[products[0].id]
+    assert (top.units_sold, top.on_hand, top.revenue_share, top.abc_class) == (20, 10, Decimal("80.00"), "A")
+    assert top.sell_through == Decimal("66.67")
+    assert top.days_of_cover == Decimal("5.0")
+    assert top.turnover == Decimal("1.00")  # 20 sold over an average of (30 + 10) / 2 units
+    assert [rows[product.id].abc_class for product in products[1:]] == ["B", "C", "C"]
+    assert rows[products[3].id].units_sold == 0
+    assert rows[products[3].id].days_of_cover is None
+
+    admin = CustomUser.objects.create_user(username="analytics_admin", password="pass1234", role=CustomUser.Role.ADMIN)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    response = client.get(reverse("analytics_inventory"), {"sales_point_id": sales_point.id, "abc_class": "c"})
+    assert response.status_code == 200
+    assert [row["product_name"] for row in response.data["results"]] == [products[2].name, products[3].name]
+    first = client.get(reverse("analytics_inventory"), {"sales_point_id": sales_point.id, "page_size": 3})
+    assert [row["product_name"] for row in first.data["results"]] == [product.name for product in products[:3]]
+    rest = client.get(first.data["next"])
+    assert [row["product_name"] for row in rest.data["results"]] == [products[3].name]
+    assert rest.data["next"] is None
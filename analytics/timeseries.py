@@ -0,0 +1,114 @@
+from datetime import timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+from django.conf import settings
+from django.utils import timezone
+from analytics import cache as analytics_cache
+
+GRANULARITIES = ("hour", "day", "week", "month")
+# Hours are aggregated live from order items; coarser buckets come from the daily rollup and are cached.
+CACHED_GRANULARITIES = ("day", "week", "month")
+
+
+def analytics_timezone():
+    """Time zone analytics buckets are cut in (ANALYTICS_TIME_ZONE)."""
+    return ZoneInfo(settings.ANALYTICS_TIME_ZONE)
+
+
+def local_day(value):
+    """Analytics day of an aware datetime."""
+    return timezone.localdate(value, analytics_timezone())
+
+
+def bucket_start(day, granularity):
+    """First day of the bucket containing `day` (weeks start on Monday)."""
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket_start(start, granularity):
+    if granularity == "week":
+        return start + timedelta(weeks=1)
+    if granularity == "month":
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def iter_bucket_starts(start_day, end_day, granularity):
+    """Every bucket overlapping the inclusive day range, in order; used to fill gaps."""
+    start = bucket_start(start_day, granularity)
+    while start <= end_day:
+        yield start
+        start = next_bucket_start(start, granularity)
+
+
+def iter_hours(start, end):
+    """Every local hour overlapping [start, end), as aware datetimes in the analytics time zone."""
+    tz = analytics_timezone()
+    hour = start.astimezone(tz).replace(minute=0, second=0, microsecond=0)
+    while hour < end:
+        yield hour
+        # Step in UTC so DST changes neither repeat nor skip an hour.
+        hour = (hour.astimezone(dt_timezone.utc) + timedelta(hours=1)).astimezone(tz)
+
+
+def merge_ranges(ranges):
+    """Sorts inclusive day ranges and joins the ones that touch."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and merged[-1][1] + timedelta(days=1) >= start:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def split_buckets(start_day, end_day, granularity, today):
+    """
+    Splits the inclusive day range into closed buckets that can be cached
+    (entirely inside the range and ended before `today`; late writes delete
+    them after commit) and the inclusive day ranges that must be queried live:
+    the open bucket and partial edge buckets.
+    """
+    closed, live = [], []
+    start = bucket_start(start_day, granularity)
+    while start <= end_day:
+        end = next_bucket_start(start, granularity) - timedelta(days=1)
+        if start >= start_day and end <= end_day and end < today:
+            closed.append(start)
+        else:
+            live.append((max(start, start_day), min(end, end_day)))
+        start = next_bucket_start(start, granularity)
+    return closed, merge_ranges(live)
+
+
+def bucketed_series(kind, sales_point_id, granularity, start_day, end_day, compute):
+    """
+    Returns [(bucket_start, values), ...] for the non-empty buckets of the range.
+
+    `compute(ranges)` aggregates the given inclusive day ranges in one query and
+    returns {bucket_start: values}. Closed buckets are read from the cache with
+    one `get_many`; the missing ones are computed together with the live
+    ranges in a single `compute` call and stored for ANALYTICS_BUCKET_TIMEOUT,
+    empty ones as `()` so they are not recomputed either. Late writes to a
+    closed bucket delete it once they commit (analytics.cache.invalidate_buckets).
+    """
+    closed, live = split_buckets(start_day, end_day, granularity, local_day(timezone.now()))
+    generation = analytics_cache.get_bucket_generation()
+    keys = {
+        start: analytics_cache.bucket_key(generation, kind, sales_point_id, granularity, start)
+        for start in closed
+    }
+    cached = analytics_cache.get_buckets(list(keys.values()))
+    values = {start: cached[key] for start, key in keys.items() if key in cached}
+
+    missing = [start for start in closed if start not in values]
+    ranges = [(start, next_bucket_start(start, granularity) - timedelta(days=1)) for start in missing] + live
+    if ranges:
+        computed = compute(merge_ranges(ranges))
+        analytics_cache.set_buckets({keys[start]: tuple(computed.get(start, ())) for start in missing})
+        values.update(computed)
+
+    return sorted((start, tuple(value)) for start, value in values.items() if value)
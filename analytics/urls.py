@@ -1,7 +1,13 @@
 from django.urls import path
-from .views import AnalyticsView
+from .views import (
+    AnalyticsView, AnalyticsExportView, AnalyticsHistoryView, AnalyticsCohortView, InventoryPerformanceListView,
+)
 
 app_name = "analytics"
 urlpatterns = [
     path('', AnalyticsView.as_view(), name='analytics'),
+    path('export/', AnalyticsExportView.as_view(), name='analytics_export'),
+    path('history/', AnalyticsHistoryView.as_view(), name='analytics_history'),
+    path('cohorts/', AnalyticsCohortView.as_view(), name='analytics_cohorts'),
+    path('inventory/', InventoryPerformanceListView.as_view(), name='analytics_inventory'),
 ]
\ No newline at end of file
@@ -1,68 +1,49 @@
+from django.http import StreamingHttpResponse
+from rest_framework import generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Sum, Count, F, Q, Avg, DecimalField
-from django.db.models.functions import Coalesce, TruncDay
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import (
+    Sum, Count, F, Func, Q, Avg, Case, DateField, DecimalField, IntegerField, Value, When, Window,
+)
+from django.db.models.functions import Coalesce, RowNumber, Trunc
 from django.utils import timezone
-from datetime import timedelta, datetime
+from datetime import date, timedelta, datetime
+from functools import reduce
+from operator import or_
 import logging
 from decimal import Decimal
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 
 from users.permissions import IsSuperuser, IsAdmin, IsStoreAdmin
-from orders.models import Order, OrderItem
+from orders.models import OrderItem
 from inventory.models import Stock
-from purchases.models import Invoice, InvoiceItem
+from store.models import Product
+from purchases.models import InvoiceItem
+from . import cache as analytics_cache
+from . import snapshots
+from .cohorts import cohort_report
+from .concurrency import run_concurrently
+from .export import EXPORT_FORMATS, stream_order_items
+from .models import DailySalesFact, InventoryPerformance, SALES_STATUSES
+from .pagination import InventoryPerformanceCursorPagination
+from .serializers import InventoryPerformanceSerializer
+from .timeseries import (
+    GRANULARITIES, analytics_timezone, bucketed_series, iter_bucket_starts, iter_hours, local_day,
+)
 
 logger = logging.getLogger(__name__)
 
-class AnalyticsView(APIView):
-    permission_classes = [IsAuthenticated, (IsSuperuser | IsAdmin | IsStoreAdmin)]
 
-    @method_decorator(cache_page(600)) # Cache this view for 10 minutes
-    def get(self, request):
-        try:
-            # --- 1. Get Filters ---
-            start_date, end_date = self._get_date_filters(request)
-            sales_point_id = request.query_params.get('sales_point_id')
-
-            # --- 2. Filter QuerySets based on Role and Filters ---
-            order_items_qs = self._get_filtered_order_items(request, start_date, end_date)
-            invoices_qs = self._get_filtered_invoices(request, start_date, end_date)
-            stock_qs = self._get_filtered_stock(request)
-
-            # --- 3. Calculate KPIs ---
-            kpis = self._calculate_kpis(order_items_qs, invoices_qs, stock_qs)
-
-            # --- 4. Get Time Series Data ---
-            daily_sales = self._get_daily_sales(order_items_qs)
-            daily_purchases = self._get_daily_purchases(invoices_qs)
-            daily_profit = self._get_daily_profit(order_items_qs)
-
-            # --- 5. Get Top Lists ---
-            top_sold_products = self._get_top_sold_products(order_items_qs)
-            top_customers = self._get_top_customers(order_items_qs)
-            top_profitable_products = self._get_top_profitable_products(order_items_qs)
-
-            # --- 6. Assemble Response ---
-            return Response({
-                'kpis': kpis,
-                'time_series': {
-                    'sales': daily_sales,
-                    'purchases': daily_purchases,
-                    'profit': daily_profit,
-                },
-                'top_lists': {
-                    'sold_products': top_sold_products,
-                    'customers': top_customers,
-                    'profitable_products': top_profitable_products,
-                }
-            })
+class _WindowTotal(Func):
+    """SUM(<aggregate>) OVER (): a grand total computed alongside grouped rows."""
+    function = 'SUM'
+    window_compatible = True
 
-        except Exception as e:
-            logger.error(f"Error in AnalyticsView: {str(e)}", exc_info=True)
-            return Response({'error': 'An internal server error occurred.'}, status=500)
+
+class AnalyticsScopeMixin:
+    """Date window and role/sales-point scoping shared by the analytics endpoints."""
 
     def _get_date_filters(self, request):
         time_filter = request.query_params.get('time_filter', 'month')
@@ -70,8 +51,10 @@ class AnalyticsView(APIView):
         end_date_str = request.query_params.get('end_date')
 
         if start_date_str and end_date_str:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').replace(tzinfo=timezone.utc)
-            end_date = (datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1)).replace(tzinfo=timezone.utc)
+            # Explicit ranges are whole local days in the analytics time zone
+            tz = analytics_timezone()
+            start_date = timezone.make_aware(datetime.strptime(start_date_str, '%Y-%m-%d'), tz)
+            end_date = timezone.make_aware(datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1), tz)
         else:
             end_date = timezone.now()
             if time_filter == 'day':
@@ -82,71 +65,246 @@ class AnalyticsView(APIView):
                 start_date = end_date - timedelta(days=30)
         return start_date, end_date
 
-    def _get_base_order_items(self, start_date, end_date):
-        # Filter orders that are not cancelled
-        return OrderItem.objects.filter(
-            order__created_at__range=(start_date, end_date),
-            order__status__in=['en_proceso', 'enviado'] # Consider only processed or shipped orders
-        )
-
-    def _get_base_invoices(self, start_date, end_date):
-        return Invoice.objects.filter(created_at__range=(start_date, end_date), status='procesada')
+    def _get_day_range(self, start_date, end_date):
+        """Local days covered by [start_date, end_date); the rollup is day-granular."""
+        return local_day(start_date), local_day(end_date - timedelta(microseconds=1))
 
-    def _get_filtered_order_items(self, request, start_date, end_date):
-        qs = self._get_base_order_items(start_date, end_date)
+    def _get_scope_sales_point_id(self, request):
+        """Sales point the report is restricted to, or None for all of them."""
         user = request.user
         sales_point_id = request.query_params.get('sales_point_id')
-        if user.role == 'store_admin' and user.sales_point:
-            return qs.filter(sales_point=user.sales_point)
+        if user.role == 'store_admin' and user.sales_point_id:
+            return user.sales_point_id
         if sales_point_id and user.role in ['superuser', 'admin']:
-            return qs.filter(sales_point_id=sales_point_id)
-        return qs
+            return sales_point_id
+        return None
 
-    def _get_filtered_invoices(self, request, start_date, end_date):
-        qs = self._get_base_invoices(start_date, end_date)
-        user = request.user
-        sales_point_id = request.query_params.get('sales_point_id')
-        if user.role == 'store_admin' and user.sales_point:
-            return qs.filter(sales_point=user.sales_point)
-        if sales_point_id and user.role in ['superuser', 'admin']:
-            return qs.filter(sales_point_id=sales_point_id)
+    def _filter_by_sales_point(self, request, qs, field='sales_point_id'):
+        sales_point_id = self._get_scope_sales_point_id(request)
+        if sales_point_id:
+            return qs.filter(**{field: sales_point_id})
         return qs
 
-    def _get_filtered_stock(self, request):
-        user = request.user
-        sales_point_id = request.query_params.get('sales_point_id')
-        qs = Stock.objects.all()
-        if user.role == 'store_admin' and user.sales_point:
-            return qs.filter(sales_point=user.sales_point)
-        if sales_point_id and user.role in ['superuser', 'admin']:
-            return qs.filter(sales_point_id=sales_point_id)
-        return qs
 
-    def _calculate_kpis(self, order_items_qs, invoices_qs, stock_qs):
-        # Correctly calculate revenue and cost of goods sold (COGS) from OrderItems
-        sales_stats = order_items_qs.aggregate(
-            total_revenue=Coalesce(Sum(F('quantity') * F('price')), Decimal(0), output_field=DecimalField()),
-            total_cogs=Coalesce(Sum(F('quantity') * F('cost_price')), Decimal(0), output_field=DecimalField()),
-            total_orders=Count('order', distinct=True)
+class AnalyticsView(AnalyticsScopeMixin, APIView):
+    permission_classes = [IsAuthenticated, (IsSuperuser | IsAdmin | IsStoreAdmin)]
+
+    def get(self, request):
+        granularity = request.query_params.get('granularity', 'day')
+        if granularity not in GRANULARITIES:
+            return Response({'error': f"granularity debe ser uno de: {', '.join(GRANULARITIES)}."}, status=400)
+
+        try:
+            # --- 1. Get Filters ---
+            start_date, end_date = self._get_date_filters(request)
+            if granularity == 'hour' and end_date - start_date > timedelta(days=settings.ANALYTICS_MAX_HOURLY_DAYS):
+                return Response(
+                    {'error': f"granularity=hour admite como máximo {settings.ANALYTICS_MAX_HOURLY_DAYS} días."},
+                    status=400,
+                )
+
+            # Reports are cached per effective scope and invalidated by version
+            # stamps that order and invoice writes bump (see analytics.signals).
+            cache_key = analytics_cache.build_key(
+                request.user.role,
+                self._get_scope_sales_point_id(request),
+                self._get_cache_window(start_date, end_date, granularity),
+                request.query_params,
+            )
+            report = analytics_cache.get_report(cache_key)
+            if report is None:
+                with timezone.override(analytics_timezone()):
+                    report = self._build_report(request, start_date, end_date, granularity)
+                analytics_cache.set_report(cache_key, report)
+            # Stock changes do not bump the report version, so the low stock
+            # count (one indexed COUNT) is read live instead of cached.
+            report['kpis']['low_stock_count'] = self._compare(self._get_low_stock_count(request), None)
+            return Response(report)
+
+        except Exception as e:
+            logger.error(f"Error in AnalyticsView: {str(e)}", exc_info=True)
+            return Response({'error': 'An internal server error occurred.'}, status=500)
+
+    def _build_report(self, request, start_date, end_date, granularity):
+        # --- 2. One grouped pass per dimension ---
+        # Every metric is derived from the pass over its dimension (product,
+        # customer, time bucket, stock); the passes are independent, so they run
+        # concurrently on separate connections when possible.
+        # KPI passes also cover the previous window of the same length and split
+        # both windows with conditional aggregation, so comparisons cost no extra query.
+        day_range = self._get_day_range(start_date, end_date)
+        tasks = [
+            lambda: self._get_product_stats(request, day_range),
+            lambda: self._get_customer_stats(request, day_range),
+            lambda: self._get_purchase_totals(request, day_range),
+        ]
+        if granularity == 'hour':
+            tasks += [
+                lambda: self._get_hourly_sales(request, start_date, end_date),
+                lambda: self._get_hourly_purchases(request, start_date, end_date),
+            ]
+        else:
+            tasks += [
+                lambda: self._get_sales_buckets(request, day_range, granularity),
+                lambda: self._get_purchase_buckets(request, day_range, granularity),
+            ]
+        product_stats, customer_stats, purchase_totals, sales, purchases = run_concurrently(tasks)
+
+        # --- 3. Time Series ---
+        if granularity == 'hour':
+            buckets = list(iter_hours(start_date, end_date))
+        else:
+            buckets = list(iter_bucket_starts(*day_range, granularity))
+        time_series = self._fill_time_series(buckets, sales, purchases, granularity)
+
+        # --- 4. KPIs ---
+        kpis = self._calculate_kpis(product_stats, customer_stats, purchase_totals)
+
+        # --- 5. Assemble Response ---
+        return {
+            'kpis': kpis,
+            'time_series': time_series,
+            'top_lists': {
+                'sold_products': product_stats['sold_products'],
+                'customers': customer_stats['customers'],
+                'profitable_products': product_stats['profitable_products'],
+            }
+        }
+
+    def _get_previous_range(self, day_range):
+        """The window of the same length right before `day_range`, for KPI comparisons."""
+        start, end = day_range
+        length = end - start + timedelta(days=1)
+        return start - length, start - timedelta(days=1)
+
+    def _get_cache_window(self, start_date, end_date, granularity):
+        """Part of the cache key that pins the window: whole days, or whole hours for hourly series."""
+        if granularity == 'hour':
+            return tuple(value.replace(minute=0, second=0, microsecond=0).isoformat() for value in (start_date, end_date))
+        return self._get_day_range(start_date, end_date)
+
+    def _days_in(self, ranges, field):
+        return reduce(or_, (Q(**{f'{field}__range': day_range}) for day_range in ranges))
+
+    def _get_product_stats(self, request, day_range):
+        """
+        Product pass over the rollup of both windows: the top-5 rankings of the
+        current window plus the revenue and COGS totals of each window (window
+        sums over the grouped rows).
+        """
+        previous_start, _ = self._get_previous_range(day_range)
+        current = Q(day__gte=day_range[0])
+        previous = Q(day__lt=day_range[0])
+        zero = Value(Decimal(0))
+        facts_qs = self._filter_by_sales_point(
+            request, DailySalesFact.objects.filter(day__range=(previous_start, day_range[1]))
         )
-        total_revenue = sales_stats['total_revenue']
-        total_cogs = sales_stats['total_cogs']
-        total_orders = sales_stats['total_orders']
+        rows = list(facts_qs.values('product_id', 'product__name')
+            .annotate(
+                total_quantity=Coalesce(Sum('quantity', filter=current), 0),
+                total_revenue=Coalesce(Sum('revenue', filter=current), zero),
+                total_cogs=Coalesce(Sum('cogs', filter=current), zero),
+                previous_revenue=Coalesce(Sum('revenue', filter=previous), zero),
+                previous_cogs=Coalesce(Sum('cogs', filter=previous), zero),
+            )
+            .annotate(
+                total_profit=F('total_revenue') - F('total_cogs'),
+                not_sold=Case(When(total_quantity=0, then=Value(1)), default=Value(0)),
+            )
+            .annotate(
+                all_revenue=Window(_WindowTotal(F('total_revenue')), output_field=DecimalField()),
+                all_cogs=Window(_WindowTotal(F('total_cogs')), output_field=DecimalField()),
+                all_previous_revenue=Window(_WindowTotal(F('previous_revenue')), output_field=DecimalField()),
+                all_previous_cogs=Window(_WindowTotal(F('previous_cogs')), output_field=DecimalField()),
+                quantity_rank=Window(RowNumber(), order_by=(F('total_quantity').desc(), F('product_id').asc())),
+                profit_rank=Window(RowNumber(), order_by=(
+                    F('not_sold').asc(), F('total_profit').desc(), F('product_id').asc(),
+                )),
+            )
+            .filter(Q(quantity_rank__lte=5) | Q(profit_rank__lte=5)))
 
-        # Purchase cost is now a separate metric for tracking expenses
-        purchase_stats = InvoiceItem.objects.filter(invoice__in=invoices_qs).aggregate(
-            total_purchase_cost=Coalesce(Sum(F('quantity') * F('cost_per_item')), Decimal(0), output_field=DecimalField())
+        totals = rows[0] if rows else dict.fromkeys(
+            ('all_revenue', 'all_cogs', 'all_previous_revenue', 'all_previous_cogs'), Decimal(0)
         )
-        total_purchase_cost = purchase_stats['total_purchase_cost']
+        # Products sold only in the previous window are ranked last and left out of the lists
+        sold_rows = [row for row in rows if row['total_quantity']]
+        return {
+            'total_revenue': totals['all_revenue'],
+            'total_cogs': totals['all_cogs'],
+            'previous_revenue': totals['all_previous_revenue'],
+            'previous_cogs': totals['all_previous_cogs'],
+            'sold_products': [
+                {'product__name': row['product__name'], 'total_quantity': row['total_quantity']}
+                for row in sorted(sold_rows, key=lambda row: row['quantity_rank']) if row['quantity_rank'] <= 5
+            ],
+            'profitable_products': [
+                {key: row[key] for key in ('product__name', 'total_revenue', 'total_cogs', 'total_profit')}
+                for row in sorted(sold_rows, key=lambda row: row['profit_rank']) if row['profit_rank'] <= 5
+            ],
+        }
 
-        # Stock KPIs
-        low_stock_count = stock_qs.filter(quantity__lte=F('low_stock_threshold')).count()
+    def _get_customer_stats(self, request, day_range):
+        """
+        Customer pass over the order items of both windows (per-customer data is
+        not rolled up): the top 5 customers of the current window plus the order
+        count of each window, which is the sum of each customer's distinct
+        orders since an order belongs to a single customer.
+        """
+        previous_start, _ = self._get_previous_range(day_range)
+        current = Q(order__created_at__date__gte=day_range[0])
+        previous = Q(order__created_at__date__lt=day_range[0])
+        items_qs = self._filter_by_sales_point(request, OrderItem.objects.filter(
+            order__created_at__date__range=(previous_start, day_range[1]),
+            order__status__in=SALES_STATUSES,  # Consider only processed or shipped orders
+        ))
+        rows = list(items_qs.values('order__user_id', 'order__user__username')
+            .annotate(
+                total_revenue=Coalesce(Sum(F('quantity') * F('price'), filter=current), Value(Decimal(0))),  # Use stored price
+                total_orders=Count('order_id', distinct=True, filter=current),
+                previous_orders=Count('order_id', distinct=True, filter=previous),
+            )
+            .annotate(not_bought=Case(When(total_orders=0, then=Value(1)), default=Value(0)))
+            .annotate(
+                all_orders=Window(_WindowTotal(F('total_orders')), output_field=IntegerField()),
+                all_previous_orders=Window(_WindowTotal(F('previous_orders')), output_field=IntegerField()),
+                revenue_rank=Window(RowNumber(), order_by=(
+                    F('not_bought').asc(), F('total_revenue').desc(), F('order__user_id').asc(),
+                )),
+            )
+            .filter(revenue_rank__lte=5)
+            .order_by('revenue_rank'))
+
+        return {
+            'total_orders': rows[0]['all_orders'] if rows else 0,
+            'previous_orders': rows[0]['all_previous_orders'] if rows else 0,
+            'customers': [
+                {'order__user__username': row['order__user__username'], 'total_revenue': row['total_revenue']}
+                for row in rows if row['total_orders']
+            ],
+        }
+
+    def _get_purchase_totals(self, request, day_range):
+        """Purchase cost of the current and the previous window in one conditional aggregate."""
+        previous_start, _ = self._get_previous_range(day_range)
+        cost = F('quantity') * F('cost_per_item')
+        zero = Value(Decimal(0))
+        return self._get_purchase_items(request).filter(
+            invoice__created_at__date__range=(previous_start, day_range[1]),
+        ).aggregate(
+            current=Coalesce(Sum(cost, filter=Q(invoice__created_at__date__gte=day_range[0])), zero, output_field=DecimalField()),
+            previous=Coalesce(Sum(cost, filter=Q(invoice__created_at__date__lt=day_range[0])), zero, output_field=DecimalField()),
+        )
+
+    def _get_low_stock_count(self, request):
+        # Stock is a snapshot without history, so the KPI has no previous value.
+        stock_qs = self._filter_by_sales_point(request, Stock.objects.all())
+        return stock_qs.filter(quantity__lte=F('low_stock_threshold')).count()
 
+    def _derive_kpis(self, total_revenue, total_cogs, total_orders, total_purchase_cost):
         # Correctly calculated KPIs
         net_profit = total_revenue - total_cogs
         profit_margin = (net_profit / total_revenue * 100) if total_revenue > 0 else 0
         avg_order_value = (total_revenue / total_orders) if total_orders > 0 else 0
-
         return {
             'total_revenue': total_revenue,
             'total_cost_of_goods_sold': total_cogs, # Renamed for clarity
@@ -154,49 +312,211 @@ class AnalyticsView(APIView):
             'profit_margin': profit_margin,
             'total_orders': total_orders,
             'avg_order_value': avg_order_value,
-            'low_stock_count': low_stock_count,
             'total_purchase_cost': total_purchase_cost, # Informational metric
         }
 
-    def _get_daily_sales(self, order_items_qs):
-        return list(order_items_qs.annotate(day=TruncDay('order__created_at'))
-            .values('day')
-            .annotate(revenue=Sum(F('quantity') * F('price'))) # Use stored price
-            .order_by('day'))
+    def _compare(self, value, previous):
+        """{value, previous, delta_pct}; delta_pct is None when there is nothing to compare with."""
+        delta_pct = None
+        if previous:
+            delta_pct = round((Decimal(value) - Decimal(previous)) / abs(Decimal(previous)) * 100, 2)
+        return {'value': value, 'previous': previous, 'delta_pct': delta_pct}
+
+    def _calculate_kpis(self, product_stats, customer_stats, purchase_totals):
+        current = self._derive_kpis(
+            product_stats['total_revenue'], product_stats['total_cogs'],
+            customer_stats['total_orders'], purchase_totals['current'],
+        )
+        previous = self._derive_kpis(
+            product_stats['previous_revenue'], product_stats['previous_cogs'],
+            customer_stats['previous_orders'], purchase_totals['previous'],
+        )
+        return {name: self._compare(value, previous[name]) for name, value in current.items()}
+
+    def _fill_time_series(self, buckets, sales, purchases, granularity):
+        """
+        Gap-filled series as parallel arrays: `timestamps[i]` is the start of the
+        i-th bucket (ISO date, or ISO datetime for hours) and `sales[i]`,
+        `purchases[i]` and `profit[i]` are its totals, 0 for empty buckets.
+        """
+        zero = Decimal(0)
+        series = {'granularity': granularity, 'timestamps': [], 'sales': [], 'purchases': [], 'profit': []}
+        for bucket in buckets:
+            revenue, cogs = sales.get(bucket, (zero, zero))
+            series['timestamps'].append(bucket.isoformat())
+            series['sales'].append(revenue)
+            series['purchases'].append(purchases.get(bucket, (zero,))[0])
+            series['profit'].append(revenue - cogs)
+        return series
+
+    def _get_sales_buckets(self, request, day_range, granularity):
+        facts_qs = self._filter_by_sales_point(request, DailySalesFact.objects.all())
+
+        def compute(ranges):
+            rows = (facts_qs.filter(self._days_in(ranges, 'day'))
+                .annotate(bucket=Trunc('day', granularity, output_field=DateField()))
+                .values('bucket')
+                .annotate(revenue=Sum('revenue'), cogs=Sum('cogs'))
+                .order_by())
+            return {row['bucket']: (row['revenue'], row['cogs']) for row in rows}
 
-    def _get_daily_purchases(self, invoices_qs):
-        return list(InvoiceItem.objects.filter(invoice__in=invoices_qs)
-            .annotate(day=TruncDay('invoice__created_at'))
-            .values('day')
+        return dict(bucketed_series('sales', self._get_scope_sales_point_id(request), granularity, *day_range, compute))
+
+    def _get_purchase_items(self, request):
+        return self._filter_by_sales_point(
+            request, InvoiceItem.objects.filter(invoice__status='procesada'), field='invoice__sales_point_id'
+        )
+
+    def _get_purchase_buckets(self, request, day_range, granularity):
+        items_qs = self._get_purchase_items(request)
+
+        def compute(ranges):
+            rows = (items_qs.filter(self._days_in(ranges, 'invoice__created_at__date'))
+                .annotate(bucket=Trunc('invoice__created_at', granularity, output_field=DateField()))
+                .values('bucket')
+                .annotate(cost=Sum(F('quantity') * F('cost_per_item')))
+                .order_by())
+            return {row['bucket']: (row['cost'],) for row in rows}
+
+        return dict(bucketed_series('purchases', self._get_scope_sales_point_id(request), granularity, *day_range, compute))
+
+    def _get_hourly_sales(self, request, start_date, end_date):
+        # Hours are finer than the rollup, so they are aggregated from the order items themselves
+        items_qs = self._filter_by_sales_point(request, OrderItem.objects.filter(
+            order__created_at__gte=start_date,
+            order__created_at__lt=end_date,
+            order__status__in=SALES_STATUSES,
+        ))
+        rows = (items_qs.annotate(bucket=Trunc('order__created_at', 'hour'))
+            .values('bucket')
+            .annotate(revenue=Sum(F('quantity') * F('price')), cogs=Sum(F('quantity') * F('cost_price')))
+            .order_by())
+        return {row['bucket']: (row['revenue'], row['cogs']) for row in rows}
+
+    def _get_hourly_purchases(self, request, start_date, end_date):
+        items_qs = self._get_purchase_items(request).filter(
+            invoice__created_at__gte=start_date,
+            invoice__created_at__lt=end_date,
+        )
+        rows = (items_qs.annotate(bucket=Trunc('invoice__created_at', 'hour'))
+            .values('bucket')
             .annotate(cost=Sum(F('quantity') * F('cost_per_item')))
-            .order_by('day'))
+            .order_by())
+        return {row['bucket']: (row['cost'],) for row in rows}
 
-    def _get_daily_profit(self, order_items_qs):
-        return list(order_items_qs.annotate(day=TruncDay('order__created_at'))
-            .values('day')
-            .annotate(
-                daily_revenue=Sum(F('quantity') * F('price')),
-                daily_cogs=Sum(F('quantity') * F('cost_price'))
-            )
-            .annotate(profit=F('daily_revenue') - F('daily_cogs'))
-            .values('day', 'profit')
-            .order_by('day'))
-
-    def _get_top_sold_products(self, order_items_qs):
-        return list(order_items_qs.values('product__name')
-            .annotate(total_quantity=Sum('quantity'))
-            .order_by('-total_quantity')[:5])
-
-    def _get_top_customers(self, order_items_qs):
-        return list(order_items_qs.values('order__user__username')
-            .annotate(total_revenue=Sum(F('quantity') * F('price'))) # Use stored price
-            .order_by('-total_revenue')[:5])
-
-    def _get_top_profitable_products(self, order_items_qs):
-        return list(order_items_qs.values('product__name')
-            .annotate(
-                total_revenue=Sum(F('quantity') * F('price')),
-                total_cogs=Sum(F('quantity') * F('cost_price'))
+
+class AnalyticsExportView(AnalyticsScopeMixin, APIView):
+    """
+    Streams the order lines behind the sales analytics (same window, roles and
+    sales-point scoping as AnalyticsView) as CSV or NDJSON:
+    `?file_format=csv|ndjson&start_date=...&end_date=...&sales_point_id=...`.
+    """
+    permission_classes = [IsAuthenticated, (IsSuperuser | IsAdmin | IsStoreAdmin)]
+
+    def get(self, request):
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in EXPORT_FORMATS:
+            return Response({'error': f"file_format debe ser uno de: {', '.join(EXPORT_FORMATS)}."}, status=400)
+
+        start_date, end_date = self._get_date_filters(request)
+        items_qs = self._filter_by_sales_point(request, OrderItem.objects.filter(
+            order__created_at__gte=start_date,
+            order__created_at__lt=end_date,
+            order__status__in=SALES_STATUSES,
+        ))
+
+        start_day, end_day = self._get_day_range(start_date, end_date)
+        response = StreamingHttpResponse(
+            stream_order_items(items_qs, file_format, settings.ANALYTICS_EXPORT_CHUNK_SIZE),
+            content_type=EXPORT_FORMATS[file_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="ventas_{start_day}_{end_day}.{file_format}"'
+        return response
+
+
+class AnalyticsHistoryView(AnalyticsScopeMixin, APIView):
+    """
+    Long-horizon trends and product mix answered from the Parquet snapshots of
+    closed days (analytics.snapshots), so multi-year ranges never reach the
+    OLTP database: `?start_date=...&end_date=...&granularity=day|week|month`.
+    Defaults to the last 12 months up to yesterday.
+    """
+    permission_classes = [IsAuthenticated, (IsSuperuser | IsAdmin | IsStoreAdmin)]
+
+    def get(self, request):
+        granularity = request.query_params.get('granularity', 'month')
+        if granularity not in snapshots.HISTORY_GRANULARITIES:
+            return Response(
+                {'error': f"granularity debe ser uno de: {', '.join(snapshots.HISTORY_GRANULARITIES)}."}, status=400
             )
-            .annotate(total_profit=F('total_revenue') - F('total_cogs'))
-            .order_by('-total_profit')[:5])
+        yesterday = local_day(timezone.now()) - timedelta(days=1)
+        try:
+            end_day = min(date.fromisoformat(request.query_params.get('end_date', yesterday.isoformat())), yesterday)
+            start_str = request.query_params.get('start_date')
+            start_day = date.fromisoformat(start_str) if start_str else (end_day.replace(day=1) - timedelta(days=320)).replace(day=1)
+        except ValueError:
+            return Response({'error': 'Las fechas deben tener el formato AAAA-MM-DD.'}, status=400)
+        if start_day > end_day:
+            return Response({'error': 'start_date no puede ser posterior a end_date (último día cerrado).'}, status=400)
+
+        sales_point_id = self._get_scope_sales_point_id(request)
+        try:
+            series = snapshots.history_series(start_day, end_day, granularity, sales_point_id)
+            mix = snapshots.product_mix(start_day, end_day, sales_point_id)
+        except ImproperlyConfigured as exc:
+            logger.error("Analytics history unavailable: %s", exc)
+            return Response({'error': 'La analítica histórica no está disponible.'}, status=503)
+
+        names = dict(Product.objects.filter(id__in=[row['product_id'] for row in mix]).values_list('id', 'name'))
+        for row in mix:
+            row['product__name'] = names.get(row['product_id'])
+        return Response({
+            'range': {'start': start_day, 'end': end_day},
+            'time_series': series,
+            'product_mix': mix,
+        })
+
+
+class AnalyticsCohortView(AnalyticsScopeMixin, APIView):
+    """
+    Monthly acquisition cohorts with retention, repeat-purchase rate and
+    lifetime value, up to the latest closed month: `?months=12` limits the
+    response to the most recent cohorts.
+    """
+    permission_classes = [IsAuthenticated, (IsSuperuser | IsAdmin | IsStoreAdmin)]
+
+    def get(self, request):
+        try:
+            months = int(request.query_params.get('months', 12))
+        except ValueError:
+            return Response({'error': 'months debe ser un número entero.'}, status=400)
+        if months < 1:
+            return Response({'error': 'months debe ser mayor que 0.'}, status=400)
+
+        try:
+            report = cohort_report(self._get_scope_sales_point_id(request))
+        except ImproperlyConfigured as exc:
+            logger.error("Analytics cohorts unavailable: %s", exc)
+            return Response({'error': 'El análisis de cohortes no está disponible.'}, status=503)
+        return Response({'through': report['through'], 'cohorts': report['cohorts'][-months:]})
+
+
+class InventoryPerformanceListView(AnalyticsScopeMixin, generics.ListAPIView):
+    """
+    Precomputed sell-through, days of cover, turnover and ABC class per product
+    and sales point (rebuilt hourly by analytics.tasks.refresh_inventory_performance).
+    `?abc_class=A|B|C` filters by class; rows are ordered by sales point and
+    revenue and paged with a cursor.
+    """
+    serializer_class = InventoryPerformanceSerializer
+    pagination_class = InventoryPerformanceCursorPagination
+    permission_classes = [IsAuthenticated, (IsSuperuser | IsAdmin | IsStoreAdmin)]
+
+    def get_queryset(self):
+        queryset = self._filter_by_sales_point(
+            self.request, InventoryPerformance.objects.select_related('product', 'sales_point')
+        )
+        abc_class = self.request.query_params.get('abc_class')
+        if abc_class:
+            queryset = queryset.filter(abc_class=abc_class.upper())
+        return queryset
@@ -4,22 +4,35 @@ import axios from "axios";
 export const useProductStore = defineStore("products", {
   state: () => ({
     products: [],
+    nextPage: null,
     currentProduct: null,
     categories: [],
     loading: false,
     error: null,
   }),
+  getters: {
+    hasMoreProducts: (state) => state.nextPage !== null,
+  },
   actions: {
-    async fetchProducts() {
-      if (this.products.length > 0) {
+    async fetchProducts({ maxPages = Infinity, pageSize = 100 } = {}) {
+      // The catalog is cursor-paginated: keep following `next` from where the
+      // previous call stopped, so callers can load a single page or walk all of them.
+      if (this.products.length > 0 && !this.nextPage) {
         console.log("Productos ya cargados, utilizando caché");
         return;
       }
       this.loading = true;
       this.error = null;
       try {
-        const response = await axios.get("/api/store/products/");
-        this.products = response.data;
+        let url = this.nextPage || `/api/store/products/?page_size=${pageSize}`;
+        let pagesLoaded = 0;
+        while (url && pagesLoaded < maxPages) {
+          const response = await axios.get(url);
+          this.products.push(...response.data.results);
+          this.nextPage = response.data.next;
+          url = this.nextPage;
+          pagesLoaded += 1;
+        }
       } catch (error) {
         this.error = error.response?.status === 429
           ? "Demasiadas solicitudes, espera un momento y recarga la página."
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from inventory.models import ProductAvailability
+
+
+class Command(BaseCommand):
+    help = "Recalcula la tabla ProductAvailability a partir de Stock."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--product",
+            type=int,
+            action="append",
+            dest="product_ids",
+            help="ID de producto a recalcular (se puede repetir). Por defecto, todo el catálogo.",
+        )
+
+    def handle(self, *args, **options):
+        product_ids = options.get("product_ids")
+        with transaction.atomic():
+            ProductAvailability.objects.refresh(product_ids)
+        scope = f"{len(product_ids)} productos" if product_ids else "todo el catálogo"
+        self.stdout.write(self.style.SUCCESS(f"Disponibilidad recalculada para {scope}."))
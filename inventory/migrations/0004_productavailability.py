@@ -0,0 +1,47 @@
+# Generated by Django 5.2 on 2026-10-17 23:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def populate_product_availability(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Stock = apps.get_model('inventory', 'Stock')
+    ProductAvailability = apps.get_model('inventory', 'ProductAvailability')
+    totals = dict(
+        Stock.objects.values('product_id')
+        .annotate(available=Sum(F('quantity') - F('reserved_quantity')))
+        .values_list('product_id', 'available')
+    )
+    ProductAvailability.objects.bulk_create(
+        [
+            ProductAvailability(product_id=product_id, available_quantity=totals.get(product_id) or 0)
+            for product_id in Product.objects.values_list('id', flat=True)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_alter_stock_sales_point'),
+        ('store', '0007_delete_stockmovement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductAvailability',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_availability', serialize=False, to='store.product')),
+                ('available_quantity', models.IntegerField(default=0, verbose_name='Cantidad disponible')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Disponibilidad de producto',
+                'verbose_name_plural': 'Disponibilidad de productos',
+            },
+        ),
+        migrations.RunPython(populate_product_availability, migrations.RunPython.noop),
+    ]
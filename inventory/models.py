@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
 from store.models import Product
 from django.contrib.auth import get_user_model
 
@@ -39,18 +41,14 @@ class Stock(models.Model):
         if not self.sales_point:
             raise ValueError(f"No se puede ajustar el stock porque el punto de venta no está asignado.")
 
-        if self.quantity + change < 0:
+        from inventory.services import change_stock, NegativeStockError
+
+        try:
+            change_stock({(self.product_id, self.sales_point_id): change}, reason=reason)
+        except NegativeStockError:
             raise ValueError(f"No hay suficiente stock de {self.product.name} en {self.sales_point.name}.")
 
         self.quantity += change
-        self.save()
-
-        StockMovement.objects.create(
-            product=self.product,
-            sales_point=self.sales_point,
-            change=change,
-            reason=reason
-        )
 
     def __str__(self):
         return f"{self.product.name} - {self.sales_point.name} - {self.quantity} en stock"
@@ -72,4 +70,109 @@ class StockMovement(models.Model):
         return f"{self.product.name} ({self.sales_point.name}): {self.change} ({self.reason})"
 
     class Meta:
-        ordering = ["-created_at"]
\ No newline at end of file
+        ordering = ["-created_at"]
+
+class ProductAvailabilityManager(models.Manager):
+    def refresh(self, product_ids=None):
+        """
+        ✅ Пересчитывает доступный остаток по `Stock` для указанных товаров
+        (или для всего каталога, если `product_ids` не передан) одним
+        сгруппированным запросом и одним upsert.
+
+        Rows are locked (in product_id order) before `Stock` is summed: a
+        concurrent refresh of the same product waits until this transaction
+        commits and then sums the committed quantities, so the last writer
+        never stores a total computed from stale rows.
+        """
+        stocks = Stock.objects.all()
+        if product_ids is None:
+            product_ids = list(Product.objects.values_list("id", flat=True))
+        else:
+            product_ids = set(product_ids)
+            if not product_ids:
+                return
+            stocks = stocks.filter(product_id__in=product_ids)
+
+        with transaction.atomic():
+            self.bulk_create(
+                [self.model(product_id=product_id) for product_id in product_ids],
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+            list(self.select_for_update().filter(product_id__in=product_ids).order_by("product_id").values_list("pk"))
+
+            totals = dict(
+                stocks.values("product_id")
+                .annotate(available=Sum(F("quantity") - F("reserved_quantity")))
+                .values_list("product_id", "available")
+            )
+            rows = [
+                self.model(product_id=product_id, available_quantity=totals.get(product_id) or 0)
+                for product_id in product_ids
+            ]
+            self.bulk_create(
+                rows,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=["product"],
+                update_fields=["available_quantity", "updated_at"],
+            )
+
+    def apply_deltas(self, deltas):
+        """
+        Adds {product_id: change} to the available quantities in the
+        transaction that has just changed `Stock` by those amounts:
+
+            UPDATE ... SET available_quantity = available_quantity + CASE ... END
+
+        The row lock makes concurrent changes to other Stock rows of the same
+        product add up instead of overwriting each other. Products without a row
+        are first inserted with their total before this change (ON CONFLICT DO
+        NOTHING), so a concurrent first insert is added to as well.
+        """
+        deltas = {product_id: change for product_id, change in deltas.items() if change}
+        if not deltas:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {self.model._meta.db_table} (product_id, available_quantity, updated_at)
+                SELECT d.product_id, COALESCE(SUM(s.quantity - s.reserved_quantity), 0) - d.change, %s
+                FROM unnest(%s::bigint[], %s::integer[]) AS d(product_id, change)
+                LEFT JOIN {Stock._meta.db_table} s ON s.product_id = d.product_id
+                WHERE NOT EXISTS (SELECT 1 FROM {self.model._meta.db_table} a WHERE a.product_id = d.product_id)
+                GROUP BY d.product_id, d.change
+                ON CONFLICT (product_id) DO NOTHING
+                """,
+                [timezone.now(), list(deltas), list(deltas.values())],
+            )
+        change = Case(*(When(product_id=product_id, then=Value(n)) for product_id, n in deltas.items()), default=Value(0))
+        self.filter(product_id__in=deltas).update(
+            available_quantity=F("available_quantity") + change, updated_at=timezone.now(),
+        )
+
+    def available_map(self, product_ids):
+        """Returns {product_id: available_quantity} for the given products."""
+        return dict(
+            self.filter(product_id__in=product_ids).values_list("product_id", "available_quantity")
+        )
+
+class ProductAvailability(models.Model):
+    """
+    ✅ Денормализованный доступный остаток товара (quantity - reserved_quantity
+    по всем точкам продаж). Обновляется в той же транзакции, что и `Stock`.
+    """
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name="stock_availability"
+    )
+    available_quantity = models.IntegerField(default=0, verbose_name="Cantidad disponible")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProductAvailabilityManager()
+
+    def __str__(self):
+        return f"{self.product_id}: {self.available_quantity} disponibles"
+
+    class Meta:
+        verbose_name = "Disponibilidad de producto"
+        verbose_name_plural = "Disponibilidad de productos"
@@ -0,0 +1,96 @@
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+from inventory.models import Stock, StockMovement, ProductAvailability
+
+
+class NegativeStockError(ValueError):
+    """Raised when a stock change would leave `Stock.quantity` below zero."""
+
+    def __init__(self, product_id, sales_point_id, change, quantity):
+        self.product_id = product_id
+        self.sales_point_id = sales_point_id
+        self.change = change
+        self.quantity = quantity
+        super().__init__(
+            f"No hay suficiente stock del producto {product_id} en el punto de venta {sales_point_id} "
+            f"({quantity} en stock, cambio {change})."
+        )
+
+
+def apply_stock_deltas(deltas, guard, **signs):
+    """
+    Applies {stock_id: n} to the given Stock fields (field=+1 adds n, field=-1
+    subtracts it) in one UPDATE whose WHERE clause is `guard(pk, n)` OR-ed over
+    the rows. Returns True if every row passed its guard.
+    """
+    delta = Case(*(When(pk=pk, then=Value(n)) for pk, n in deltas.items()), default=Value(0))
+    updates = {
+        field: F(field) + delta if sign > 0 else F(field) - delta
+        for field, sign in signs.items()
+    }
+    updated = Stock.objects.filter(
+        reduce(or_, (guard(pk, n) for pk, n in deltas.items()))
+    ).update(updated_at=timezone.now(), **updates)
+    return updated == len(deltas)
+
+
+@transaction.atomic
+def change_stock(changes, reason, create_missing=False):
+    """
+    Applies quantity changes {(product_id, sales_point_id): change} atomically
+    (joining the caller's transaction if there is one) and logs one
+    StockMovement per row.
+
+    The rows are locked with one query in (product_id, sales_point_id) order and
+    updated with a single `UPDATE ... SET quantity = quantity + CASE ... END`
+    whose WHERE clause refuses to go below zero. With `create_missing`, absent
+    Stock rows are inserted first (ON CONFLICT DO NOTHING). Raises
+    NegativeStockError without writing anything if a change cannot be applied.
+    """
+    totals = defaultdict(int)
+    for key, change in changes.items() if isinstance(changes, dict) else changes:
+        totals[key] += change
+    totals = {key: change for key, change in totals.items() if change}
+    if not totals:
+        return
+
+    if create_missing:
+        Stock.objects.bulk_create(
+            [Stock(product_id=product_id, sales_point_id=sales_point_id, quantity=0)
+             for product_id, sales_point_id in totals],
+            ignore_conflicts=True,
+        )
+
+    rows = Stock.objects.select_for_update().filter(
+        reduce(or_, (Q(product_id=product_id, sales_point_id=sales_point_id) for product_id, sales_point_id in totals))
+    ).order_by("product_id", "sales_point_id").values_list("pk", "product_id", "sales_point_id", "quantity")
+    stocks = {(product_id, sales_point_id): (pk, quantity) for pk, product_id, sales_point_id, quantity in rows}
+
+    deltas = {}
+    for (product_id, sales_point_id), change in totals.items():
+        pk, quantity = stocks.get((product_id, sales_point_id), (None, 0))
+        if pk is None or quantity + change < 0:
+            raise NegativeStockError(product_id, sales_point_id, change, quantity)
+        deltas[pk] = change
+
+    applied = apply_stock_deltas(
+        deltas,
+        guard=lambda pk, n: Q(pk=pk, quantity__gte=-n) if n < 0 else Q(pk=pk),
+        quantity=1,
+    )
+    if not applied:
+        (product_id, sales_point_id), change = next(iter(totals.items()))
+        raise NegativeStockError(product_id, sales_point_id, change, None)
+
+    StockMovement.objects.bulk_create([
+        StockMovement(product_id=product_id, sales_point_id=sales_point_id, change=change, reason=reason)
+        for (product_id, sales_point_id), change in totals.items()
+    ])
+    available = defaultdict(int)
+    for (product_id, _), change in totals.items():
+        available[product_id] += change
+    ProductAvailability.objects.apply_deltas(available)
@@ -0,0 +1,22 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from store.models import Product
+from inventory.models import Stock, ProductAvailability
+
+
+@receiver(post_save, sender=Stock)
+def refresh_availability_on_save(sender, instance, **kwargs):
+    """
+    ✅ Поддерживает `ProductAvailability` в актуальном состоянии при каждом сохранении `Stock`.
+    """
+    ProductAvailability.objects.refresh([instance.product_id])
+
+
+@receiver(post_delete, sender=Stock)
+def refresh_availability_on_delete(sender, instance, origin=None, **kwargs):
+    """
+    ✅ Пересчитывает доступность после удаления `Stock`, кроме каскадного удаления самого товара.
+    """
+    if isinstance(origin, Product) or getattr(origin, "model", None) is Product:
+        return
+    ProductAvailability.objects.refresh([instance.product_id])
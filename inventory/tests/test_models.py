@@ -1,11 +1,14 @@
 import pytest
 import uuid
-from inventory.models import SalesPoint, Stock, StockMovement
+from inventory.models import SalesPoint, Stock, StockMovement, ProductAvailability
+from inventory.services import change_stock, NegativeStockError
 from store.models import Product, Category
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 
 User = get_user_model()
 
+
 @pytest.mark.django_db(transaction=True)
 def test_create_sales_point():
     """Проверяет создание точки продаж и связь с пользователями."""
@@ -16,6 +19,7 @@ def test_create_sales_point():
     assert sales_point.name == "Test Store"
     assert user in sales_point.administrators.all()
 
+
 @pytest.mark.django_db(transaction=True)
 def test_create_stock():
     """Проверяет создание склада и его свойства."""
@@ -26,6 +30,7 @@ def test_create_stock():
     assert stock.quantity == 10
     assert stock.is_low_stock() == False
 
+
 @pytest.mark.django_db(transaction=True)
 def test_create_stock_movement():
     """Проверяет создание перемещения товара."""
@@ -35,4 +40,80 @@ def test_create_stock_movement():
     stock = Stock.objects.create(product=product, sales_point=sales_point, quantity=10)
     movement = StockMovement.objects.create(product=product, sales_point=sales_point, change=-2, reason="Venta")
     assert movement.change == -2
-    assert str(movement) == "MacBook Pro (Main Store): -2 (Venta)"
\ No newline at end of file
+    assert str(movement) == "MacBook Pro (Main Store): -2 (Venta)"
+
+
+@pytest.mark.django_db
+def test_product_availability_follows_stock():
+    """Проверяет, что `ProductAvailability` обновляется при изменении и удалении `Stock`."""
+    category = Category.objects.create(name=f"Tablets {uuid.uuid4().hex[:6]}")
+    product = Product.objects.create(name="iPad", category=category, price=800)
+    first = SalesPoint.objects.create(name="Store A")
+    second = SalesPoint.objects.create(name="Store B")
+    stock = Stock.objects.create(product=product, sales_point=first, quantity=10, reserved_quantity=2)
+    Stock.objects.create(product=product, sales_point=second, quantity=4)
+    assert ProductAvailability.objects.get(product=product).available_quantity == 12
+
+    stock.adjust_stock(-3, reason="Venta")
+    assert ProductAvailability.objects.get(product=product).available_quantity == 9
+
+    stock.delete()
+    assert ProductAvailability.objects.get(product=product).available_quantity == 4
+
+
+@pytest.mark.django_db
+def test_rebuild_product_availability_command():
+    """Проверяет, что команда пересобирает таблицу доступности из `Stock`."""
+    category = Category.objects.create(name=f"Consoles {uuid.uuid4().hex[:6]}")
+    product = Product.objects.create(name="Switch", category=category, price=300)
+    sales_point = SalesPoint.objects.create(name="Warehouse")
+    Stock.objects.create(product=product, sales_point=sales_point, quantity=7, reserved_quantity=1)
+    ProductAvailability.objects.filter(product=product).delete()
+
+    call_command("rebuild_product_availability", "--product", str(product.id))
+    assert ProductAvailability.objects.get(product=product).available_quantity == 6
+
+
+@pytest.mark.django_db
+def test_product_availability_applies_stock_deltas():
+    """Проверяет, что изменения `Stock` прибавляются к доступности, а отсутствующая строка создаётся из остатков."""
+    category = Category.objects.create(name=f"Cameras {uuid.uuid4().hex[:6]}")
+    product = Product.objects.create(name="Lumix", category=category, price=500)
+    sales_point = SalesPoint.objects.create(name="Warehouse")
+    Stock.objects.bulk_create([Stock(product=product, sales_point=sales_point, quantity=8)])
+    assert not ProductAvailability.objects.filter(product=product).exists()
+
+    change_stock({(product.id, sales_point.id): -3}, reason="Venta")
+    assert ProductAvailability.objects.get(product=product).available_quantity == 5
+
+    # Deltas are added to the stored value (a concurrent change is never overwritten by a re-sum)
+    ProductAvailability.objects.filter(product=product).update(available_quantity=100)
+    change_stock({(product.id, sales_point.id): 2}, reason="Ajuste")
+    assert ProductAvailability.objects.get(product=product).available_quantity == 102
+
+
+@pytest.mark.django_db
+def test_change_stock_applies_deltas_and_logs_movements():
+    """Проверяет атомарное изменение остатков через `change_stock` и защиту от отрицательного остатка."""
+    category = Category.objects.create(name=f"Audio {uuid.uuid4().hex[:6]}")
+    headphones = Product.objects.create(name="AirPods", category=category, price=200)
+    speaker = Product.objects.create(name="HomePod", category=category, price=300)
+    sales_point = SalesPoint.objects.create(name="Audio Store")
+    stock = Stock.objects.create(product=headphones, sales_point=sales_point, quantity=5)
+
+    change_stock(
+        {(headphones.id, sales_point.id): -2, (speaker.id, sales_point.id): 4},
+        reason="Recuento",
+        create_missing=True,
+    )
+    stock.refresh_from_db()
+    assert stock.quantity == 3
+    assert Stock.objects.get(product=speaker, sales_point=sales_point).quantity == 4
+    assert StockMovement.objects.filter(sales_point=sales_point, reason="Recuento").count() == 2
+    assert ProductAvailability.objects.get(product=speaker).available_quantity == 4
+
+    with pytest.raises(NegativeStockError):
+        change_stock({(headphones.id, sales_point.id): -4}, reason="Venta")
+    stock.refresh_from_db()
+    assert stock.quantity == 3
+    assert not StockMovement.objects.filter(sales_point=sales_point, reason="Venta").exists()
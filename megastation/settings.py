@@ -5,6 +5,7 @@ Generated by 'django-admin startproject' using Django 5.1.6.
 import os
 from pathlib import Path
 from datetime import timedelta
+from celery.schedules import crontab
 from dotenv import load_dotenv
 import sys
 import tempfile
@@ -36,6 +37,7 @@ INSTALLED_APPS = [
     'cart',
     'purchases',
     'inventory',
+    'analytics',
 ]
 
 MIDDLEWARE = [
@@ -148,6 +150,116 @@ CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = "redis://localhost:6379/0"
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+CELERY_BEAT_SCHEDULE = {
+    'release-expired-reservations': {
+        'task': 'orders.tasks.release_expired_reservations',
+        'schedule': timedelta(minutes=5),
+    },
+    'relay-outbox-events': {
+        'task': 'orders.tasks.relay_outbox_events',
+        'schedule': timedelta(minutes=1),
+    },
+    'purge-idempotency-keys': {
+        'task': 'orders.tasks.purge_idempotency_keys',
+        'schedule': timedelta(hours=1),
+    },
+    'reconcile-stale-payments': {
+        'task': 'orders.tasks.reconcile_stale_payments',
+        'schedule': timedelta(minutes=10),
+    },
+    'requeue-stale-checkouts': {
+        'task': 'orders.tasks.requeue_stale_checkouts',
+        'schedule': timedelta(minutes=5),
+    },
+    'export-analytics-snapshots': {
+        'task': 'analytics.tasks.export_analytics_snapshots',
+        'schedule': crontab(hour=3, minute=30),
+    },
+    'refresh-inventory-performance': {
+        'task': 'analytics.tasks.refresh_inventory_performance',
+        'schedule': timedelta(hours=1),
+    },
+    'generate-reorder-invoices': {
+        'task': 'purchases.tasks.generate_reorder_invoices',
+        'schedule': crontab(hour=4, minute=0),
+    },
+}
+
+# Время жизни резерва для неоплаченных заказов ('pendiente') по способу оплаты; None — без срока.
+ORDER_RESERVATION_TTL = {
+    'mercado_pago': timedelta(minutes=30),
+    'cash': timedelta(hours=72),
+    'card': None,
+}
+ORDER_RESERVATION_RELEASE_BATCH_SIZE = 200
+# Order events (orders.OutboxEvent) are relayed in batches after commit; a failed
+# event waits OUTBOX_RETRY_DELAY, doubled on each further failure, and is left
+# undelivered after OUTBOX_MAX_ATTEMPTS (1, 2, 4 and 8 minutes: about a quarter of an hour).
+OUTBOX_RELAY_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = timedelta(minutes=1)
+# How long a client's Idempotency-Key (order creation) replays its first response.
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+# Payment webhooks are acknowledged at once and reconciled by a Celery task; the
+# gateway (a dotted path, so tests can use a fake) is retried with a delay that
+# doubles from PAYMENT_RECONCILE_RETRY_DELAY seconds.
+PAYMENT_GATEWAY = 'orders.payments.MercadoPagoGateway'
+PAYMENT_RECONCILE_MAX_RETRIES = 6
+PAYMENT_RECONCILE_RETRY_DELAY = 10
+PAYMENT_RECONCILE_SWEEP_WINDOW = timedelta(hours=24)
+# Asynchronous checkout (/api/orders/checkout/): tickets are placed by product
+# partition on the Celery queues checkout-0 .. checkout-<N-1>. Run one worker
+# with concurrency 1 per queue, e.g. `celery -A megastation worker -Q checkout-0 -c 1`.
+CHECKOUT_PARTITIONS = 4
+# A sent ticket still queued after CHECKOUT_REQUEUE_AFTER is presumed lost and
+# sent again, waiting twice as long before each further resend.
+CHECKOUT_REQUEUE_AFTER = timedelta(minutes=10)
+CHECKOUT_MAX_REQUEUES = 3
+# Digest mode: when set, staff get one email per sales point every N minutes
+# listing the new orders instead of one email per order.
+ORDER_NOTIFICATION_DIGEST_MINUTES = None
+if ORDER_NOTIFICATION_DIGEST_MINUTES:
+    CELERY_BEAT_SCHEDULE['send-staff-order-digests'] = {
+        'task': 'orders.tasks.send_staff_order_digests',
+        'schedule': timedelta(minutes=ORDER_NOTIFICATION_DIGEST_MINUTES),
+    }
+
+# Invoice numbers are PREFIX-YYYYMMDD-NNNNN with a counter per day (and per
+# sales point when enabled: INV3-20260317-00001).
+INVOICE_NUMBER_PREFIX = 'INV'
+INVOICE_NUMBER_PER_SALES_POINT = False
+
+# Demand-driven reorder (purchases.reorder): daily sales history and short moving
+# average window, supplier lead time, days of demand to order for, safety-stock
+# z-score (1.65 ≈ 95% service level) and the supplier name on the draft invoices.
+REORDER_HISTORY_DAYS = 56
+REORDER_SHORT_WINDOW_DAYS = 7
+REORDER_LEAD_TIME_DAYS = 7
+REORDER_COVER_DAYS = 14
+REORDER_SERVICE_LEVEL_Z = 1.65
+REORDER_SUPPLIER = 'Reposición sugerida'
+
+# Analytics reports are cached per role, sales point and window until a write
+# bumps their version stamp (see analytics.cache); this is only a safety net.
+ANALYTICS_CACHE_TIMEOUT = 60 * 60
+# Closed time-series buckets and cohort matrices are dropped when a late write
+# touches their days; the timeout only bounds a bucket cached from a racing read.
+ANALYTICS_BUCKET_TIMEOUT = 24 * 60 * 60
+# Analytics days, weeks and months are cut in the stores' local time; hourly
+# series are computed from raw orders, so their range is capped.
+ANALYTICS_TIME_ZONE = 'America/Argentina/Buenos_Aires'
+ANALYTICS_MAX_HOURLY_DAYS = 31
+# Independent analytics queries run on up to this many threads (own DB connections); 1 disables it.
+ANALYTICS_QUERY_WORKERS = 4
+# Rows fetched per server-side cursor round trip (and lines per streamed chunk) in analytics exports.
+ANALYTICS_EXPORT_CHUNK_SIZE = 2000
+# Closed days are exported nightly as Parquet partitions for the historical
+# reports (analytics.snapshots); requires pyarrow and duckdb.
+ANALYTICS_SNAPSHOT_DIR = os.path.join(BASE_DIR, "analytics_snapshots")
+# Inventory performance report (analytics.InventoryPerformance): sales window in
+# closed days and the cumulative revenue shares (%) that close classes A and B.
+ANALYTICS_INVENTORY_WINDOW_DAYS = 90
+ANALYTICS_ABC_THRESHOLDS = (80, 95)
 
 MEDIA_URL = "/media/"
 if 'test' in sys.argv:
@@ -3,7 +3,9 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from analytics.views import AnalyticsView
+from analytics.views import (
+    AnalyticsView, AnalyticsExportView, AnalyticsHistoryView, AnalyticsCohortView, InventoryPerformanceListView,
+)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -16,6 +18,10 @@ urlpatterns = [
     path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("api/analytics/", AnalyticsView.as_view(), name="analytics"),
+    path("api/analytics/export/", AnalyticsExportView.as_view(), name="analytics_export"),
+    path("api/analytics/history/", AnalyticsHistoryView.as_view(), name="analytics_history"),
+    path("api/analytics/cohorts/", AnalyticsCohortView.as_view(), name="analytics_cohorts"),
+    path("api/analytics/inventory/", InventoryPerformanceListView.as_view(), name="analytics_inventory"),
 ]
 
 if settings.DEBUG:
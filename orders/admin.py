@@ -1,7 +1,10 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db import transaction
 from .models import Order, OrderItem
-from store.models import Product
-from inventory.models import Stock, StockMovement  # ✅ Используем Stock
+from .reservations import InsufficientStockError, release_order_stock, reserve_order_stock
+
+# Statuses whose orders hold reserved stock (see orders.reservations).
+HOLDING_STATUSES = ('pendiente', 'en_proceso')
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -17,91 +20,73 @@ class OrderAdmin(admin.ModelAdmin):
 
     def save_model(self, request, obj, form, change):
         """
-        ✅ Управляет списанием и возвратом товаров при изменении статуса заказа.
+        ✅ Резервирует и освобождает сток при изменении статуса заказа.
         """
         if change:  # Проверяем, что заказ уже существует (не новый)
-            old_order = Order.objects.get(pk=obj.pk)  # Получаем старый статус
+            old_order = Order.objects.select_for_update().get(pk=obj.pk)  # Получаем старый статус
 
-            # 🔥 Если заказ отменяли, а теперь активируют → нужно списать товары
-            if old_order.status == "cancelado" and obj.status != "cancelado":
-                self.deduct_stock(obj)
+            # 🔥 Если заказ отменяли, а теперь активируют → нужно зарезервировать товары
+            if old_order.status == "cancelado" and obj.status in HOLDING_STATUSES:
+                self.reserve_stock(obj)
 
-            # 🔥 Если заказ активный, а теперь отменяют → нужно вернуть товары
-            elif old_order.status != "cancelado" and obj.status == "cancelado":
-                self.restore_stock(obj)
+            # 🔥 Если заказ держал резерв, а теперь отменяют → нужно освободить товары
+            elif old_order.status in HOLDING_STATUSES and obj.status == "cancelado":
+                self.release_stock(obj)
 
         super().save_model(request, obj, form, change)
 
-    def deduct_stock(self, order):
+    def reserve_stock(self, order):
         """
-        ✅ Списывает товары при повторной активации заказа через `Stock`.
+        ✅ Резервирует товары при повторной активации заказа (`reserve_order_stock`).
         """
-        stock_movements = []
-        updated_stocks = []
-
-        for item in order.items.all():
-            stock = Stock.objects.filter(product=item.product).first()
-            if not stock or stock.quantity < item.quantity:
-                raise ValueError(f"Stock insuficiente para {item.product.name}.")
-
-            stock.quantity -= item.quantity
-            updated_stocks.append(stock)
-
-            stock_movements.append(StockMovement(
-                product=item.product,
-                change=-item.quantity,
-                reason=f"Reactivación de pedido {order.id} (Admin)"
-            ))
-
-        if updated_stocks:
-            Stock.objects.bulk_update(updated_stocks, ['quantity'])
-            StockMovement.objects.bulk_create(stock_movements)
-
-    def restore_stock(self, order):
+        try:
+            reserve_order_stock(order)
+        except InsufficientStockError as e:
+            raise ValueError(f"Stock insuficiente para reactivar el pedido {order.id}.") from e
+        if order.status == "pendiente":
+            order.reset_reservation_expiry()
+
+    def release_stock(self, order):
         """
-        ✅ Возвращает товары при отмене заказа через `Stock`.
+        ✅ Освобождает зарезервированные товары при отмене заказа (`release_order_stock`).
         """
-        stock_movements = []
-        updated_stocks = []
-
-        for item in order.items.all():
-            stock = Stock.objects.filter(product=item.product).first()
-            if stock:
-                stock.quantity += item.quantity
-                updated_stocks.append(stock)
-
-                stock_movements.append(StockMovement(
-                    product=item.product,
-                    change=item.quantity,
-                    reason=f"Cancelación de pedido {order.id} (Admin)"
-                ))
+        release_order_stock(order)
 
-        if updated_stocks:
-            Stock.objects.bulk_update(updated_stocks, ['quantity'])
-            StockMovement.objects.bulk_create(stock_movements)
-
-    @admin.action(description="Cancelar pedidos seleccionados y devolver stock")
+    @admin.action(description="Cancelar pedidos seleccionados y liberar su stock")
     def cancel_orders(self, request, queryset):
         """
-        ✅ Массовая отмена заказов и возврат товаров через `Stock`.
+        ✅ Массовая отмена заказов и освобождение их резерва.
         """
-        for order in queryset:
-            if order.status != "enviado":
+        for order_id in queryset.values_list('id', flat=True):
+            with transaction.atomic():
+                order = Order.objects.select_for_update().get(pk=order_id)
+                if order.status in ("enviado", "completado", "cancelado"):
+                    continue
+                if order.status in HOLDING_STATUSES:
+                    self.release_stock(order)
                 order.status = "cancelado"
-                self.restore_stock(order)
                 order.save()
-        self.message_user(request, "Pedidos cancelados y stock devuelto con éxito.")
+        self.message_user(request, "Pedidos cancelados y stock liberado con éxito.")
 
-    @admin.action(description="Reactivar pedidos seleccionados y descontar stock")
+    @admin.action(description="Reactivar pedidos seleccionados y reservar su stock")
     def reactivate_orders(self, request, queryset):
         """
-        ✅ Массовая реактивация заказов и списание товаров через `Stock`.
+        ✅ Массовая реактивация заказов и резервирование товаров.
         """
-        for order in queryset:
-            if order.status == "cancelado":
-                order.status = "pendiente"
-                self.deduct_stock(order)
-                order.save()
-        self.message_user(request, "Pedidos reactivados y stock descontado con éxito.")
+        failed = []
+        for order_id in queryset.values_list('id', flat=True):
+            try:
+                with transaction.atomic():
+                    order = Order.objects.select_for_update().get(pk=order_id)
+                    if order.status != "cancelado":
+                        continue
+                    order.status = "pendiente"
+                    self.reserve_stock(order)
+                    order.save()
+            except ValueError:
+                failed.append(order_id)
+        if failed:
+            self.message_user(request, f"Stock insuficiente para reactivar los pedidos {failed}.", level=messages.WARNING)
+        self.message_user(request, "Pedidos reactivados y stock reservado con éxito.")
 
 admin.site.register(Order, OrderAdmin)
@@ -0,0 +1,156 @@
+"""
+Order placement, shared by the synchronous and the asynchronous checkout.
+
+`parse_cart` validates a cart and `place_order` reserves its stock and
+creates the order inside the caller's transaction. The asynchronous checkout
+validates the cart in the request and stores it as a CheckoutTicket. The ticket
+is queued on the Celery queue of its product partition
+(`checkout-<partition>`, one worker with concurrency 1 each), so the orders of
+a partition are placed one after another instead of piling up on the locks of
+the same hot Stock rows.
+
+Known limit: a cart spanning several partitions goes to the lowest one only,
+so its other products are reserved outside their own partition's serial order
+and may still wait on row locks held by that partition's worker. The row locks
+taken by `reserve_stock` keep it correct, just not serialized.
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import now
+from store.models import Product
+from .models import CheckoutTicket, Order, OrderItem
+from .outbox import record_event
+from .reservations import record_reservations, reserve_stock
+
+logger = logging.getLogger(__name__)
+
+
+class CartError(Exception):
+    """The cart cannot be placed as sent; the message is shown to the customer."""
+
+
+def parse_cart(data):
+    """
+    Validates the `items` and `payment_method` of a cart. Returns
+    ({product_id: quantity}, {product_id: product}, payment_method) or raises
+    CartError.
+    """
+    cart_items = data.get("items", [])
+    payment_method = data.get("payment_method", "cash")
+
+    if not cart_items:
+        raise CartError("El carrito está vacío.")
+
+    aggregated_items = defaultdict(int)
+    for item in cart_items:
+        try:
+            product_id = int(item['id'])
+            quantity = int(item['quantity'])
+        except (ValueError, TypeError, KeyError):
+            raise CartError("Datos de carrito inválidos: ID y cantidad deben ser números.")
+        if quantity <= 0:
+            raise CartError(f"La cantidad para el producto ID {product_id} debe ser positiva.")
+        aggregated_items[product_id] += quantity
+
+    product_ids = list(aggregated_items.keys())
+    products = Product.objects.filter(id__in=product_ids).in_bulk()
+    missing_ids = [product_id for product_id in product_ids if product_id not in products]
+    if missing_ids:
+        raise CartError(f"Producto con ID {missing_ids[0]} no encontrado.")
+    return dict(aggregated_items), products, payment_method
+
+
+def insufficient_stock_detail(error, products):
+    if error.product_id is None:
+        return "No se pudo reservar el stock, inténtelo de nuevo."
+    return f"Stock insuficiente para '{products[error.product_id].name}'. Hay {error.available} disponibles en total."
+
+
+def place_order(user, quantities, products, payment_method):
+    """
+    Reserves the stock of a parsed cart and creates its order in the current
+    transaction. Raises InsufficientStockError; the caller rolls back.
+    """
+    allocations = reserve_stock(quantities)
+
+    total_price = Decimal('0.0')
+    total_cost_price = Decimal('0.0')
+    order_items_to_create = []
+
+    for product_id, quantity in quantities.items():
+        product = products[product_id]
+        item_price = product.price
+        # FIX: Safely get cost_price, defaulting to 0 if not present.
+        item_cost_price = getattr(product, 'cost_price', 0)
+
+        total_price += item_price * quantity
+        total_cost_price += item_cost_price * quantity
+
+        # The item is attributed to the sales point that holds most of its units.
+        main_stock, _ = max(allocations[product_id], key=lambda allocation: allocation[1])
+
+        order_items_to_create.append(
+            OrderItem(
+                product=product,
+                sales_point_id=main_stock.sales_point_id,
+                quantity=quantity,
+                price=item_price,  # Use the correct price at the time of order
+                cost_price=item_cost_price # Use the safely obtained cost price
+            )
+        )
+
+    order_status = 'en_proceso' if payment_method == 'card' else 'pendiente'
+    order = Order.objects.create(
+        user=user,
+        total_price=total_price,
+        total_cost_price=total_cost_price,
+        status=order_status,
+        payment_method=payment_method
+    )
+
+    for item in order_items_to_create:
+        item.order = order
+
+    OrderItem.objects.bulk_create(order_items_to_create)
+    record_reservations(order_items_to_create, allocations)
+    # Staff is notified by the outbox relay once this transaction commits.
+    record_event(order, 'order_created')
+    return order
+
+
+def partition_for(product_ids):
+    """Partition of a cart: that of its lowest product id (see the known limit above)."""
+    return min(product_ids) % settings.CHECKOUT_PARTITIONS
+
+
+def queue_name(partition):
+    return f"checkout-{partition}"
+
+
+def enqueue(ticket):
+    from .tasks import place_checkout
+
+    try:
+        place_checkout.apply_async(args=[ticket.id], queue=queue_name(ticket.partition))
+    except Exception:
+        logger.warning(f"Could not enqueue checkout ticket {ticket.id}; the periodic sweep will queue it.", exc_info=True)
+    else:
+        CheckoutTicket.objects.filter(id=ticket.id).update(enqueued_at=now(), enqueue_count=F("enqueue_count") + 1)
+
+
+def create_ticket(user, quantities, payment_method):
+    """Stores a validated cart as a queued ticket, sent to its partition queue once the transaction commits."""
+    ticket = CheckoutTicket.objects.create(
+        user=user,
+        partition=partition_for(quantities),
+        payload={
+            "items": [{"id": product_id, "quantity": quantity} for product_id, quantity in quantities.items()],
+            "payment_method": payment_method,
+        },
+    )
+    transaction.on_commit(lambda: enqueue(ticket))
+    return ticket
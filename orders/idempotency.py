@@ -0,0 +1,72 @@
+"""
+`Idempotency-Key` support for unsafe endpoints.
+
+The key is claimed by inserting its row inside the request transaction. A
+concurrent retry blocks on the unique constraint until the first request
+commits and then replays its stored response; if the first request rolls
+back, the retry runs as if it were the first. Keys expire after
+IDEMPOTENCY_KEY_TTL and are purged by orders.tasks.purge_idempotency_keys.
+"""
+import hashlib
+import json
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils.timezone import now
+from rest_framework import status
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+
+
+def request_hash(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+
+def claim(user, scope, key, data):
+    """
+    Claims `key` for this request. Returns (record, None) when the request
+    should run, or (None, response) when it must be answered without running:
+    the stored response of an earlier request with the same key and body, or
+    422 when the key was used with a different body. Call inside the request
+    transaction.
+    """
+    digest = request_hash(data)
+    expires_at = now() + settings.IDEMPOTENCY_KEY_TTL
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, scope=scope, key=key, request_hash=digest, expires_at=expires_at,
+            ), None
+    except IntegrityError:
+        record = IdempotencyKey.objects.select_for_update().get(user=user, scope=scope, key=key)
+
+    if record.expires_at <= now():
+        record.request_hash, record.expires_at = digest, expires_at
+        record.response_status = record.response_body = None
+        record.save(update_fields=["request_hash", "expires_at", "response_status", "response_body"])
+        return record, None
+    if record.request_hash != digest:
+        return None, Response(
+            {"detail": f"La clave {HEADER} ya se usó con otra solicitud."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if record.response_status is None:
+        return None, Response(
+            {"detail": "La solicitud original todavía se está procesando."}, status=status.HTTP_409_CONFLICT,
+        )
+    return None, Response(record.response_body, status=record.response_status, headers={"Idempotent-Replayed": "true"})
+
+
+def store(record, response):
+    """
+    Saves a successful response under the claimed key. Other responses roll the
+    request transaction back instead, releasing the key so the client can retry.
+    """
+    if response.status_code >= 300:
+        transaction.set_rollback(True)
+        return
+    record.response_status = response.status_code
+    record.response_body = response.data
+    record.save(update_fields=["response_status", "response_body"])
@@ -0,0 +1,24 @@
+# Generated by Django 5.2 on 2026-10-17 23:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0011_stockreservation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='reservation_expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Vencimiento de la reserva'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('reservation_expires_at__isnull', False), ('status', 'pendiente')), fields=['reservation_expires_at'], name='order_reservation_expiry_idx'),
+        ),
+    ]
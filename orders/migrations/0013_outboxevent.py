@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 00:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0012_order_reservation_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('order_created', 'Pedido creado'), ('status_changed', 'Cambio de estado'), ('cancelled', 'Pedido cancelado')], max_length=20, verbose_name='Tipo de evento')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='Datos')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('dispatched_at', models.DateTimeField(blank=True, null=True, verbose_name='Fecha de envío')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Intentos fallidos')),
+                ('last_error', models.TextField(blank=True, verbose_name='Último error')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_events', to='orders.order', verbose_name='Orden')),
+            ],
+            options={
+                'verbose_name': 'Evento pendiente',
+                'verbose_name_plural': 'Eventos pendientes',
+                'indexes': [models.Index(condition=models.Q(('dispatched_at__isnull', True)), fields=['id'], name='outbox_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2 on 2026-10-18 00:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0013_outboxevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_id', models.CharField(max_length=64, unique=True, verbose_name='ID de pago')),
+                ('payment_status', models.CharField(blank=True, max_length=30, verbose_name='Estado del pago')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de recepción')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Fecha de procesamiento')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_notifications', to='orders.order', verbose_name='Orden')),
+            ],
+            options={
+                'verbose_name': 'Notificación de pago',
+                'verbose_name_plural': 'Notificaciones de pago',
+            },
+        ),
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=50, verbose_name='Operación')),
+                ('key', models.CharField(max_length=255, verbose_name='Clave')),
+                ('request_hash', models.CharField(max_length=64, verbose_name='Hash de la solicitud')),
+                ('response_status', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Código de respuesta')),
+                ('response_body', models.JSONField(blank=True, null=True, verbose_name='Respuesta')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('expires_at', models.DateTimeField(verbose_name='Vencimiento')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Clave de idempotencia',
+                'verbose_name_plural': 'Claves de idempotencia',
+                'indexes': [models.Index(fields=['expires_at'], name='idempotency_key_expiry_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'scope', 'key'), name='idempotency_key_user_scope_key')],
+            },
+        ),
+    ]
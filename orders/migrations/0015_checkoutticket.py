@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-18 00:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0014_idempotencykey_paymentnotification'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckoutTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'En cola'), ('placed', 'Realizado'), ('failed', 'Rechazado')], default='queued', max_length=10, verbose_name='Estado')),
+                ('partition', models.PositiveSmallIntegerField(verbose_name='Partición')),
+                ('payload', models.JSONField(verbose_name='Carrito')),
+                ('detail', models.TextField(blank=True, verbose_name='Detalle')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Fecha de actualización')),
+                ('order', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='checkout_ticket', to='orders.order', verbose_name='Orden')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkout_tickets', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Ticket de compra',
+                'verbose_name_plural': 'Tickets de compra',
+                'indexes': [models.Index(condition=models.Q(('status', 'queued')), fields=['created_at'], name='checkout_queued_idx')],
+            },
+        ),
+    ]
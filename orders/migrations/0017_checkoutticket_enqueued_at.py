@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0016_outboxevent_next_attempt_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkoutticket',
+            name='enqueue_count',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Envíos a la cola'),
+        ),
+        migrations.AddField(
+            model_name='checkoutticket',
+            name='enqueued_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Último envío a la cola'),
+        ),
+    ]
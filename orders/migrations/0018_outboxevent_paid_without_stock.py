@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 00:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0017_checkoutticket_enqueued_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboxevent',
+            name='event_type',
+            field=models.CharField(choices=[('order_created', 'Pedido creado'), ('status_changed', 'Cambio de estado'), ('cancelled', 'Pedido cancelado'), ('paid_without_stock', 'Pagado sin stock')], max_length=20, verbose_name='Tipo de evento'),
+        ),
+    ]
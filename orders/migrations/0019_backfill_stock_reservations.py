@@ -0,0 +1,52 @@
+from collections import defaultdict
+from django.db import migrations
+
+
+def backfill_stock_reservations(apps, schema_editor):
+    """
+    Records the holds of active orders placed before StockReservation existed,
+    so releases and fulfilments only ever touch recorded reservations. Each
+    item takes the units still reserved on its product's rows and not recorded
+    for another order, from its own sales point first.
+    """
+    Stock = apps.get_model('inventory', 'Stock')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    StockReservation = apps.get_model('orders', 'StockReservation')
+
+    items = list(
+        OrderItem.objects.filter(order__status__in=['pendiente', 'en_proceso'], reservations__isnull=True)
+        .order_by('order_id', 'id')
+    )
+    recorded = defaultdict(int)
+    for stock_id, quantity in StockReservation.objects.values_list('stock_id', 'quantity'):
+        recorded[stock_id] += quantity
+    stocks_by_product = defaultdict(list)
+    for stock in Stock.objects.filter(
+        product_id__in={item.product_id for item in items}, reserved_quantity__gt=0,
+    ).order_by('product_id', 'sales_point_id'):
+        stocks_by_product[stock.product_id].append(stock)
+
+    reservations = []
+    for item in items:
+        remaining = item.quantity
+        for stock in sorted(stocks_by_product[item.product_id], key=lambda stock: stock.sales_point_id != item.sales_point_id):
+            take = min(remaining, stock.reserved_quantity - recorded[stock.id])
+            if take > 0:
+                reservations.append(StockReservation(order_item_id=item.id, stock_id=stock.id, quantity=take))
+                recorded[stock.id] += take
+                remaining -= take
+            if not remaining:
+                break
+    StockReservation.objects.bulk_create(reservations, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_productavailability'),
+        ('orders', '0018_outboxevent_paid_without_stock'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_stock_reservations, migrations.RunPython.noop),
+    ]
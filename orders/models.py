@@ -1,4 +1,5 @@
 from django.db import models
+from django.conf import settings
 from users.models import CustomUser
 from store.models import Product
 from inventory.models import Stock, SalesPoint # Import SalesPoint
@@ -27,13 +28,34 @@ class Order(models.Model):
     total_cost_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, verbose_name="Costo total")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de creación")
     payment_method = models.CharField(max_length=20, choices=PAYMENT_CHOICES, default='card', verbose_name="Método de pago")
+    # Unpaid orders release their reserved stock after this moment (see orders.tasks.release_expired_reservations).
+    reservation_expires_at = models.DateTimeField(null=True, blank=True, verbose_name="Vencimiento de la reserva")
 
     def __str__(self):
         return f"Orden {self.id} - {self.user.username} - {self.get_status_display()}"
 
+    def reset_reservation_expiry(self):
+        """Starts the reservation TTL configured for the payment method (None never expires)."""
+        ttl = settings.ORDER_RESERVATION_TTL.get(self.payment_method)
+        self.reservation_expires_at = now() + ttl if ttl else None
+
+    def save(self, *args, **kwargs):
+        if self.status != 'pendiente':
+            self.reservation_expires_at = None
+        elif self._state.adding and self.reservation_expires_at is None:
+            self.reset_reservation_expiry()
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Orden"
         verbose_name_plural = "Órdenes"
+        indexes = [
+            models.Index(
+                fields=["reservation_expires_at"],
+                name="order_reservation_expiry_idx",
+                condition=models.Q(status="pendiente", reservation_expires_at__isnull=False),
+            ),
+        ]
 
 class OrderItem(models.Model):
     DELIVERY_CHOICES = (
@@ -56,3 +78,130 @@ class OrderItem(models.Model):
     class Meta:
         verbose_name = "Artículo en la orden"
         verbose_name_plural = "Artículos en la orden"
+
+class StockReservation(models.Model):
+    """Units of an order item held on a specific Stock row until the order is fulfilled or released."""
+    order_item = models.ForeignKey(OrderItem, on_delete=models.CASCADE, related_name="reservations", verbose_name="Artículo")
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name="reservations", verbose_name="Stock")
+    quantity = models.PositiveIntegerField(verbose_name="Cantidad reservada")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de reserva")
+
+    def __str__(self):
+        return f"{self.quantity} x {self.stock} (Artículo {self.order_item_id})"
+
+    class Meta:
+        verbose_name = "Reserva de stock"
+        verbose_name_plural = "Reservas de stock"
+
+
+class OutboxEvent(models.Model):
+    """
+    An order event written in the same transaction as the change it describes.
+    orders.tasks.relay_outbox_events delivers it after commit, so requests never
+    wait for the mail server and rolled back changes never notify anyone.
+    """
+    EVENT_TYPES = (
+        ('order_created', 'Pedido creado'),
+        ('status_changed', 'Cambio de estado'),
+        ('cancelled', 'Pedido cancelado'),
+        ('paid_without_stock', 'Pagado sin stock'),
+    )
+
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPES, verbose_name="Tipo de evento")
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="outbox_events", verbose_name="Orden")
+    payload = models.JSONField(default=dict, blank=True, verbose_name="Datos")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de creación")
+    dispatched_at = models.DateTimeField(null=True, blank=True, verbose_name="Fecha de envío")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Intentos fallidos")
+    last_error = models.TextField(blank=True, verbose_name="Último error")
+    # After a failed attempt the event waits until then (backoff), see orders.outbox.record_failure.
+    next_attempt_at = models.DateTimeField(null=True, blank=True, verbose_name="Próximo intento")
+
+    def __str__(self):
+        return f"{self.get_event_type_display()} - Orden {self.order_id}"
+
+    class Meta:
+        verbose_name = "Evento pendiente"
+        verbose_name_plural = "Eventos pendientes"
+        indexes = [
+            models.Index(fields=["id"], name="outbox_pending_idx", condition=models.Q(dispatched_at__isnull=True)),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """
+    A client-supplied `Idempotency-Key` and the response it produced. A retry
+    with the same key and body is answered from here instead of running the
+    request again (see orders.idempotency).
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="idempotency_keys", verbose_name="Usuario")
+    scope = models.CharField(max_length=50, verbose_name="Operación")
+    key = models.CharField(max_length=255, verbose_name="Clave")
+    request_hash = models.CharField(max_length=64, verbose_name="Hash de la solicitud")
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Código de respuesta")
+    response_body = models.JSONField(null=True, blank=True, verbose_name="Respuesta")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de creación")
+    expires_at = models.DateTimeField(verbose_name="Vencimiento")
+
+    def __str__(self):
+        return f"{self.scope}:{self.key} ({self.user_id})"
+
+    class Meta:
+        verbose_name = "Clave de idempotencia"
+        verbose_name_plural = "Claves de idempotencia"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "scope", "key"], name="idempotency_key_user_scope_key"),
+        ]
+        indexes = [
+            models.Index(fields=["expires_at"], name="idempotency_key_expiry_idx"),
+        ]
+
+
+class PaymentNotification(models.Model):
+    """A notified MercadoPago payment; `processed_at` is set once its final status is applied and redeliveries are ignored."""
+    payment_id = models.CharField(max_length=64, unique=True, verbose_name="ID de pago")
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name="payment_notifications", verbose_name="Orden")
+    payment_status = models.CharField(max_length=30, blank=True, verbose_name="Estado del pago")
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de recepción")
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name="Fecha de procesamiento")
+
+    def __str__(self):
+        return f"Pago {self.payment_id} ({self.payment_status or 'sin procesar'})"
+
+    class Meta:
+        verbose_name = "Notificación de pago"
+        verbose_name_plural = "Notificaciones de pago"
+
+
+class CheckoutTicket(models.Model):
+    """
+    An order queued by the asynchronous checkout. The cart is validated when
+    the ticket is created and placed later by `orders.tasks.place_checkout` on
+    the queue of its product partition (see orders.checkout).
+    """
+    STATUS_CHOICES = (
+        ('queued', 'En cola'),
+        ('placed', 'Realizado'),
+        ('failed', 'Rechazado'),
+    )
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="checkout_tickets", verbose_name="Usuario")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued', verbose_name="Estado")
+    partition = models.PositiveSmallIntegerField(verbose_name="Partición")
+    payload = models.JSONField(verbose_name="Carrito")
+    order = models.OneToOneField(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name="checkout_ticket", verbose_name="Orden")
+    detail = models.TextField(blank=True, verbose_name="Detalle")
+    enqueued_at = models.DateTimeField(null=True, blank=True, verbose_name="Último envío a la cola")
+    enqueue_count = models.PositiveSmallIntegerField(default=0, verbose_name="Envíos a la cola")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de creación")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Fecha de actualización")
+
+    def __str__(self):
+        return f"Ticket {self.id} - {self.get_status_display()}"
+
+    class Meta:
+        verbose_name = "Ticket de compra"
+        verbose_name_plural = "Tickets de compra"
+        indexes = [
+            models.Index(fields=["created_at"], name="checkout_queued_idx", condition=models.Q(status="queued")),
+        ]
@@ -0,0 +1,73 @@
+"""
+Order notification emails.
+
+Messages are built here and delivered in batches over one backend connection
+(`deliver`), instead of one SMTP session per message as with `send_mail`.
+"""
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+
+def _item_lines(order):
+    return ", ".join(f"{item.quantity} x {item.product.name}" for item in order.items.all())
+
+
+def order_created_message(order, sales_point, staff_emails):
+    """Staff notification of a new order supplied by `sales_point`."""
+    return EmailMessage(
+        subject=f"Nuevo pedido #{order.id} en {sales_point.name}",
+        body=f"Se ha creado un nuevo pedido #{order.id} el {order.created_at}.\n"
+             f"Cliente: {order.user.username}\n"
+             f"Total: ${order.total_price}\n"
+             f"Detalles: {_item_lines(order)}",
+        from_email=settings.EMAIL_HOST_USER,
+        to=staff_emails,
+    )
+
+
+def paid_without_stock_message(order, payment_id, staff_emails):
+    """Staff alert for an approved payment whose order could not get its stock back."""
+    return EmailMessage(
+        subject=f"Pedido #{order.id} pagado sin stock",
+        body=f"El pago {payment_id} del pedido #{order.id} fue aprobado, pero el stock ya no está disponible.\n"
+             f"El pedido sigue en estado: {order.status}. Revíselo y, si corresponde, reembolse el pago.\n"
+             f"Cliente: {order.user.username}\n"
+             f"Total: ${order.total_price}\n"
+             f"Detalles: {_item_lines(order)}",
+        from_email=settings.EMAIL_HOST_USER,
+        to=staff_emails,
+    )
+
+
+def order_status_message(user_email, order_id, new_status):
+    """Customer notification of an order status change."""
+    return EmailMessage(
+        subject=f"Tu pedido #{order_id} ha cambiado de estado",
+        body=f"Hola,\n\nTu pedido ahora está en estado: {new_status}.\n\nGracias por tu compra en Megastation.",
+        from_email=settings.EMAIL_HOST_USER,
+        to=[user_email],
+    )
+
+
+def staff_digest_message(sales_point, orders, staff_emails):
+    """One email listing every new order of a sales point since the previous digest."""
+    lines = [
+        f"#{order.id} - {order.created_at:%d/%m %H:%M} - {order.user.username} - ${order.total_price}: {_item_lines(order)}"
+        for order in orders
+    ]
+    return EmailMessage(
+        subject=f"{len(orders)} pedidos nuevos en {sales_point.name}",
+        body="Pedidos recibidos desde el último resumen:\n\n" + "\n".join(lines),
+        from_email=settings.EMAIL_HOST_USER,
+        to=staff_emails,
+    )
+
+
+def deliver(messages, connection=None):
+    """Sends the messages over `connection`, or over one new connection opened for the whole batch."""
+    if not messages:
+        return 0
+    if connection is not None:
+        return connection.send_messages(messages) or 0
+    with get_connection() as connection:
+        return connection.send_messages(messages) or 0
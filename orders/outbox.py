@@ -0,0 +1,215 @@
+"""
+Transactional outbox for order events.
+
+Views record events with `record_event` inside the transaction that changes
+the order; once it commits, `orders.tasks.relay_outbox_events` is queued and
+delivers pending events in batches (`dispatch_events`). The periodic relay run
+picks up anything whose after-commit enqueue was lost, e.g. with the broker down.
+In digest mode new orders are left for `dispatch_digests` instead.
+"""
+import logging
+from collections import defaultdict
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
+from django.utils.timezone import now
+from inventory.models import SalesPoint
+from .models import OrderItem, OutboxEvent
+from .notifications import (
+    deliver, order_created_message, order_status_message, paid_without_stock_message, staff_digest_message,
+)
+
+logger = logging.getLogger(__name__)
+
+# Events sent to the staff of the sales points the order draws stock from.
+STAFF_EVENTS = {"order_created", "paid_without_stock"}
+
+
+def _enqueue_relay():
+    from .tasks import relay_outbox_events
+
+    try:
+        relay_outbox_events.delay()
+    except Exception:
+        logger.warning("Could not enqueue the outbox relay; the periodic run will deliver the events.", exc_info=True)
+
+
+def record_events(order_ids, event_type, **payload):
+    """Writes one `event_type` event per order in the current transaction and schedules the relay after commit."""
+    OutboxEvent.objects.bulk_create([
+        OutboxEvent(order_id=order_id, event_type=event_type, payload=payload) for order_id in order_ids
+    ])
+    transaction.on_commit(_enqueue_relay)
+
+
+def record_event(order, event_type, **payload):
+    record_events([order.id], event_type, **payload)
+
+
+def due(events):
+    """Narrows an OutboxEvent queryset to undelivered events that may be attempted now."""
+    return events.filter(
+        Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now()),
+        dispatched_at__isnull=True, attempts__lt=settings.OUTBOX_MAX_ATTEMPTS,
+    )
+
+
+def record_failure(event, exc):
+    """
+    Counts a failed attempt and holds the event back for OUTBOX_RETRY_DELAY,
+    doubled on each further failure, so a short mail server outage does not use
+    up OUTBOX_MAX_ATTEMPTS within one relay run.
+    """
+    event.attempts += 1
+    event.last_error = str(exc)
+    event.next_attempt_at = now() + settings.OUTBOX_RETRY_DELAY * 2 ** (event.attempts - 1)
+    if event.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        logger.error(f"Outbox event {event.id} ({event.event_type}) dropped after {event.attempts} attempts: {exc}")
+
+
+def staff_recipients(order_ids):
+    """
+    {order_id: [(sales_point, [emails]), ...]} for the sales points the orders
+    draw stock from, skipping sales points without staff emails; four queries.
+    """
+    sales_points = defaultdict(set)
+    for order_id, sales_point_id in (
+        OrderItem.objects.filter(order_id__in=order_ids, sales_point__isnull=False)
+        .values_list("order_id", "sales_point_id").distinct()
+    ):
+        sales_points[order_id].add(sales_point_id)
+
+    sales_point_ids = set().union(*sales_points.values())
+    emails = defaultdict(set)
+    for field in ("administrators__email", "sellers__email"):
+        for sales_point_id, email in SalesPoint.objects.filter(id__in=sales_point_ids).values_list("id", field):
+            if email:
+                emails[sales_point_id].add(email)
+    by_id = SalesPoint.objects.in_bulk([sales_point_id for sales_point_id in sales_point_ids if emails[sales_point_id]])
+    return {
+        order_id: [
+            (by_id[sales_point_id], sorted(emails[sales_point_id]))
+            for sales_point_id in sorted(ids) if sales_point_id in by_id
+        ]
+        for order_id, ids in sales_points.items()
+    }
+
+
+def _messages(event, recipients):
+    if event.event_type == "order_created":
+        return [
+            order_created_message(event.order, sales_point, emails)
+            for sales_point, emails in recipients.get(event.order_id, [])
+        ]
+    if event.event_type == "paid_without_stock":
+        emails = sorted({email for _, emails in recipients.get(event.order_id, []) for email in emails})
+        return [paid_without_stock_message(event.order, event.payload.get("payment_id"), emails)] if emails else []
+    if not event.order.user.email:
+        return []
+    new_status = event.payload.get("status", event.order.status)
+    return [order_status_message(event.order.user.email, event.order_id, new_status)]
+
+
+def _staff_orders(events):
+    orders = [event.order for event in events if event.event_type in STAFF_EVENTS]
+    prefetch_related_objects(orders, "items__product")
+    return orders
+
+
+def dispatch_events(events):
+    """
+    Fans out a batch of events (staff notifications for new orders and paid
+    orders without stock, customer emails for status changes and
+    cancellations) over a single backend connection. Delivered events are stamped `dispatched_at`; failed ones keep
+    their error and are retried with backoff until OUTBOX_MAX_ATTEMPTS. If
+    the connection cannot be opened, every event not yet sent counts as failed.
+    """
+    orders = _staff_orders(events)
+    recipients = staff_recipients([order.id for order in orders]) if orders else {}
+    pending = list(events)
+    try:
+        with get_connection() as connection:
+            while pending:
+                event = pending.pop(0)
+                try:
+                    deliver(_messages(event, recipients), connection=connection)
+                except Exception as exc:
+                    logger.error(f"Outbox event {event.id} ({event.event_type}) failed: {exc}")
+                    record_failure(event, exc)
+                else:
+                    event.dispatched_at = now()
+    except Exception as exc:
+        # The connection itself failed: the events not yet sent back off together.
+        logger.error(f"Outbox batch of {len(events)} events failed: {exc}")
+        for event in pending:
+            record_failure(event, exc)
+    OutboxEvent.objects.bulk_update(events, ["dispatched_at", "attempts", "last_error", "next_attempt_at"])
+
+
+def _send_digests(events):
+    """
+    Sends one digest per sales point for a claimed batch of `order_created`
+    events and marks each event delivered once every sales point it concerns
+    got its digest. Sales points already sent are kept in the event payload, so
+    a retry after a partial failure only goes to the ones that failed.
+    """
+    orders = _staff_orders(events)
+    sent = {event.order_id: set(event.payload.get("digest_sales_points", [])) for event in events}
+    targets = staff_recipients([order.id for order in orders])
+    digests = {}
+    for order_id, order_targets in targets.items():
+        for sales_point, emails in order_targets:
+            if sales_point.id not in sent[order_id]:
+                digests.setdefault(sales_point.id, (sales_point, emails, set()))[2].add(order_id)
+
+    errors = {}
+    try:
+        with get_connection() as connection:
+            for sales_point, emails, order_ids in digests.values():
+                message = staff_digest_message(sales_point, [order for order in orders if order.id in order_ids], emails)
+                try:
+                    deliver([message], connection=connection)
+                except Exception as exc:
+                    logger.error(f"Staff digest for {sales_point.name} ({len(order_ids)} orders) failed: {exc}")
+                    for order_id in order_ids:
+                        errors[order_id] = exc
+                else:
+                    for order_id in order_ids:
+                        sent[order_id].add(sales_point.id)
+    except Exception as exc:
+        # The connection itself failed: nothing of this batch went out.
+        logger.error(f"Staff digest of {len(events)} orders failed: {exc}")
+        errors = {event.order_id: exc for event in events if event.order_id in targets}
+
+    for event in events:
+        if event.order_id in errors:
+            event.payload["digest_sales_points"] = sorted(sent[event.order_id])
+            record_failure(event, errors[event.order_id])
+        else:
+            event.dispatched_at = now()
+    OutboxEvent.objects.bulk_update(events, ["dispatched_at", "attempts", "last_error", "next_attempt_at", "payload"])
+
+
+def dispatch_digests(batch_size):
+    """
+    Sends pending `order_created` events as one digest email per sales point
+    (see orders.tasks.send_staff_order_digests), claiming them in batches with
+    SKIP LOCKED like the relay. Returns the number of events included.
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                due(OutboxEvent.objects.select_for_update(skip_locked=True, of=("self",)))
+                .filter(event_type="order_created")
+                .select_related("order__user")
+                .order_by("id")[:batch_size]
+            )
+            if not events:
+                break
+            _send_digests(events)
+        processed += len(events)
+        if len(events) < batch_size:
+            break
+    return processed
@@ -0,0 +1,105 @@
+"""
+MercadoPago payments.
+
+The gateway client is loaded from the PAYMENT_GATEWAY setting (a dotted path,
+like EMAIL_BACKEND), so tests can plug in a local fake. The webhook stores each
+notification as a PaymentNotification row and answers at once. The
+`orders.tasks.reconcile_payment` task then fetches the payment, retrying the
+gateway with backoff, and applies it with `apply_payment`.
+"""
+import logging
+import mercadopago
+from django.conf import settings
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+from .models import Order
+from .outbox import record_event
+from .reservations import release_order_stock, reserve_order_stock
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = {"approved", "rejected", "cancelled"}
+
+
+class GatewayError(Exception):
+    """The payment gateway answered with an error status."""
+
+
+class MercadoPagoGateway:
+    def __init__(self, access_token=None):
+        self.sdk = mercadopago.SDK(access_token or settings.MERCADOPAGO_ACCESS_TOKEN)
+
+    def _response(self, result):
+        if result.get("status") not in (200, 201):
+            raise GatewayError(f"MercadoPago respondió {result.get('status')}: {result.get('response')}")
+        return result["response"]
+
+    def get_payment(self, payment_id):
+        return self._response(self.sdk.payment().get(payment_id))
+
+    def create_preference(self, preference_data):
+        return self._response(self.sdk.preference().create(preference_data))
+
+
+def get_gateway():
+    return import_string(settings.PAYMENT_GATEWAY)()
+
+
+def apply_payment(notification, payment):
+    """
+    Applies a fetched payment to its order. `notification` must be locked in
+    the current transaction. A final status stamps `processed_at`, so later
+    deliveries are ignored. Other statuses (pending, in_process) leave it open
+    for the next notification of the payment.
+    """
+    notification.payment_status = payment["status"]
+    notification.order = Order.objects.select_for_update().filter(id=payment.get("external_reference")).first()
+    if notification.order is None:
+        logger.error(f"Payment {notification.payment_id} references unknown order {payment.get('external_reference')}.")
+    elif payment["status"] in FINAL_STATUSES:
+        _transition(notification.order, payment["status"])
+    if payment["status"] in FINAL_STATUSES:
+        notification.processed_at = now()
+    notification.save(update_fields=["payment_status", "order", "processed_at"])
+
+
+def record_paid_without_stock(notification, payment):
+    """
+    Closes an approved payment whose order could not reserve its stock again
+    (apply_payment raised InsufficientStockError and was rolled back): stores
+    the fetched status and `processed_at`, so neither redeliveries nor
+    reconcile_stale_payments fetch it again. Staff get a `paid_without_stock`
+    event to refund it or restock by hand. `notification` must be locked in
+    the current transaction.
+    """
+    notification.payment_status = payment["status"]
+    notification.order = Order.objects.filter(id=payment.get("external_reference")).first()
+    notification.processed_at = now()
+    notification.save(update_fields=["payment_status", "order", "processed_at"])
+    if notification.order is not None:
+        record_event(notification.order, "paid_without_stock", payment_id=notification.payment_id)
+
+
+def _transition(order, payment_status):
+    """
+    An approval moves a `pendiente` order, which already holds its stock, to
+    `en_proceso`. A `fallido` or `cancelado` order reserves its stock again
+    first (InsufficientStockError rolls back, see record_paid_without_stock).
+    Orders already `en_proceso`, `enviado` or `completado` are left alone. Any
+    other final status releases and fails only `pendiente` and `en_proceso` orders.
+    """
+    if payment_status == "approved":
+        if order.status in ("fallido", "cancelado"):
+            # The reservation was released before the payment arrived: hold the stock again.
+            reserve_order_stock(order)
+        elif order.status != "pendiente":
+            return
+        new_status = "en_proceso"
+    else:
+        if order.status not in ("pendiente", "en_proceso"):
+            return
+        release_order_stock(order)
+        new_status = "fallido"
+    record_event(order, "status_changed", status=new_status, previous=order.status)
+    order.status = new_status
+    order.save()
@@ -0,0 +1,194 @@
+import logging
+from collections import defaultdict
+from django.db.models import F, Q
+from inventory.models import Stock, ProductAvailability
+from inventory.services import apply_stock_deltas
+from .models import StockReservation
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStockError(Exception):
+    """Raised when the locked Stock rows of a product cannot cover the requested quantity."""
+
+    def __init__(self, product_id, requested, available):
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+        super().__init__(f"Stock insuficiente para el producto {product_id}: {requested} pedidos, {available} disponibles.")
+
+
+class ReservationError(Exception):
+    """Raised when the recorded reservations of an order cannot be released or fulfilled; nothing is changed."""
+
+
+def _allocate(stocks, quantity):
+    """
+    Splits `quantity` over the locked rows of one product. A single row that
+    covers the whole line is preferred so the item ships from one sales point.
+    """
+    for stock in stocks:
+        if stock.quantity - stock.reserved_quantity >= quantity:
+            return [(stock, quantity)]
+
+    allocations = []
+    remaining = quantity
+    for stock in stocks:
+        if remaining <= 0:
+            break
+        take = min(remaining, stock.quantity - stock.reserved_quantity)
+        if take > 0:
+            allocations.append((stock, take))
+            remaining -= take
+    return allocations
+
+
+def reserve_stock(quantities):
+    """
+    Reserves stock for {product_id: quantity} inside the caller's transaction.
+
+    All Stock rows of the involved products are locked with one query in a
+    fixed (product_id, sales_point_id) order, so concurrent checkouts always
+    acquire locks in the same sequence and cannot deadlock. The reservation
+    itself is a single guarded statement:
+
+        UPDATE stock SET reserved_quantity = reserved_quantity + CASE ... END
+        WHERE (id = %s AND quantity >= reserved_quantity + %s) OR ...
+
+    Returns {product_id: [(stock, quantity), ...]} with the rows each product
+    was reserved from. Raises InsufficientStockError if any line cannot be covered.
+    """
+    product_ids = sorted(quantities)
+    stocks = Stock.objects.select_for_update().filter(
+        product_id__in=product_ids
+    ).order_by("product_id", "sales_point_id")
+
+    stocks_by_product = defaultdict(list)
+    for stock in stocks:
+        stocks_by_product[stock.product_id].append(stock)
+
+    allocations = {}
+    for product_id in product_ids:
+        product_stocks = stocks_by_product[product_id]
+        available = sum(stock.quantity - stock.reserved_quantity for stock in product_stocks)
+        if available < quantities[product_id]:
+            raise InsufficientStockError(product_id, quantities[product_id], available)
+        allocations[product_id] = _allocate(product_stocks, quantities[product_id])
+
+    deltas = {stock.pk: quantity for rows in allocations.values() for stock, quantity in rows}
+    if not deltas:
+        return allocations
+
+    applied = apply_stock_deltas(
+        deltas,
+        guard=lambda pk, n: Q(pk=pk, quantity__gte=F("reserved_quantity") + n),
+        reserved_quantity=1,
+    )
+    if not applied:
+        # A guard failed despite the lock (e.g. a writer that does not lock the row).
+        raise InsufficientStockError(None, sum(deltas.values()), None)
+
+    for rows in allocations.values():
+        for stock, quantity in rows:
+            stock.reserved_quantity += quantity
+
+    ProductAvailability.objects.apply_deltas({product_id: -quantities[product_id] for product_id in product_ids})
+    return allocations
+
+
+def record_reservations(order_items, allocations):
+    """Stores which Stock rows hold the units of each freshly created order item."""
+    StockReservation.objects.bulk_create([
+        StockReservation(order_item=item, stock=stock, quantity=quantity)
+        for item in order_items
+        for stock, quantity in allocations[item.product_id]
+    ])
+
+
+def reserve_order_stock(order):
+    """Reserves stock again for every item of an existing order (e.g. one reactivated after failing)."""
+    quantities = defaultdict(int)
+    items = list(order.items.all())
+    for item in items:
+        quantities[item.product_id] += item.quantity
+    allocations = reserve_stock(quantities)
+    record_reservations(items, allocations)
+    return allocations
+
+
+def _collect_holds(order_ids):
+    """
+    Locks the Stock rows holding recorded reservations of the given orders in
+    (product_id, sales_point_id) order, the same order as reserve_stock, so an
+    expiry batch and concurrent checkouts cannot deadlock. Returns
+    ({stock_id: quantity}, {stock_id: locked stock}).
+
+    Only StockReservation rows count (those of orders placed before they
+    existed were backfilled by a migration): an order that holds nothing, e.g.
+    one already released, releases nothing, and never units of other orders.
+    """
+    holds = defaultdict(int)
+    for stock_id, quantity in StockReservation.objects.filter(
+        order_item__order_id__in=order_ids
+    ).values_list("stock_id", "quantity"):
+        holds[stock_id] += quantity
+
+    stocks = Stock.objects.select_for_update().filter(pk__in=list(holds)).order_by("product_id", "sales_point_id")
+    return dict(holds), {stock.pk: stock for stock in stocks}
+
+
+def release_orders_stock(order_ids):
+    """
+    Returns the units reserved by the given orders to sellable stock and drops
+    their reservation records. The whole batch costs a constant number of queries.
+
+    A hold larger than what its locked row still has reserved (e.g. after a
+    manual edit of reserved_quantity) is logged and releases what is left, so
+    the guard below cannot fail on it. If the guard still fails, nothing is
+    released, the reservation records are kept and ReservationError is raised.
+    """
+    order_ids = list(order_ids)
+    holds, stocks = _collect_holds(order_ids)
+    for pk, quantity in holds.items():
+        if quantity > stocks[pk].reserved_quantity:
+            logger.error(
+                f"Stock {pk} holds {stocks[pk].reserved_quantity} reserved units but orders {order_ids} "
+                f"release {quantity}; releasing {stocks[pk].reserved_quantity}."
+            )
+            holds[pk] = stocks[pk].reserved_quantity
+    holds = {pk: quantity for pk, quantity in holds.items() if quantity}
+    if holds:
+        applied = apply_stock_deltas(
+            holds,
+            guard=lambda pk, n: Q(pk=pk, reserved_quantity__gte=n),
+            reserved_quantity=-1,
+        )
+        if not applied:
+            raise ReservationError(f"No se pudo liberar el stock reservado de los pedidos {order_ids}")
+        released = defaultdict(int)
+        for pk, quantity in holds.items():
+            released[stocks[pk].product_id] += quantity
+        ProductAvailability.objects.apply_deltas(released)
+    StockReservation.objects.filter(order_item__order_id__in=order_ids).delete()
+
+
+def release_order_stock(order):
+    """Returns the units reserved by `order` to sellable stock and drops its reservation records."""
+    release_orders_stock([order.pk])
+
+
+def fulfill_order_stock(order):
+    """Ships the units reserved by `order`: both `quantity` and `reserved_quantity` go down."""
+    holds, _ = _collect_holds([order.pk])
+    if holds:
+        applied = apply_stock_deltas(
+            holds,
+            guard=lambda pk, n: Q(pk=pk, reserved_quantity__gte=n, quantity__gte=n),
+            reserved_quantity=-1,
+            quantity=-1,
+        )
+        if not applied:
+            raise ReservationError(f"No se pudo cumplir con el stock reservado para el pedido {order.id}")
+        # quantity and reserved_quantity drop by the same amount: availability is unchanged.
+    StockReservation.objects.filter(order_item__order_id=order.pk).delete()
+
@@ -1,9 +1,8 @@
 from rest_framework import serializers
-from django.db.models import Sum, F
 from .models import Order, OrderItem
 from users.serializers import SimpleUserSerializer
 from store.serializers import ProductSerializer
-from inventory.models import Stock
+from inventory.models import ProductAvailability
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
@@ -31,14 +30,9 @@ class OrderSerializer(serializers.ModelSerializer):
         # 1. Get the default serialized data.
         data = super().to_representation(instance)
         
-        # 2. Calculate the available stock, just like before.
+        # 2. Look up the denormalized availability of the products in one query.
         product_ids = [item['product']['id'] for item in data['items']]
-        
-        stocks = Stock.objects.filter(product_id__in=product_ids)\
-            .values('product_id')\
-            .annotate(available_stock=Sum(F('quantity') - F('reserved_quantity')))
-            
-        stock_map = {s['product_id']: s['available_stock'] for s in stocks}
+        stock_map = ProductAvailability.objects.available_map(product_ids)
         
         # 3. Manually iterate and inject the availability into the serialized data.
         for item_data in data['items']:
@@ -1,24 +1,226 @@
+import logging
+from datetime import timedelta
 from celery import shared_task
-from django.core.mail import send_mail
 from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
 
 
 @shared_task
-def send_order_notification_emails(order_id, sales_point_id, staff_emails):
-    """Send order notification emails to staff"""
-    from .models import Order, SalesPoint
-    order = Order.objects.get(id=order_id)
-    sales_point = SalesPoint.objects.get(id=sales_point_id)
-
-    subject = f"Nuevo pedido #{order.id} en {sales_point.name}"
-    message = f"Se ha creado un nuevo pedido #{order.id} el {order.created_at}.\n" \
-              f"Cliente: {order.user.username}\n" \
-              f"Total: ${order.total_price}\n" \
-              f"Detalles: {', '.join([f'{item.quantity} x {item.product.name}' for item in order.items.all()])}"
-    send_mail(
-        subject,
-        message,
-        settings.EMAIL_HOST_USER,
-        staff_emails,
-        fail_silently=True,
-    )
\ No newline at end of file
+def release_expired_reservations(batch_size=None):
+    """
+    Releases the stock held by unpaid orders whose reservation TTL has passed and
+    marks them 'fallido'. Orders are taken from the partial expiry index in
+    bounded batches, each in its own transaction; rows locked by a concurrent
+    worker or checkout are skipped and picked up on the next run. If a batch
+    cannot be released (ReservationError), its orders are released one by one
+    and those that still fail are logged and retried an hour later, so they
+    never hold up the rest.
+    """
+    from .models import Order
+    from .outbox import record_events
+    from .reservations import ReservationError, release_orders_stock
+
+    batch_size = batch_size or settings.ORDER_RESERVATION_RELEASE_BATCH_SIZE
+    released = 0
+    while True:
+        with transaction.atomic():
+            order_ids = list(
+                Order.objects.select_for_update(skip_locked=True)
+                .filter(status='pendiente', reservation_expires_at__lte=now())
+                .order_by('reservation_expires_at')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not order_ids:
+                break
+            batch = order_ids
+            try:
+                with transaction.atomic():
+                    release_orders_stock(batch)
+            except ReservationError:
+                order_ids = _release_each(batch)
+            Order.objects.filter(id__in=order_ids).update(status='fallido', reservation_expires_at=None)
+            record_events(order_ids, 'status_changed', status='fallido', previous='pendiente')
+        released += len(order_ids)
+        if len(batch) < batch_size:
+            break
+    return released
+
+
+def _release_each(order_ids):
+    """Releases the orders one by one; those that fail are logged and postponed. Returns the released ids."""
+    from .models import Order
+    from .reservations import ReservationError, release_orders_stock
+
+    released, failed = [], []
+    for order_id in order_ids:
+        try:
+            with transaction.atomic():
+                release_orders_stock([order_id])
+        except ReservationError as exc:
+            logger.error(f"Could not release the expired reservation of order {order_id}: {exc}")
+            failed.append(order_id)
+        else:
+            released.append(order_id)
+    Order.objects.filter(id__in=failed).update(reservation_expires_at=now() + timedelta(hours=1))
+    return released
+
+
+@shared_task(bind=True, max_retries=settings.PAYMENT_RECONCILE_MAX_RETRIES)
+def reconcile_payment(self, payment_id):
+    """
+    Fetches a notified payment from the gateway and applies it to its order.
+    The gateway is called outside any transaction and retried with exponential
+    backoff from PAYMENT_RECONCILE_RETRY_DELAY seconds. The transition runs with
+    the PaymentNotification row locked, so concurrent deliveries apply it once.
+    """
+    from .models import PaymentNotification
+    from .payments import apply_payment, get_gateway, record_paid_without_stock
+    from .reservations import InsufficientStockError
+
+    try:
+        payment = get_gateway().get_payment(payment_id)
+    except Exception as exc:
+        raise self.retry(exc=exc, countdown=settings.PAYMENT_RECONCILE_RETRY_DELAY * 2 ** self.request.retries)
+
+    try:
+        with transaction.atomic():
+            notification = PaymentNotification.objects.select_for_update().get(payment_id=payment_id)
+            if notification.processed_at is None:
+                apply_payment(notification, payment)
+    except InsufficientStockError:
+        logger.error(f"Payment {payment_id} approved for order {payment.get('external_reference')} but its stock is no longer available.")
+        # The transition was rolled back; record the outcome on its own.
+        with transaction.atomic():
+            notification = PaymentNotification.objects.select_for_update().get(payment_id=payment_id)
+            if notification.processed_at is None:
+                record_paid_without_stock(notification, payment)
+
+
+@shared_task
+def reconcile_stale_payments():
+    """
+    Safety net for webhook notifications whose reconcile task was never queued
+    (broker down) or gave up: queues them again if no payment status was ever
+    fetched, within PAYMENT_RECONCILE_SWEEP_WINDOW. Returns the number queued.
+    """
+    from .models import PaymentNotification
+
+    payment_ids = list(
+        PaymentNotification.objects.filter(
+            processed_at__isnull=True, payment_status="",
+            received_at__gte=now() - settings.PAYMENT_RECONCILE_SWEEP_WINDOW,
+            # Fresh notifications are still in the hands of their own task.
+            received_at__lte=now() - timedelta(minutes=5),
+        ).values_list("payment_id", flat=True)
+    )
+    for payment_id in payment_ids:
+        reconcile_payment.delay(payment_id)
+    return len(payment_ids)
+
+
+@shared_task
+def place_checkout(ticket_id):
+    """
+    Places the order of a queued CheckoutTicket. Routed to the queue of the
+    ticket's product partition, so one worker places that partition's orders
+    one by one. A ticket that is no longer queued is left alone, so a
+    redelivered message does nothing. Returns the ticket status.
+    """
+    from .checkout import CartError, insufficient_stock_detail, parse_cart, place_order
+    from .models import CheckoutTicket
+    from .reservations import InsufficientStockError
+
+    with transaction.atomic():
+        ticket = CheckoutTicket.objects.select_for_update().select_related("user").get(id=ticket_id)
+        if ticket.status != "queued":
+            return ticket.status
+        products = {}
+        try:
+            with transaction.atomic():
+                quantities, products, payment_method = parse_cart(ticket.payload)
+                ticket.order = place_order(ticket.user, quantities, products, payment_method)
+        except CartError as e:
+            ticket.status, ticket.detail = "failed", str(e)
+        except InsufficientStockError as e:
+            ticket.status, ticket.detail = "failed", insufficient_stock_detail(e, products)
+        else:
+            ticket.status = "placed"
+        ticket.save(update_fields=["status", "order", "detail", "updated_at"])
+    return ticket.status
+
+
+@shared_task
+def requeue_stale_checkouts():
+    """
+    Safety net for checkout tickets whose message was lost. Tickets never sent
+    (the broker was down at commit) are queued after a minute. A sent ticket is
+    only sent again once CHECKOUT_REQUEUE_AFTER has passed since its last send,
+    doubled on each resend and at most CHECKOUT_MAX_REQUEUES times, so a
+    partition with a long legitimate backlog is not flooded with copies of it
+    (a copy of a placed ticket does nothing). Returns the number queued.
+    """
+    from django.db.models import Q
+    from .checkout import enqueue
+    from .models import CheckoutTicket
+
+    stale = Q(enqueued_at__isnull=True, created_at__lte=now() - timedelta(minutes=1))
+    for sends in range(1, settings.CHECKOUT_MAX_REQUEUES + 1):
+        stale |= Q(enqueue_count=sends, enqueued_at__lte=now() - settings.CHECKOUT_REQUEUE_AFTER * 2 ** (sends - 1))
+    tickets = list(CheckoutTicket.objects.filter(stale, status="queued").only("id", "partition"))
+    for ticket in tickets:
+        enqueue(ticket)
+    return len(tickets)
+
+
+@shared_task
+def purge_idempotency_keys():
+    """Deletes Idempotency-Key records past their TTL. Returns the number deleted."""
+    from .models import IdempotencyKey
+
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now()).delete()
+    return deleted
+
+
+@shared_task
+def relay_outbox_events(batch_size=None):
+    """
+    Delivers pending OutboxEvent rows in id order, in batches of
+    OUTBOX_RELAY_BATCH_SIZE. Each batch is claimed with SKIP LOCKED, so parallel
+    relays never deliver the same event twice. Queued after every commit that
+    records events and run periodically as a safety net. Returns the number of
+    events processed.
+    """
+    from .models import OutboxEvent
+    from .outbox import dispatch_events, due
+
+    batch_size = batch_size or settings.OUTBOX_RELAY_BATCH_SIZE
+    processed = 0
+    while True:
+        with transaction.atomic():
+            events = due(OutboxEvent.objects.select_for_update(skip_locked=True, of=("self",)))
+            if settings.ORDER_NOTIFICATION_DIGEST_MINUTES:
+                # New orders are left for the staff digest (send_staff_order_digests)
+                events = events.exclude(event_type="order_created")
+            events = list(events.select_related("order__user").order_by("id")[:batch_size])
+            if not events:
+                break
+            dispatch_events(events)
+        processed += len(events)
+        if len(events) < batch_size:
+            break
+    return processed
+
+
+@shared_task
+def send_staff_order_digests(batch_size=None):
+    """
+    Digest mode (ORDER_NOTIFICATION_DIGEST_MINUTES): sends each sales point's
+    staff one email listing the orders created since the previous run, over
+    one connection. Returns the number of orders included.
+    """
+    from .outbox import dispatch_digests
+
+    return dispatch_digests(batch_size or settings.OUTBOX_RELAY_BATCH_SIZE)
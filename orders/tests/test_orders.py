@@ -1,12 +1,26 @@
 import pytest
+from unittest import mock
+from datetime import timedelta
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.test import APIClient
 from rest_framework.exceptions import ValidationError
+from django.contrib import admin
 from django.core import mail
-from inventory.models import Stock, StockMovement, SalesPoint
+from django.core.mail.backends import locmem
+from inventory.models import Stock, StockMovement, SalesPoint, ProductAvailability
 from store.models import Product, Category
 from cart.models import CartItem
-from orders.models import Order, OrderItem
+from orders.models import CheckoutTicket, Order, OrderItem, OutboxEvent, PaymentNotification, StockReservation
 from orders.serializers import OrderSerializer, OrderItemSerializer
+from orders.views import StaffOrderDetailView
+from orders import reservations
+from orders.admin import OrderAdmin
+from orders.reservations import reserve_stock, fulfill_order_stock, release_order_stock, InsufficientStockError
+from orders.tasks import (
+    place_checkout, reconcile_payment, reconcile_stale_payments, relay_outbox_events, release_expired_reservations,
+    requeue_stale_checkouts, send_staff_order_digests,
+)
 from users.models import CustomUser
 
 
@@ -176,3 +190,580 @@ def test_order_update_view(authenticated_client, product, stock):
 
     response = client.patch(f"/api/orders/{order.id}/", {"status": "enviado"}, format="json")
     assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_order_create_view_with_items_updates_availability(authenticated_client, product, stock):
+    client, user = authenticated_client
+    response = client.post(
+        "/api/orders/create/",
+        {"items": [{"id": product.id, "quantity": 3}], "payment_method": "cash"},
+        format="json",
+    )
+    assert response.status_code == 201
+    stock.refresh_from_db()
+    assert stock.reserved_quantity == 3
+    assert ProductAvailability.objects.get(product=product).available_quantity == 17
+
+    response = client.post(
+        "/api/orders/create/",
+        {"items": [{"id": product.id, "quantity": 50}], "payment_method": "cash"},
+        format="json",
+    )
+    assert response.status_code == 400
+    assert Order.objects.filter(user=user).count() == 1
+
+
+@pytest.mark.django_db
+def test_reserve_stock_splits_across_sales_points(product, stock):
+    second_point = SalesPoint.objects.create(name="Second Warehouse")
+    second_stock = Stock.objects.create(product=product, sales_point=second_point, quantity=5)
+
+    allocations = reserve_stock({product.id: 23})
+
+    stock.refresh_from_db()
+    second_stock.refresh_from_db()
+    assert stock.reserved_quantity == 20
+    assert second_stock.reserved_quantity == 3
+    assert [quantity for _, quantity in allocations[product.id]] == [20, 3]
+
+    with pytest.raises(InsufficientStockError) as excinfo:
+        reserve_stock({product.id: 3})
+    assert excinfo.value.available == 2
+
+
+@pytest.mark.django_db
+def test_order_create_query_count_does_not_grow_with_cart(authenticated_client, category, sales_point, django_assert_max_num_queries):
+    client, user = authenticated_client
+    products = [Product.objects.create(name=f"Phone {i}", category=category, price=100) for i in range(20)]
+    Stock.objects.bulk_create([Stock(product=p, sales_point=sales_point, quantity=10) for p in products])
+
+    with django_assert_max_num_queries(15):
+        response = client.post(
+            "/api/orders/create/",
+            {"items": [{"id": p.id, "quantity": 2} for p in products], "payment_method": "cash"},
+            format="json",
+        )
+    assert response.status_code == 201
+    assert Stock.objects.filter(product__in=products, reserved_quantity=2).count() == 20
+
+
+@pytest.mark.django_db
+def test_release_never_leaves_units_reserved(authenticated_client, product, stock):
+    client, user = authenticated_client
+    response = client.post(
+        "/api/orders/create/", {"items": [{"id": product.id, "quantity": 3}], "payment_method": "cash"}, format="json",
+    )
+    order = Order.objects.get(id=response.data["id"])
+    # The row lost part of its hold behind the reservation's back
+    Stock.objects.filter(id=stock.id).update(reserved_quantity=1)
+
+    release_order_stock(order)
+
+    stock.refresh_from_db()
+    assert stock.reserved_quantity == 0
+    assert not StockReservation.objects.filter(order_item__order=order).exists()
+
+
+@pytest.mark.django_db
+def test_releasing_an_order_twice_keeps_other_orders_reserved(authenticated_client, product, stock):
+    client, user = authenticated_client
+    order_ids = [
+        client.post(
+            "/api/orders/create/", {"items": [{"id": product.id, "quantity": quantity}], "payment_method": "cash"},
+            format="json",
+        ).data["id"]
+        for quantity in (2, 3)
+    ]
+    first = Order.objects.get(id=order_ids[0])
+
+    release_order_stock(first)
+    release_order_stock(first)
+    fulfill_order_stock(first)
+
+    stock.refresh_from_db()
+    assert (stock.quantity, stock.reserved_quantity) == (20, 3)
+    assert StockReservation.objects.get(order_item__order_id=order_ids[1]).quantity == 3
+
+
+@pytest.mark.django_db
+def test_reservations_drive_cancel_and_fulfillment(authenticated_client, product, stock, sales_point):
+    client, user = authenticated_client
+    other_point = SalesPoint.objects.create(name="Other Warehouse")
+    other_stock = Stock.objects.create(product=product, sales_point=other_point, quantity=10, reserved_quantity=4)
+
+    response = client.post(
+        "/api/orders/create/",
+        {"items": [{"id": product.id, "quantity": 3}], "payment_method": "cash"},
+        format="json",
+    )
+    assert response.status_code == 201
+    item = OrderItem.objects.get(order_id=response.data["id"])
+    assert item.sales_point == sales_point
+    reservation = StockReservation.objects.get(order_item=item)
+    assert reservation.stock == stock
+    assert reservation.quantity == 3
+
+    response = client.post(f"/api/orders/{item.order_id}/cancel/")
+    assert response.status_code == 200
+    stock.refresh_from_db()
+    other_stock.refresh_from_db()
+    assert stock.reserved_quantity == 0
+    assert other_stock.reserved_quantity == 4
+    assert not StockReservation.objects.filter(order_item=item).exists()
+
+    response = client.post(
+        "/api/orders/create/",
+        {"items": [{"id": product.id, "quantity": 5}], "payment_method": "cash"},
+        format="json",
+    )
+    order = Order.objects.get(id=response.data["id"])
+    fulfill_order_stock(order)
+    stock.refresh_from_db()
+    assert stock.quantity == 15
+    assert stock.reserved_quantity == 0
+    assert not StockReservation.objects.filter(order_item__order=order).exists()
+
+
+@pytest.mark.django_db
+def test_cancel_rechecks_status_under_the_row_lock(authenticated_client, product, stock):
+    client, user = authenticated_client
+    response = client.post(
+        "/api/orders/create/", {"items": [{"id": product.id, "quantity": 2}], "payment_method": "cash"}, format="json",
+    )
+    order = Order.objects.get(id=response.data["id"])
+    staff = CustomUser.objects.create_user(username="lock_staff", password="pass1234", role="admin")
+    staff_client = APIClient()
+    staff_client.force_authenticate(user=staff)
+    # Another transaction released and failed the order after the view read it
+    release_order_stock(order)
+    Order.objects.filter(id=order.id).update(status="fallido")
+
+    with mock.patch.object(StaffOrderDetailView, "get_object", return_value=order):
+        response = staff_client.patch(f"/api/orders/staff/{order.id}/", {"status": "cancelado"}, format="json")
+    assert response.status_code == 400
+    assert client.post(f"/api/orders/{order.id}/cancel/").status_code == 400
+    assert Order.objects.get(id=order.id).status == "fallido"
+    assert not OutboxEvent.objects.filter(order=order, event_type="cancelled").exists()
+
+
+@pytest.mark.django_db
+def test_admin_cancel_and_reactivate_go_through_reservations(authenticated_client, product, stock):
+    client, user = authenticated_client
+    response = client.post(
+        "/api/orders/create/", {"items": [{"id": product.id, "quantity": 4}], "payment_method": "cash"}, format="json",
+    )
+    orders = Order.objects.filter(id=response.data["id"])
+    order_admin = OrderAdmin(Order, admin.site)
+
+    with mock.patch.object(OrderAdmin, "message_user"):
+        order_admin.cancel_orders(None, orders)
+        stock.refresh_from_db()
+        assert (stock.quantity, stock.reserved_quantity) == (20, 0)
+        assert orders.get().status == "cancelado"
+
+        order_admin.reactivate_orders(None, orders)
+    stock.refresh_from_db()
+    assert (stock.quantity, stock.reserved_quantity) == (20, 4)
+    assert orders.get().status == "pendiente"
+    assert StockReservation.objects.get(order_item__order=orders.get()).quantity == 4
+
+
+@pytest.mark.django_db
+def test_release_expired_reservations(authenticated_client, product, stock):
+    client, user = authenticated_client
+    order_ids = []
+    for _ in range(3):
+        response = client.post(
+            "/api/orders/create/",
+            {"items": [{"id": product.id, "quantity": 2}], "payment_method": "mercado_pago"},
+            format="json",
+        )
+        assert response.status_code == 201
+        order_ids.append(response.data["id"])
+
+    expired_ids = order_ids[:2]
+    assert Order.objects.get(id=order_ids[2]).reservation_expires_at is not None
+    Order.objects.filter(id__in=expired_ids).update(reservation_expires_at=timezone.now() - timedelta(minutes=1))
+
+    assert release_expired_reservations(batch_size=1) == 2
+
+    stock.refresh_from_db()
+    assert stock.reserved_quantity == 2
+    assert set(Order.objects.filter(status="fallido").values_list("id", flat=True)) == set(expired_ids)
+    assert Order.objects.get(id=order_ids[2]).status == "pendiente"
+    assert not StockReservation.objects.filter(order_item__order_id__in=expired_ids).exists()
+
+
+@pytest.mark.django_db
+def test_failing_release_skips_only_its_order(authenticated_client, product, stock, category, sales_point):
+    client, user = authenticated_client
+    other_product = Product.objects.create(name="Tablet", category=category, price=300)
+    other_stock = Stock.objects.create(product=other_product, sales_point=sales_point, quantity=5, reserved_quantity=0)
+    order_ids = [
+        client.post(
+            "/api/orders/create/", {"items": [{"id": item.id, "quantity": 1}], "payment_method": "mercado_pago"},
+            format="json",
+        ).data["id"]
+        for item in (product, other_product)
+    ]
+    Order.objects.filter(id__in=order_ids).update(reservation_expires_at=timezone.now() - timedelta(minutes=1))
+    real_apply = reservations.apply_stock_deltas
+
+    def apply_stock_deltas(deltas, **kwargs):
+        return False if stock.id in deltas else real_apply(deltas, **kwargs)
+
+    with mock.patch("orders.reservations.apply_stock_deltas", side_effect=apply_stock_deltas):
+        assert release_expired_reservations() == 1
+        response = client.post(f"/api/orders/{order_ids[0]}/cancel/")
+    assert response.status_code == 409
+
+    stuck = Order.objects.get(id=order_ids[0])
+    assert stuck.status == "pendiente"
+    assert stuck.reservation_expires_at > timezone.now()
+    assert Order.objects.get(id=order_ids[1]).status == "fallido"
+    stock.refresh_from_db()
+    other_stock.refresh_from_db()
+    assert (stock.reserved_quantity, other_stock.reserved_quantity) == (1, 0)
+
+
+@pytest.mark.django_db
+def test_order_events_are_relayed_from_the_outbox(authenticated_client, product, stock, sales_point):
+    client, user = authenticated_client
+    user.email = "customer@example.com"
+    user.save()
+    admin = CustomUser.objects.create_user(username="outbox_admin", password="pass1234", email="admin@example.com")
+    seller = CustomUser.objects.create_user(username="outbox_seller", password="pass1234", email="seller@example.com")
+    sales_point.administrators.add(admin)
+    sales_point.sellers.add(seller)
+
+    response = client.post(
+        "/api/orders/create/",
+        {"items": [{"id": product.id, "quantity": 1}], "payment_method": "cash"},
+        format="json",
+    )
+    assert response.status_code == 201
+    # Nothing is sent inside the request: the event waits in the outbox
+    assert mail.outbox == []
+    event = OutboxEvent.objects.get(order_id=response.data["id"])
+    assert event.event_type == "order_created"
+    assert event.dispatched_at is None
+
+    assert relay_outbox_events() == 1
+    assert len(mail.outbox) == 1
+    assert sorted(mail.outbox[0].to) == ["admin@example.com", "seller@example.com"]
+    event.refresh_from_db()
+    assert event.dispatched_at is not None
+
+    assert client.post(f"/api/orders/{response.data['id']}/cancel/").status_code == 200
+    assert relay_outbox_events() == 1
+    assert mail.outbox[-1].to == ["customer@example.com"]
+    assert "cancelado" in mail.outbox[-1].body
+    assert relay_outbox_events() == 0
+
+
+@pytest.mark.django_db
+def test_failed_outbox_events_back_off(authenticated_client, product, stock, sales_point):
+    client, user = authenticated_client
+    admin = CustomUser.objects.create_user(username="backoff_admin", password="pass1234", email="admin@example.com")
+    sales_point.administrators.add(admin)
+    response = client.post(
+        "/api/orders/create/", {"items": [{"id": product.id, "quantity": 1}], "payment_method": "cash"}, format="json",
+    )
+    event = OutboxEvent.objects.get(order_id=response.data["id"])
+
+    with mock.patch("orders.outbox.deliver", side_effect=ConnectionError("smtp down")):
+        assert relay_outbox_events(batch_size=1) == 1
+    # Not retried by the next runs until its backoff has passed
+    assert relay_outbox_events(batch_size=1) == 0
+    event.refresh_from_db()
+    assert (event.attempts, event.last_error, event.dispatched_at) == (1, "smtp down", None)
+    assert event.next_attempt_at > timezone.now()
+
+    OutboxEvent.objects.filter(id=event.id).update(next_attempt_at=timezone.now())
+    # The mail server refuses the connection: the batch backs off instead of failing the task
+    with mock.patch.object(locmem.EmailBackend, "open", side_effect=ConnectionError("connection refused")):
+        assert relay_outbox_events(batch_size=1) == 1
+    event.refresh_from_db()
+    assert (event.attempts, event.last_error) == (2, "connection refused")
+    assert event.next_attempt_at > timezone.now()
+
+    OutboxEvent.objects.filter(id=event.id).update(next_attempt_at=timezone.now())
+    assert relay_outbox_events(batch_size=1) == 1
+    assert mail.outbox[-1].to == ["admin@example.com"]
+
+
+@pytest.mark.django_db
+def test_notifications_share_one_connection_and_support_digests(authenticated_client, product, stock, sales_point, settings):
+    client, user = authenticated_client
+    admin = CustomUser.objects.create_user(username="digest_admin", password="pass1234", email="admin@example.com")
+    sales_point.administrators.add(admin)
+
+    def place_orders(count):
+        for _ in range(count):
+            response = client.post(
+                "/api/orders/create/",
+                {"items": [{"id": product.id, "quantity": 1}], "payment_method": "cash"},
+                format="json",
+            )
+            assert response.status_code == 201
+
+    place_orders(3)
+    with mock.patch.object(locmem.EmailBackend, "open", autospec=True, wraps=locmem.EmailBackend.open) as opened:
+        assert relay_outbox_events() == 3
+    assert opened.call_count == 1
+    assert len(mail.outbox) == 3
+
+    settings.ORDER_NOTIFICATION_DIGEST_MINUTES = 15
+    mail.outbox.clear()
+    place_orders(2)
+    # The relay leaves new orders for the digest
+    assert relay_outbox_events() == 0
+    assert send_staff_order_digests() == 2
+    [digest] = mail.outbox
+    assert digest.to == ["admin@example.com"]
+    assert digest.subject == f"2 pedidos nuevos en {sales_point.name}"
+    assert digest.body.count(f"1 x {product.name}") == 2
+    assert send_staff_order_digests() == 0
+
+
+@pytest.mark.django_db
+def test_failed_digest_is_resent_only_to_its_sales_point(authenticated_client, product, stock, sales_point, category, settings):
+    client, user = authenticated_client
+    other_point = SalesPoint.objects.create(name="Branch")
+    other_product = Product.objects.create(name="Mouse", category=category, price=20)
+    Stock.objects.create(product=other_product, sales_point=other_point, quantity=5, reserved_quantity=0)
+    for point, email in ((sales_point, "main@example.com"), (other_point, "branch@example.com")):
+        admin = CustomUser.objects.create_user(username=email.split("@")[0], password="pass1234", email=email)
+        point.administrators.add(admin)
+    settings.ORDER_NOTIFICATION_DIGEST_MINUTES = 15
+    response = client.post(
+        "/api/orders/create/",
+        {"items": [{"id": product.id, "quantity": 1}, {"id": other_product.id, "quantity": 1}], "payment_method": "cash"},
+        format="json",
+    )
+    assert response.status_code == 201
+
+    def deliver(messages, connection=None):
+        if messages[0].to == ["branch@example.com"]:
+            raise ConnectionError("smtp down")
+        mail.outbox.extend(messages)
+
+    with mock.patch("orders.outbox.deliver", side_effect=deliver):
+        assert send_staff_order_digests() == 1
+    assert [message.to for message in mail.outbox] == [["main@example.com"]]
+    event = OutboxEvent.objects.get(order_id=response.data["id"])
+    assert (event.attempts, event.dispatched_at) == (1, None)
+
+    OutboxEvent.objects.filter(id=event.id).update(next_attempt_at=timezone.now())
+    assert send_staff_order_digests() == 1
+    assert [message.to for message in mail.outbox] == [["main@example.com"], ["branch@example.com"]]
+    event.refresh_from_db()
+    assert event.dispatched_at is not None
+
+
+@pytest.mark.django_db
+def test_order_create_is_idempotent_per_key(authenticated_client, product, stock):
+    client, user = authenticated_client
+    cart = {"items": [{"id": product.id, "quantity": 2}], "payment_method": "cash"}
+
+    first = client.post("/api/orders/create/", cart, format="json", HTTP_IDEMPOTENCY_KEY="checkout-1")
+    retry = client.post("/api/orders/create/", cart, format="json", HTTP_IDEMPOTENCY_KEY="checkout-1")
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.data == first.data
+    assert retry["Idempotent-Replayed"] == "true"
+    assert Order.objects.filter(user=user).count() == 1
+    stock.refresh_from_db()
+    assert stock.reserved_quantity == 2
+
+    other_cart = {"items": [{"id": product.id, "quantity": 3}], "payment_method": "cash"}
+    assert client.post("/api/orders/create/", other_cart, format="json", HTTP_IDEMPOTENCY_KEY="checkout-1").status_code == 422
+
+    # Failed attempts are not stored: the same key works once the cart can be placed
+    too_many = {"items": [{"id": product.id, "quantity": 50}], "payment_method": "cash"}
+    assert client.post("/api/orders/create/", too_many, format="json", HTTP_IDEMPOTENCY_KEY="checkout-2").status_code == 400
+    Stock.objects.filter(id=stock.id).update(quantity=100)
+    assert client.post("/api/orders/create/", too_many, format="json", HTTP_IDEMPOTENCY_KEY="checkout-2").status_code == 201
+
+
+class FakeGateway:
+    payments = {}
+    failures = 0
+    calls = []
+
+    def get_payment(self, payment_id):
+        FakeGateway.calls.append(payment_id)
+        if FakeGateway.failures:
+            FakeGateway.failures -= 1
+            raise ConnectionError("gateway timeout")
+        return FakeGateway.payments[payment_id]
+
+
+@pytest.fixture
+def fake_gateway(settings):
+    settings.PAYMENT_GATEWAY = "orders.tests.test_orders.FakeGateway"
+    FakeGateway.payments, FakeGateway.failures, FakeGateway.calls = {}, 0, []
+    return FakeGateway
+
+
+@pytest.mark.django_db
+def test_payment_webhook_acks_and_reconciles_in_background(
+    authenticated_client, product, stock, fake_gateway, django_capture_on_commit_callbacks,
+):
+    client, user = authenticated_client
+    response = client.post(
+        "/api/orders/create/",
+        {"items": [{"id": product.id, "quantity": 1}], "payment_method": "mercado_pago"},
+        format="json",
+    )
+    order_id = response.data["id"]
+    fake_gateway.payments["987654"] = {"status": "approved", "external_reference": str(order_id)}
+    notification = {"type": "payment", "data": {"id": 987654}}
+
+    with mock.patch("orders.views.reconcile_payment.delay") as delay:
+        with django_capture_on_commit_callbacks(execute=True):
+            assert client.post("/api/orders/webhook/", notification, format="json").status_code == 200
+        assert fake_gateway.calls == []
+        delay.assert_called_once_with("987654")
+
+        # Two failed gateway calls are retried before the payment is applied
+        fake_gateway.failures = 2
+        reconcile_payment.apply(args=["987654"])
+        assert fake_gateway.calls == ["987654"] * 3
+        reconcile_payment("987654")
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert client.post("/api/orders/webhook/", notification, format="json").status_code == 200
+        assert delay.call_count == 1
+
+    assert Order.objects.get(id=order_id).status == "en_proceso"
+    assert OutboxEvent.objects.filter(order_id=order_id, event_type="status_changed").count() == 1
+    assert PaymentNotification.objects.get(payment_id="987654").order_id == order_id
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("initial, expected, reserved", [
+    ("cancelado", "en_proceso", 2),
+    ("enviado", "enviado", 0),
+    ("completado", "completado", 0),
+])
+def test_approved_payment_never_reactivates_without_stock(
+    authenticated_client, product, stock, fake_gateway, initial, expected, reserved,
+):
+    client, user = authenticated_client
+    response = client.post(
+        "/api/orders/create/",
+        {"items": [{"id": product.id, "quantity": 2}], "payment_method": "mercado_pago"},
+        format="json",
+    )
+    order = Order.objects.get(id=response.data["id"])
+    release_order_stock(order)
+    Order.objects.filter(id=order.id).update(status=initial)
+    PaymentNotification.objects.create(payment_id="777")
+    fake_gateway.payments["777"] = {"status": "approved", "external_reference": str(order.id)}
+
+    reconcile_payment("777")
+
+    assert Order.objects.get(id=order.id).status == expected
+    stock.refresh_from_db()
+    assert stock.reserved_quantity == reserved
+    assert StockReservation.objects.filter(order_item__order=order).exists() == bool(reserved)
+
+
+@pytest.mark.django_db
+def test_paid_order_without_stock_is_closed_and_reported(authenticated_client, product, stock, sales_point, fake_gateway):
+    client, user = authenticated_client
+    admin = CustomUser.objects.create_user(username="stock_admin", password="pass1234", email="admin@example.com")
+    sales_point.administrators.add(admin)
+    response = client.post(
+        "/api/orders/create/",
+        {"items": [{"id": product.id, "quantity": 1}], "payment_method": "mercado_pago"},
+        format="json",
+    )
+    order_id = response.data["id"]
+    Order.objects.filter(id=order_id).update(reservation_expires_at=timezone.now() - timedelta(minutes=1))
+    assert release_expired_reservations() == 1
+    Stock.objects.filter(id=stock.id).update(quantity=0)
+    PaymentNotification.objects.create(payment_id="555")
+    PaymentNotification.objects.filter(payment_id="555").update(received_at=timezone.now() - timedelta(minutes=10))
+    fake_gateway.payments["555"] = {"status": "approved", "external_reference": str(order_id)}
+
+    reconcile_payment("555")
+
+    notification = PaymentNotification.objects.get(payment_id="555")
+    assert (notification.payment_status, notification.order_id) == ("approved", order_id)
+    assert notification.processed_at is not None
+    assert Order.objects.get(id=order_id).status == "fallido"
+    assert reconcile_stale_payments() == 0
+    mail.outbox.clear()
+    relay_outbox_events()
+    [alert] = [message for message in mail.outbox if "sin stock" in message.subject]
+    assert alert.to == ["admin@example.com"]
+    assert "555" in alert.body
+
+
+@pytest.mark.django_db
+def test_async_checkout_queues_ticket_on_product_partition(
+    authenticated_client, product, stock, settings, django_capture_on_commit_callbacks,
+):
+    client, user = authenticated_client
+    settings.CHECKOUT_PARTITIONS = 4
+
+    assert client.post("/api/orders/checkout/", {"items": []}, format="json").status_code == 400
+
+    with mock.patch("orders.tasks.place_checkout.apply_async") as apply_async:
+        with django_capture_on_commit_callbacks(execute=True):
+            accepted = client.post(
+                "/api/orders/checkout/",
+                {"items": [{"id": product.id, "quantity": 2}], "payment_method": "cash"},
+                format="json",
+            )
+            rejected = client.post(
+                "/api/orders/checkout/", {"items": [{"id": product.id, "quantity": 50}]}, format="json",
+            )
+
+    assert accepted.status_code == rejected.status_code == 202
+    assert accepted["Location"] == accepted.data["status_url"]
+    ticket_id = accepted.data["ticket"]
+    apply_async.assert_any_call(args=[ticket_id], queue=f"checkout-{product.id % 4}")
+    assert client.get(accepted["Location"]).data["status"] == "queued"
+    assert not Order.objects.filter(user=user).exists()
+
+    assert place_checkout(ticket_id) == "placed"
+    assert place_checkout(ticket_id) == "placed"
+    assert place_checkout(rejected.data["ticket"]) == "failed"
+
+    placed = client.get(accepted["Location"]).data
+    order = Order.objects.get(user=user)
+    assert placed["order_id"] == order.id
+    assert order.items.get().quantity == 2
+    stock.refresh_from_db()
+    assert stock.reserved_quantity == 2
+    assert "Stock insuficiente" in client.get(rejected.data["status_url"]).data["detail"]
+
+
+@pytest.mark.django_db
+def test_requeue_only_resends_lost_checkout_tickets(authenticated_client, product, settings):
+    _, user = authenticated_client
+    settings.CHECKOUT_REQUEUE_AFTER = timedelta(minutes=10)
+    settings.CHECKOUT_MAX_REQUEUES = 2
+    old = timezone.now() - timedelta(minutes=30)
+    payload = {"items": [{"id": product.id, "quantity": 1}], "payment_method": "cash"}
+    unsent = CheckoutTicket.objects.create(user=user, partition=0, payload=payload)
+    waiting = CheckoutTicket.objects.create(user=user, partition=0, payload=payload)
+    lost = CheckoutTicket.objects.create(user=user, partition=0, payload=payload)
+    given_up = CheckoutTicket.objects.create(user=user, partition=0, payload=payload)
+    CheckoutTicket.objects.filter(id__in=[unsent.id, waiting.id, lost.id, given_up.id]).update(created_at=old)
+    CheckoutTicket.objects.filter(id=waiting.id).update(enqueued_at=timezone.now() - timedelta(minutes=5), enqueue_count=1)
+    # Resent once already: waits twice CHECKOUT_REQUEUE_AFTER before the next resend
+    CheckoutTicket.objects.filter(id=lost.id).update(enqueued_at=timezone.now() - timedelta(minutes=25), enqueue_count=2)
+    CheckoutTicket.objects.filter(id=given_up.id).update(enqueued_at=old, enqueue_count=3)
+
+    with mock.patch("orders.tasks.place_checkout.apply_async") as apply_async:
+        assert requeue_stale_checkouts() == 2
+    assert sorted(call.kwargs["args"][0] for call in apply_async.call_args_list) == [unsent.id, lost.id]
+    lost.refresh_from_db()
+    assert lost.enqueue_count == 3
+    with mock.patch("orders.tasks.place_checkout.apply_async") as apply_async:
+        assert requeue_stale_checkouts() == 0
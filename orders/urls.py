@@ -3,6 +3,8 @@ from .views import (
     OrderListView, 
     OrderDetailView, 
     OrderCreateView, 
+    CheckoutCreateView,
+    CheckoutStatusView,
     CancelOrderView, 
     StaffOrderListView,
     CreatePaymentView,
@@ -14,6 +16,8 @@ urlpatterns = [
     path('', OrderListView.as_view(), name='order-list'),
     path('<int:pk>/', OrderDetailView.as_view(), name='order-detail'),
     path('create/', OrderCreateView.as_view(), name='order-create'),
+    path('checkout/', CheckoutCreateView.as_view(), name='checkout-create'),
+    path('checkout/<int:pk>/', CheckoutStatusView.as_view(), name='checkout-status'),
     path('create-payment/', CreatePaymentView.as_view(), name='create-payment'),
     path('webhook/', MercadoPagoWebhookView.as_view(), name='mercadopago-webhook'),
     path('<int:pk>/cancel/', CancelOrderView.as_view(), name='order-cancel'),
@@ -2,21 +2,24 @@ from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, F, Sum
-from store.models import Product
+from django.urls import reverse
 from users.models import CustomUser
 from users.permissions import IsSuperuser, IsAdmin, IsStoreAdmin
-from inventory.models import Stock, SalesPoint
-from .models import Order, OrderItem
+from .models import CheckoutTicket, Order, PaymentNotification
 from .serializers import OrderSerializer
-from .tasks import send_order_notification_emails
+from .reservations import (
+    reserve_order_stock, release_order_stock, fulfill_order_stock,
+    InsufficientStockError, ReservationError,
+)
+from .checkout import CartError, create_ticket, insufficient_stock_detail, parse_cart, place_order
+from .outbox import record_event
+from .payments import get_gateway
+from .tasks import reconcile_payment
+from . import idempotency
 from django.db import transaction
-import mercadopago
-from django.conf import settings
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-from decimal import Decimal
-from collections import defaultdict
+from functools import partial
 import logging
 
 logger = logging.getLogger(__name__)
@@ -40,114 +43,82 @@ class OrderCreateView(APIView):
 
     @transaction.atomic
     def post(self, request, *args, **kwargs):
-        user = request.user
-        cart_items = request.data.get("items", [])
-        payment_method = request.data.get("payment_method", "cash")
-
-        if not cart_items:
-            return Response({"detail": "El carrito está vacío."}, status=status.HTTP_400_BAD_REQUEST)
-
-        aggregated_items = defaultdict(int)
-        for item in cart_items:
-            try:
-                product_id = int(item['id'])
-                quantity = int(item['quantity'])
-                if quantity <= 0:
-                    return Response({"detail": f"La cantidad para el producto ID {product_id} debe ser positiva."},
-                                    status=status.HTTP_400_BAD_REQUEST)
-                aggregated_items[product_id] += quantity
-            except (ValueError, TypeError, KeyError):
-                return Response({"detail": "Datos de carrito inválidos: ID y cantidad deben ser números."},
-                                status=status.HTTP_400_BAD_REQUEST)
-
-        total_price = Decimal('0.0')
-        total_cost_price = Decimal('0.0')
-        order_items_to_create = []
-        stocks_to_update = []
-
-        product_ids = list(aggregated_items.keys())
-        products = Product.objects.filter(id__in=product_ids).in_bulk()
-
-        for product_id, quantity in aggregated_items.items():
-            product = products.get(product_id)
-            if not product:
-                return Response({"detail": f"Producto con ID {product_id} no encontrado."},
-                                status=status.HTTP_400_BAD_REQUEST)
-
-            stock_info = Stock.objects.filter(product_id=product_id).aggregate(
-                total_available=Sum(F('quantity') - F('reserved_quantity'))
-            )
-            total_available = stock_info.get('total_available') or 0
-
-            if total_available < quantity:
-                return Response({"detail": f"Stock insuficiente para '{product.name}'. Hay {total_available} disponibles en total."},
-                                status=status.HTTP_400_BAD_REQUEST)
-
-            quantity_to_reserve = quantity
-            product_stocks = Stock.objects.select_for_update().filter(product_id=product_id)
-            
-            for stock in product_stocks:
-                if quantity_to_reserve <= 0:
-                    break
-                
-                available_in_this_stock = stock.quantity - stock.reserved_quantity
-                reserve_from_this = min(quantity_to_reserve, available_in_this_stock)
-
-                if reserve_from_this > 0:
-                    stock.reserved_quantity += reserve_from_this
-                    stocks_to_update.append(stock)
-                    quantity_to_reserve -= reserve_from_this
-
-            item_price = product.price
-            # FIX: Safely get cost_price, defaulting to 0 if not present.
-            item_cost_price = getattr(product, 'cost_price', 0)
-
-            total_price += item_price * quantity
-            total_cost_price += item_cost_price * quantity
-
-            order_items_to_create.append(
-                OrderItem(
-                    product=product,
-                    quantity=quantity,
-                    price=item_price,  # Use the correct price at the time of order
-                    cost_price=item_cost_price # Use the safely obtained cost price
-                )
-            )
-
-        order_status = 'en_proceso' if payment_method == 'card' else 'pendiente'
-        order = Order.objects.create(
-            user=user,
-            total_price=total_price,
-            total_cost_price=total_cost_price,
-            status=order_status,
-            payment_method=payment_method
-        )
-
-        for item in order_items_to_create:
-            item.order = order
-        
-        OrderItem.objects.bulk_create(order_items_to_create)
-        Stock.objects.bulk_update(list(set(stocks_to_update)), ['reserved_quantity'])
+        """
+        Places the order. With an `Idempotency-Key` header, a retry with the
+        same key and cart gets the first response back without reserving stock again.
+        """
+        key = request.headers.get(idempotency.HEADER)
+        if not key:
+            return self._place_order(request)
+        record, replay = idempotency.claim(request.user, 'order_create', key, request.data)
+        if replay is not None:
+            return replay
+        response = self._place_order(request)
+        idempotency.store(record, response)
+        return response
+
+    def _place_order(self, request):
+        try:
+            quantities, products, payment_method = parse_cart(request.data)
+        except CartError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            product_ids_in_order = [item.product.id for item in order_items_to_create]
-            sales_points = SalesPoint.objects.filter(
-                stock__product_id__in=product_ids_in_order
-            ).distinct()
-            for sales_point in sales_points:
-                staff_emails = list(sales_point.administrators.values_list('email', flat=True)) + \
-                               list(sales_point.sellers.values_list('email', flat=True))
-                if staff_emails:
-                    send_order_notification_emails(
-                        order_id=order.id,
-                        sales_point_id=sales_point.id,
-                        staff_emails=staff_emails,
-                    )
-        except Exception as e:
-            logger.error(f"Failed to send order notification email for order {order.id}: {e}")
+            order = place_order(request.user, quantities, products, payment_method)
+        except InsufficientStockError as e:
+            transaction.set_rollback(True)
+            return Response({"detail": insufficient_stock_detail(e, products)}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({'id': order.id}, status=status.HTTP_201_CREATED)
 
+class CheckoutCreateView(APIView):
+    """
+    Asynchronous checkout: validates the cart and answers 202 with a ticket
+    to poll while a partition worker places the order (see orders.checkout).
+    Accepts an `Idempotency-Key` header like OrderCreateView.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @transaction.atomic
+    def post(self, request, *args, **kwargs):
+        key = request.headers.get(idempotency.HEADER)
+        if not key:
+            return self._queue_order(request)
+        record, replay = idempotency.claim(request.user, 'checkout', key, request.data)
+        if replay is not None:
+            return replay
+        response = self._queue_order(request)
+        idempotency.store(record, response)
+        return response
+
+    def _queue_order(self, request):
+        try:
+            quantities, products, payment_method = parse_cart(request.data)
+        except CartError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        ticket = create_ticket(request.user, quantities, payment_method)
+        status_url = reverse('checkout-status', args=[ticket.id])
+        return Response(
+            {'ticket': ticket.id, 'status': ticket.status, 'status_url': status_url},
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': status_url},
+        )
+
+class CheckoutStatusView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        ticket = get_object_or_404(
+            CheckoutTicket.objects.values('id', 'status', 'order_id', 'detail'), pk=pk, user=request.user,
+        )
+        return Response({
+            'ticket': ticket['id'],
+            'status': ticket['status'],
+            'order_id': ticket['order_id'],
+            'detail': ticket['detail'],
+        })
+
 class CreatePaymentView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -155,8 +126,6 @@ class CreatePaymentView(APIView):
         order_id = request.data.get('order_id')
         order = get_object_or_404(Order, id=order_id, user=request.user)
 
-        sdk = mercadopago.SDK(settings.MERCADOPAGO_ACCESS_TOKEN)
-
         items = [{
             "title": item.product.name,
             "quantity": item.quantity,
@@ -175,74 +144,61 @@ class CreatePaymentView(APIView):
         }
 
         try:
-            preference_response = sdk.preference().create(preference_data)
-            return Response({'init_point': preference_response["response"]['init_point']})
+            preference = get_gateway().create_preference(preference_data)
+            return Response({'init_point': preference['init_point']})
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @method_decorator(csrf_exempt, name='dispatch')
 class MercadoPagoWebhookView(APIView):
+    """
+    Acknowledges MercadoPago notifications without calling the gateway: the
+    notification is stored and `reconcile_payment` fetches and applies the
+    payment in the background. Redeliveries of an applied payment are ignored.
+    """
     def post(self, request, *args, **kwargs):
         notification = request.data
         if notification.get('type') == 'payment':
             payment_id = notification.get('data', {}).get('id')
             if not payment_id:
                 return Response(status=status.HTTP_400_BAD_REQUEST)
+            payment_id = str(payment_id)
 
-            try:
-                sdk = mercadopago.SDK(settings.MERCADOPAGO_ACCESS_TOKEN)
-                payment_info = sdk.payment().get(payment_id)
-                payment = payment_info['response']
-                order_id = payment.get('external_reference')
-                order = get_object_or_404(Order, id=order_id)
-
-                if payment['status'] == 'approved':
-                    order.status = 'en_proceso'
-                    order.save()
-                elif payment['status'] in ['rejected', 'cancelled']:
-                    order.status = 'fallido'
-                    order.save()
-
-            except Exception as e:
-                logger.error(f"Error processing MercadoPago webhook: {e}", exc_info=True)
-                return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            record, _ = PaymentNotification.objects.get_or_create(payment_id=payment_id)
+            if record.processed_at is None:
+                transaction.on_commit(partial(self._enqueue_reconcile, payment_id))
 
         return Response(status=status.HTTP_200_OK)
 
+    def _enqueue_reconcile(self, payment_id):
+        try:
+            reconcile_payment.delay(payment_id)
+        except Exception:
+            logger.warning(f"Could not enqueue reconciliation of payment {payment_id}; the periodic sweep will retry it.", exc_info=True)
+
 class CancelOrderView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, pk):
-        order = get_object_or_404(Order, pk=pk, user=request.user)
-
-        if order.status not in ['pendiente', 'en_proceso']:
-            return Response({"error": f"No se puede cancelar un pedido en estado '{order.status}'."}, status=status.HTTP_400_BAD_REQUEST)
-
-        with transaction.atomic():
-            self._release_stock_for_order(order)
-            order.status = "cancelado"
-            order.save()
+        try:
+            with transaction.atomic():
+                # Locked, so a concurrent expiry or staff update cannot release the order twice.
+                order = get_object_or_404(Order.objects.select_for_update(), pk=pk, user=request.user)
+                if order.status not in ['pendiente', 'en_proceso']:
+                    return Response({"error": f"No se puede cancelar un pedido en estado '{order.status}'."}, status=status.HTTP_400_BAD_REQUEST)
+
+                self._release_stock_for_order(order)
+                record_event(order, 'cancelled', status='cancelado', previous=order.status)
+                order.status = "cancelado"
+                order.save()
+        except ReservationError as e:
+            logger.error(f"Could not cancel order {pk}: {e}")
+            return Response({"error": "No se pudo liberar el stock del pedido, inténtelo de nuevo."}, status=status.HTTP_409_CONFLICT)
 
         return Response({"message": "Pedido cancelado con éxito."})
     
     def _release_stock_for_order(self, order):
-        stocks_to_update = []
-        for item in order.items.all():
-            quantity_to_return = item.quantity
-            product_stocks = Stock.objects.select_for_update().filter(product=item.product)
-            
-            for stock in product_stocks:
-                if quantity_to_return <= 0:
-                    break
-                
-                can_return = min(quantity_to_return, stock.reserved_quantity)
-                if can_return > 0:
-                    stock.reserved_quantity -= can_return
-                    stocks_to_update.append(stock)
-                    quantity_to_return -= can_return
-
-        if stocks_to_update:
-            Stock.objects.bulk_update(list(set(stocks_to_update)), ['reserved_quantity'])
+        release_order_stock(order)
 
 
 class StaffOrderListView(generics.ListAPIView):
@@ -271,14 +227,10 @@ class StaffOrderDetailView(generics.RetrieveUpdateAPIView):
     def update(self, request, *args, **kwargs):
         order = self.get_object()
         new_status = request.data.get('status')
-        original_status = order.status
 
         if not new_status:
             return Response({"error": "El campo 'status' es requerido."}, status=status.HTTP_400_BAD_REQUEST)
 
-        if new_status == original_status:
-            return Response(self.get_serializer(order).data)
-
         allowed_transitions = {
             'pendiente': ['en_proceso', 'cancelado'],
             'en_proceso': ['enviado', 'completado', 'cancelado'],
@@ -288,22 +240,43 @@ class StaffOrderDetailView(generics.RetrieveUpdateAPIView):
             'fallido': ['pendiente']
         }
 
-        if new_status not in allowed_transitions.get(original_status, []):
-            return Response({
-                "error": f"No se puede cambiar el estado de '{original_status}' a '{new_status}'."
-            }, status=status.HTTP_400_BAD_REQUEST)
-
         try:
             with transaction.atomic():
+                # The status is read again under the row lock: the expiry task or a
+                # customer cancel may have changed it since get_object().
+                order = self.get_queryset().select_for_update().get(pk=order.pk)
+                original_status = order.status
+
+                if new_status == original_status:
+                    return Response(self.get_serializer(order).data)
+
+                if new_status not in allowed_transitions.get(original_status, []):
+                    return Response({
+                        "error": f"No se puede cambiar el estado de '{original_status}' a '{new_status}'."
+                    }, status=status.HTTP_400_BAD_REQUEST)
+
                 if new_status in ['enviado', 'completado'] and original_status not in ['enviado', 'completado']:
                     self._fulfill_stock_for_order(order)
                 
                 elif new_status == 'cancelado':
                     self._release_stock_for_order(order)
 
+                elif original_status == 'fallido' and new_status == 'pendiente':
+                    reserve_order_stock(order)
+                    order.reset_reservation_expiry()
+
+                record_event(
+                    order, 'cancelled' if new_status == 'cancelado' else 'status_changed',
+                    status=new_status, previous=original_status,
+                )
                 order.status = new_status
                 order.save()
 
+        except InsufficientStockError:
+            return Response({"error": "No hay stock suficiente para reactivar el pedido."}, status=status.HTTP_400_BAD_REQUEST)
+        except ReservationError as e:
+            logger.error(f"Could not update order {order.id} stock: {e}")
+            return Response({"error": "No se pudo actualizar el stock reservado del pedido, inténtelo de nuevo."}, status=status.HTTP_409_CONFLICT)
         except Exception as e:
             logger.error(f"Error updating order {order.id} status: {e}", exc_info=True)
             return Response({"error": "Ocurrió un error interno al actualizar el pedido."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -311,27 +284,7 @@ class StaffOrderDetailView(generics.RetrieveUpdateAPIView):
         return Response(self.get_serializer(order).data)
 
     def _release_stock_for_order(self, order):
-        cancel_view = CancelOrderView()
-        cancel_view._release_stock_for_order(order)
+        release_order_stock(order)
 
     def _fulfill_stock_for_order(self, order):
-        stocks_to_update = []
-        for item in order.items.all():
-            quantity_to_fulfill = item.quantity
-            product_stocks = Stock.objects.select_for_update().filter(product=item.product)
-
-            for stock in product_stocks:
-                if quantity_to_fulfill <= 0: break
-                
-                fulfill_from_this = min(quantity_to_fulfill, stock.reserved_quantity)
-                if fulfill_from_this > 0:
-                    stock.quantity -= fulfill_from_this
-                    stock.reserved_quantity -= fulfill_from_this
-                    stocks_to_update.append(stock)
-                    quantity_to_fulfill -= fulfill_from_this
-            
-            if quantity_to_fulfill > 0:
-                raise Exception(f"No se pudo cumplir con el stock reservado para el producto {item.product.id}")
-
-        if stocks_to_update:
-            Stock.objects.bulk_update(list(set(stocks_to_update)), ['quantity', 'reserved_quantity'])
+        fulfill_order_stock(order)
@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-17 23:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchases', '0009_alter_invoiceitem_options'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoice',
+            name='invoice_number',
+            field=models.CharField(blank=True, max_length=32, unique=True, verbose_name='Número de factura'),
+        ),
+        migrations.CreateModel(
+            name='InvoiceNumberCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Día')),
+                ('prefix', models.CharField(max_length=16, verbose_name='Prefijo')),
+                ('last_value', models.PositiveIntegerField(default=0, verbose_name='Último número')),
+            ],
+            options={
+                'verbose_name': 'Contador de facturas',
+                'verbose_name_plural': 'Contadores de facturas',
+                'constraints': [models.UniqueConstraint(fields=('day', 'prefix'), name='invoice_number_counter_day_prefix')],
+            },
+        ),
+    ]
@@ -1,10 +1,10 @@
 from django.db import models, transaction
 from django.db.models import Sum, F
 from store.models import Product
-from django.utils.timezone import now
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
-from inventory.models import SalesPoint, Stock, StockMovement
+from inventory.models import SalesPoint, Stock
+from inventory.services import change_stock, NegativeStockError
 from orders.models import OrderItem
 
 User = get_user_model()
@@ -16,7 +16,7 @@ class Invoice(models.Model):
         ("anulada", "Anulada"),
     ]
 
-    invoice_number = models.CharField(max_length=20, unique=True, blank=True, verbose_name="Número de factura")
+    invoice_number = models.CharField(max_length=32, unique=True, blank=True, verbose_name="Número de factura")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de creación")
     supplier = models.CharField(max_length=100, verbose_name="Proveedor")
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Usuario")
@@ -29,7 +29,8 @@ class Invoice(models.Model):
     def save(self, *args, **kwargs):
         is_new = self._state.adding
         if not self.invoice_number:
-            self.invoice_number = f"INV-{now().strftime('%Y%m%d-%H%M%S')}"
+            from purchases.numbering import next_invoice_number
+            self.invoice_number = next_invoice_number(self.sales_point_id)
 
         if is_new and not self.user_id:
             raise ValidationError({"user": "No se puede crear una factura sin usuario."})
@@ -38,40 +39,33 @@ class Invoice(models.Model):
             super().save(*args, **kwargs)
 
     def update_stock(self):
-        if not self.items.exists():
+        """Adds every line to stock at the invoice's sales point with a constant number of queries."""
+        items = list(self.items.all())
+        if not items:
             raise ValidationError("No se puede procesar una factura sin artículos.")
-        with transaction.atomic():
-            for item in self.items.all():
-                stock, created = Stock.objects.get_or_create(
-                    product=item.product, sales_point=self.sales_point, defaults={"quantity": 0}
-                )
-                stock.quantity += item.quantity
-                stock.save()
-                StockMovement.objects.create(
-                    product=item.product,
-                    sales_point=self.sales_point,
-                    change=item.quantity,
-                    reason=f"Recepción de factura {self.invoice_number}"
-                )
+        change_stock(
+            [((item.product_id, self.sales_point_id), item.quantity) for item in items],
+            reason=f"Recepción de factura {self.invoice_number}",
+            create_missing=True,
+        )
 
     def revert_stock(self):
-        if not self.items.exists():
+        """Removes what is left of every line (quantity minus returns) from stock."""
+        items = list(self.items.select_related("product"))
+        if not items:
             raise ValidationError("No se puede revertir una factura sin artículos.")
-        with transaction.atomic():
-            for item in self.items.all():
-                stock = Stock.objects.filter(product=item.product, sales_point=self.sales_point).first()
-                total_returned = self.returns.filter(product=item.product).aggregate(Sum('quantity'))['quantity__sum'] or 0
-                remaining_quantity = item.quantity - total_returned
-                if not stock or stock.quantity < remaining_quantity:
-                    raise ValidationError(f"No hay suficiente stock para revertir {item.product.name}.")
-                stock.quantity -= remaining_quantity
-                stock.save()
-                StockMovement.objects.create(
-                    product=item.product,
-                    sales_point=self.sales_point,
-                    change=-remaining_quantity,
-                    reason=f"Anulación de factura {self.invoice_number}"
-                )
+        returned = dict(
+            self.returns.values("product_id").annotate(total=Sum("quantity")).values_list("product_id", "total")
+        )
+        changes = [
+            ((item.product_id, self.sales_point_id), -(item.quantity - returned.get(item.product_id, 0)))
+            for item in items
+        ]
+        try:
+            change_stock(changes, reason=f"Anulación de factura {self.invoice_number}")
+        except NegativeStockError as e:
+            product_name = next(item.product.name for item in items if item.product_id == e.product_id)
+            raise ValidationError(f"No hay suficiente stock para revertir {product_name}.")
 
     def delete(self, *args, **kwargs):
         with transaction.atomic():
@@ -87,6 +81,23 @@ class Invoice(models.Model):
         verbose_name = "Factura"
         verbose_name_plural = "Facturas"
 
+class InvoiceNumberCounter(models.Model):
+    """Último número emitido por día y prefijo; cada fila se incrementa con un único UPSERT."""
+    day = models.DateField(verbose_name="Día")
+    prefix = models.CharField(max_length=16, verbose_name="Prefijo")
+    last_value = models.PositiveIntegerField(default=0, verbose_name="Último número")
+
+    def __str__(self):
+        return f"{self.prefix}-{self.day:%Y%m%d}: {self.last_value}"
+
+    class Meta:
+        verbose_name = "Contador de facturas"
+        verbose_name_plural = "Contadores de facturas"
+        constraints = [
+            models.UniqueConstraint(fields=["day", "prefix"], name="invoice_number_counter_day_prefix"),
+        ]
+
+
 class InvoiceItem(models.Model):
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name="items", verbose_name="Factura")
     product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="Producto")
@@ -104,24 +115,17 @@ class InvoiceItem(models.Model):
         with transaction.atomic():
             is_new = self._state.adding
             if not is_new:
-                old_instance = InvoiceItem.objects.get(pk=self.pk)
-                quantity_diff = self.quantity - old_instance.quantity
+                old_quantity = InvoiceItem.objects.values_list("quantity", flat=True).get(pk=self.pk)
+                quantity_diff = self.quantity - old_quantity
                 if quantity_diff != 0 and self.invoice.status == "procesada":
-                    stock = Stock.objects.filter(product=self.product, sales_point=self.invoice.sales_point).first()
-                    if stock:
-                        if quantity_diff > 0:
-                            stock.quantity += quantity_diff
-                        elif stock.quantity >= -quantity_diff:
-                            stock.quantity -= -quantity_diff
-                        else:
-                            raise ValidationError(f"No hay suficiente stock para reducir {self.product.name}.")
-                        stock.save()
-                        StockMovement.objects.create(
-                            product=self.product,
-                            sales_point=self.invoice.sales_point,
-                            change=quantity_diff,
-                            reason=f"Modificación de factura {self.invoice.invoice_number}"
+                    try:
+                        change_stock(
+                            {(self.product_id, self.invoice.sales_point_id): quantity_diff},
+                            reason=f"Modificación de factura {self.invoice.invoice_number}",
+                            create_missing=True,
                         )
+                    except NegativeStockError:
+                        raise ValidationError(f"No hay suficiente stock para reducir {self.product.name}.")
 
             existing_item = InvoiceItem.objects.filter(
                 invoice=self.invoice, product=self.product
@@ -135,17 +139,12 @@ class InvoiceItem(models.Model):
     def delete(self, *args, **kwargs):
         with transaction.atomic():
             if self.invoice.status == "procesada":
-                stock = Stock.objects.filter(product=self.product, sales_point=self.invoice.sales_point).first()
-                if stock and stock.quantity >= self.quantity:
-                    stock.quantity -= self.quantity
-                    stock.save()
-                    StockMovement.objects.create(
-                        product=self.product,
-                        sales_point=self.invoice.sales_point,
-                        change=-self.quantity,
-                        reason=f"Eliminación de artículo de factura {self.invoice.invoice_number}"
+                try:
+                    change_stock(
+                        {(self.product_id, self.invoice.sales_point_id): -self.quantity},
+                        reason=f"Eliminación de artículo de factura {self.invoice.invoice_number}",
                     )
-                else:
+                except NegativeStockError:
                     raise ValidationError(f"No hay suficiente stock para eliminar {self.product.name}.")
             super().delete(*args, **kwargs)
 
@@ -179,42 +178,17 @@ class InvoiceReturn(models.Model):
     def save(self, *args, **kwargs):
         with transaction.atomic():
             self.clean()
-            is_new = self._state.adding
-            stock = Stock.objects.filter(product=self.product, sales_point=self.sales_point).first()
-            if not is_new:
-                old_instance = InvoiceReturn.objects.get(pk=self.pk)
-                quantity_diff = self.quantity - old_instance.quantity
-                if quantity_diff != 0:
-                    if quantity_diff > 0 and stock.quantity >= quantity_diff:
-                        stock.quantity -= quantity_diff
-                        stock.save()
-                        StockMovement.objects.create(
-                            product=self.product,
-                            sales_point=self.sales_point,
-                            change=-quantity_diff,
-                            reason=f"Modificación de devolución de factura {self.invoice.invoice_number}"
-                        )
-                    elif quantity_diff < 0:
-                        stock.quantity += abs(quantity_diff)
-                        stock.save()
-                        StockMovement.objects.create(
-                            product=self.product,
-                            sales_point=self.sales_point,
-                            change=abs(quantity_diff),
-                            reason=f"Modificación de devolución de factura {self.invoice.invoice_number}"
-                        )
+            if self._state.adding:
+                change = -self.quantity
+                reason = f"Devolución de factura {self.invoice.invoice_number}"
             else:
-                if stock.quantity >= self.quantity:
-                    stock.quantity -= self.quantity
-                    stock.save()
-                    StockMovement.objects.create(
-                        product=self.product,
-                        sales_point=self.sales_point,
-                        change=-self.quantity,
-                        reason=f"Devolución de factura {self.invoice.invoice_number}"
-                    )
-                else:
-                    raise ValidationError(f"No hay suficiente stock de {self.product.name} para devolver.")
+                old_quantity = InvoiceReturn.objects.values_list("quantity", flat=True).get(pk=self.pk)
+                change = old_quantity - self.quantity
+                reason = f"Modificación de devolución de factura {self.invoice.invoice_number}"
+            try:
+                change_stock({(self.product_id, self.sales_point_id): change}, reason=reason)
+            except NegativeStockError:
+                raise ValidationError(f"No hay suficiente stock de {self.product.name} para devolver.")
 
             super().save(*args, **kwargs)
 
@@ -222,16 +196,11 @@ class InvoiceReturn(models.Model):
         with transaction.atomic():
             if OrderItem.objects.filter(product=self.product).exists():
                 raise ValidationError("No se puede eliminar el retorno: el producto ya ha sido vendido.")
-            stock = Stock.objects.filter(product=self.product, sales_point=self.sales_point).first()
-            if stock:
-                stock.quantity += self.quantity
-                stock.save()
-                StockMovement.objects.create(
-                    product=self.product,
-                    sales_point=self.sales_point,
-                    change=self.quantity,
-                    reason=f"Cancelación de devolución de factura {self.invoice.invoice_number}"
-                )
+            change_stock(
+                {(self.product_id, self.sales_point_id): self.quantity},
+                reason=f"Cancelación de devolución de factura {self.invoice.invoice_number}",
+                create_missing=True,
+            )
             super().delete(*args, **kwargs)
 
     def __str__(self):
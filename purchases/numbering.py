@@ -0,0 +1,72 @@
+from threading import local
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.utils import timezone
+from .models import InvoiceNumberCounter
+
+_counter = local()
+
+
+def invoice_number_prefix(sales_point_id=None):
+    """`INV`, or `INV<sales point id>` when INVOICE_NUMBER_PER_SALES_POINT is enabled."""
+    prefix = settings.INVOICE_NUMBER_PREFIX
+    if settings.INVOICE_NUMBER_PER_SALES_POINT and sales_point_id:
+        prefix = f"{prefix}{sales_point_id}"
+    return prefix
+
+
+def _counter_connection():
+    """
+    The connection the counter is bumped on. Inside a transaction this is a
+    second connection to the same database, kept per thread in autocommit
+    mode, so the counter row is locked for one statement only instead of until
+    the caller's transaction (the whole invoice create) ends.
+    """
+    if not connection.in_atomic_block:
+        return connection
+    side = getattr(_counter, "connection", None)
+    if side is None:
+        side = _counter.connection = connections.create_connection(DEFAULT_DB_ALIAS)
+    elif side.connection is not None and not side.is_usable():
+        side.close()
+    return side
+
+
+def reserve_invoice_numbers(count, sales_point_id=None, day=None):
+    """
+    Reserves `count` consecutive invoice numbers for `day` (today by default)
+    and returns them as a list.
+
+    The per-day counter row is bumped with a single statement:
+
+        INSERT INTO purchases_invoicenumbercounter ... ON CONFLICT (day, prefix)
+        DO UPDATE SET last_value = last_value + %s RETURNING last_value
+
+    so concurrent callers never read the same value and a whole import batch
+    costs one round trip. It commits on its own (see _counter_connection), so
+    parallel invoice creates only wait on each other for that statement. Like
+    a sequence, numbers taken by a transaction that rolls back are skipped.
+    """
+    if count <= 0:
+        return []
+    day = day or timezone.localdate()
+    prefix = invoice_number_prefix(sales_point_id)
+    db = _counter_connection()
+    table = db.ops.quote_name(InvoiceNumberCounter._meta.db_table)
+    with db.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (day, prefix, last_value) VALUES (%s, %s, %s) "
+            f"ON CONFLICT (day, prefix) DO UPDATE SET last_value = {table}.last_value + EXCLUDED.last_value "
+            f"RETURNING last_value",
+            [day, prefix, count],
+        )
+        last_value = cursor.fetchone()[0]
+    return [
+        f"{prefix}-{day:%Y%m%d}-{value:05d}"
+        for value in range(last_value - count + 1, last_value + 1)
+    ]
+
+
+def next_invoice_number(sales_point_id=None):
+    """Returns the next invoice number for today, e.g. `INV-20260317-00042`."""
+    return reserve_invoice_numbers(1, sales_point_id)[0]
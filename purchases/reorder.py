@@ -0,0 +1,167 @@
+"""
+Demand-driven reorder suggestions.
+
+Daily sales of every (sales point, product) pair over the last
+REORDER_HISTORY_DAYS closed days are loaded from the DailySalesFact rollup in
+one query into a NumPy matrix. Demand and its variability are then computed for
+all pairs at once with moving averages:
+
+    demand        = max(short moving average, long moving average) per day
+    reorder point = demand * lead time + z * std(daily sales) * sqrt(lead time)
+    order up to   = reorder point + demand * REORDER_COVER_DAYS
+
+A Stock row is reordered when its position (available plus what is already on
+pending invoices) is at or below its reorder point. The suggestions become
+draft `pendiente` invoices, one per sales point.
+"""
+import logging
+import math
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from analytics.models import DailySalesFact
+from analytics.optional import require
+from analytics.timeseries import local_day
+from inventory.models import Stock
+from .models import Invoice, InvoiceItem
+
+logger = logging.getLogger(__name__)
+
+
+def _demand(pair_keys, rows, start_day, days):
+    """
+    Per-pair (demand per day, std of daily sales) for the sorted `pair_keys`,
+    from (pair key, day, quantity) rows of the [start_day, start_day + days) window.
+    """
+    np = require("numpy")
+    sales = np.zeros((len(pair_keys), days))
+    if rows:
+        keys = np.fromiter((key for key, _, _ in rows), dtype=np.int64, count=len(rows))
+        offsets = np.fromiter(((day - start_day).days for _, day, _ in rows), dtype=np.int64, count=len(rows))
+        quantities = np.fromiter((quantity for _, _, quantity in rows), dtype=float, count=len(rows))
+        np.add.at(sales, (np.searchsorted(pair_keys, keys), offsets), quantities)
+
+    totals = np.cumsum(sales, axis=1)
+    short = min(settings.REORDER_SHORT_WINDOW_DAYS, days)
+    short_average = (totals[:, -1] - (totals[:, -short - 1] if short < days else 0)) / short
+    long_average = totals[:, -1] / days
+    return np.maximum(short_average, long_average), sales.std(axis=1)
+
+
+def _pair_key(sales_point_id, product_id):
+    # Both ids fit in 32 bits, so a pair packs into one sortable int64.
+    return (sales_point_id << 32) | product_id
+
+
+def suggest_reorders():
+    """
+    Returns [{'sales_point_id', 'product_id', 'quantity', 'reorder_point'}, ...]
+    for every Stock row whose position fell to its reorder point. Runs three
+    queries whatever the number of products and sales points.
+    """
+    np = require("numpy")
+    days = settings.REORDER_HISTORY_DAYS
+    end_day = local_day(timezone.now()) - timedelta(days=1)
+    start_day = end_day - timedelta(days=days - 1)
+
+    stocks = list(Stock.objects.values_list("sales_point_id", "product_id", F("quantity") - F("reserved_quantity")))
+    if not stocks:
+        return []
+    on_order = {
+        _pair_key(sales_point_id, product_id): quantity
+        for sales_point_id, product_id, quantity in InvoiceItem.objects.filter(invoice__status="pendiente")
+        .values_list("invoice__sales_point_id", "product_id")
+        .annotate(quantity=Sum("quantity"))
+        .order_by()
+    }
+    stock_keys = np.fromiter(
+        (_pair_key(sales_point_id, product_id) for sales_point_id, product_id, _ in stocks),
+        dtype=np.int64, count=len(stocks),
+    )
+    pair_keys = np.unique(stock_keys)
+    known = set(pair_keys.tolist())
+    facts = [
+        (key, day, quantity)
+        for key, day, quantity in (
+            (_pair_key(sales_point_id, product_id), day, quantity)
+            for sales_point_id, product_id, day, quantity in DailySalesFact.objects.filter(
+                day__range=(start_day, end_day), sales_point__isnull=False,
+            ).values_list("sales_point_id", "product_id", "day", "quantity").iterator(chunk_size=5000)
+        )
+        if key in known
+    ]
+    demand, deviation = _demand(pair_keys, facts, start_day, days)
+
+    lead_time = settings.REORDER_LEAD_TIME_DAYS
+    reorder_point = demand * lead_time + settings.REORDER_SERVICE_LEVEL_Z * deviation * math.sqrt(lead_time)
+    order_up_to = reorder_point + demand * settings.REORDER_COVER_DAYS
+
+    # Back to Stock order: one row of the pair arrays per Stock row.
+    rows = np.searchsorted(pair_keys, stock_keys)
+    position = np.fromiter(
+        (available + on_order.get(key, 0) for key, (_, _, available) in zip(stock_keys.tolist(), stocks)),
+        dtype=float, count=len(stocks),
+    )
+    quantity = np.ceil(order_up_to[rows] - position)
+    reorder = (demand[rows] > 0) & (position <= reorder_point[rows]) & (quantity > 0)
+
+    suggestions = [
+        {
+            "sales_point_id": stocks[index][0],
+            "product_id": stocks[index][1],
+            "quantity": int(quantity[index]),
+            "reorder_point": round(float(reorder_point[rows[index]]), 2),
+        }
+        for index in np.flatnonzero(reorder)
+    ]
+    return suggestions
+
+
+def _last_costs(product_ids):
+    """Unit cost of each product on its latest processed invoice."""
+    return dict(
+        InvoiceItem.objects.filter(invoice__status="procesada", product_id__in=product_ids)
+        .order_by("product_id", "-invoice__created_at", "-id")
+        .distinct("product_id")
+        .values_list("product_id", "cost_per_item")
+    )
+
+
+def create_reorder_invoices(user, suggestions=None):
+    """
+    Turns the suggestions into draft `pendiente` invoices for REORDER_SUPPLIER,
+    one per sales point, priced at the last known cost. Returns the invoices.
+    Their lines count as on order, so running it again does not reorder them.
+    """
+    if suggestions is None:
+        suggestions = suggest_reorders()
+    by_sales_point = defaultdict(list)
+    for suggestion in suggestions:
+        by_sales_point[suggestion["sales_point_id"]].append(suggestion)
+    costs = _last_costs({suggestion["product_id"] for suggestion in suggestions})
+
+    invoices = []
+    with transaction.atomic():
+        for sales_point_id, lines in sorted(by_sales_point.items()):
+            invoice = Invoice.objects.create(
+                supplier=settings.REORDER_SUPPLIER,
+                user=user,
+                sales_point_id=sales_point_id,
+                status="pendiente",
+            )
+            InvoiceItem.objects.bulk_create([
+                InvoiceItem(
+                    invoice=invoice,
+                    product_id=line["product_id"],
+                    quantity=line["quantity"],
+                    cost_per_item=costs.get(line["product_id"], 0),
+                )
+                for line in lines
+            ])
+            invoices.append(invoice)
+    if invoices:
+        logger.info("Reorder: %s draft invoices with %s lines", len(invoices), len(suggestions))
+    return invoices
@@ -4,6 +4,7 @@ from django.db.models import Sum
 from .models import Invoice, InvoiceItem, InvoiceReturn
 from store.models import Product
 from inventory.models import SalesPoint, Stock
+from inventory.services import change_stock, NegativeStockError
 from inventory.serializers import SalesPointSerializer
 from users.serializers import SimpleUserSerializer # Import SimpleUserSerializer
 
@@ -22,6 +23,7 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = InvoiceItem
         fields = ["id", "invoice", "product", "product_id", "quantity", "cost_per_item", "total_cost"]
+        read_only_fields = ["invoice"]
 
     def get_total_cost(self, obj):
         return obj.quantity * obj.cost_per_item
@@ -51,9 +53,12 @@ class InvoiceSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         items_data = validated_data.pop("items")
-        invoice = Invoice.objects.create(**validated_data)
-        for item_data in items_data:
-            InvoiceItem.objects.create(invoice=invoice, **item_data)
+        with transaction.atomic():
+            invoice = Invoice.objects.create(**validated_data)
+            InvoiceItem.objects.bulk_create([
+                InvoiceItem(invoice=invoice, **item_data)
+                for item_data in self._merge_items(items_data).values()
+            ])
         return invoice
 
     def update(self, instance, validated_data):
@@ -69,16 +74,73 @@ class InvoiceSerializer(serializers.ModelSerializer):
             instance.save()
 
             if items_data is not None:
-                if instance.status == "procesada":
-                    instance.revert_stock()
-                instance.items.all().delete()
-                for item_data in items_data:
-                    InvoiceItem.objects.create(invoice=instance, **item_data)
-                if instance.status == "procesada":
-                    instance.update_stock()
+                self._sync_items(instance, items_data)
 
         return instance
 
+    def _merge_items(self, items_data):
+        """
+        Collapses repeated products into one line, like InvoiceItem.save does:
+        quantities are added and the first cost is kept.
+        """
+        merged = {}
+        for item_data in items_data:
+            item_data = dict(item_data)
+            product_id = item_data["product"].id
+            if product_id in merged:
+                merged[product_id]["quantity"] += item_data.get("quantity", 1)
+            else:
+                merged[product_id] = item_data
+        return merged
+
+    def _sync_items(self, instance, items_data):
+        """
+        Diffs the submitted lines against the stored ones per product. Only
+        the added, changed and removed lines are written, in bulk, and a
+        processed invoice only applies the net stock change of each product
+        instead of reverting and replaying the whole invoice.
+        """
+        desired = self._merge_items(items_data)
+        existing = {item.product_id: item for item in instance.items.all()}
+
+        to_create, to_update, stock_changes = [], [], {}
+        for product_id, item_data in desired.items():
+            quantity = item_data.get("quantity", 1)
+            cost_per_item = item_data.get("cost_per_item", 0)
+            item = existing.get(product_id)
+            if item is None:
+                to_create.append(InvoiceItem(invoice=instance, **item_data))
+                stock_changes[product_id] = quantity
+            elif item.quantity != quantity or item.cost_per_item != cost_per_item:
+                stock_changes[product_id] = quantity - item.quantity
+                item.quantity = quantity
+                item.cost_per_item = cost_per_item
+                to_update.append(item)
+        removed = [item for product_id, item in existing.items() if product_id not in desired]
+        for item in removed:
+            stock_changes[item.product_id] = -item.quantity
+
+        if instance.status == "procesada":
+            try:
+                change_stock(
+                    [((product_id, instance.sales_point_id), change) for product_id, change in stock_changes.items()],
+                    reason=f"Modificación de factura {instance.invoice_number}",
+                    create_missing=True,
+                )
+            except NegativeStockError as e:
+                item_data = desired.get(e.product_id)
+                product = item_data["product"] if item_data else existing[e.product_id].product
+                raise serializers.ValidationError({"items": f"No hay suficiente stock para reducir {product.name}."})
+
+        if removed:
+            InvoiceItem.objects.filter(pk__in=[item.pk for item in removed]).delete()
+        if to_update:
+            InvoiceItem.objects.bulk_update(to_update, ["quantity", "cost_per_item"])
+        if to_create:
+            InvoiceItem.objects.bulk_create(to_create)
+        if hasattr(instance, "_prefetched_objects_cache"):
+            instance._prefetched_objects_cache.pop("items", None)
+
 class InvoiceReturnSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
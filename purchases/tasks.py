@@ -0,0 +1,23 @@
+import logging
+from celery import shared_task
+from django.contrib.auth import get_user_model
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def generate_reorder_invoices(user_id=None):
+    """
+    Creates draft invoices from the demand-driven reorder suggestions
+    (purchases.reorder). They are recorded under `user_id`, or under the first
+    superuser when it is not given. Returns the ids of the new invoices.
+    """
+    from .reorder import create_reorder_invoices
+
+    User = get_user_model()
+    users = User.objects.filter(id=user_id) if user_id else User.objects.filter(role="superuser").order_by("id")
+    user = users.first()
+    if user is None:
+        logger.warning("Reorder skipped: no user to record the draft invoices under.")
+        return []
+    return [invoice.id for invoice in create_reorder_invoices(user)]
@@ -1,22 +1,35 @@
 import pytest
+from datetime import timedelta
+from decimal import Decimal
 from rest_framework.test import APIClient
 from django.urls import reverse
 from rest_framework import status
 from purchases.models import Invoice, InvoiceItem, InvoiceReturn
+from purchases.serializers import InvoiceSerializer
+from purchases.numbering import reserve_invoice_numbers
+from purchases.reorder import create_reorder_invoices, suggest_reorders
+from purchases.tasks import generate_reorder_invoices
+from analytics.models import DailySalesFact
+from analytics.timeseries import local_day
 from store.models import Product
-from inventory.models import SalesPoint
+from inventory.models import SalesPoint, Stock, StockMovement
 from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
 
 CustomUser = get_user_model()
 
+
 @pytest.fixture
 def api_client():
     return APIClient()
 
+
 @pytest.fixture
 def admin():
     return CustomUser.objects.create_superuser(username='admin', password='admin123', email='admin@example.com')
 
+
 @pytest.fixture
 def product():
     # Use a unique barcode for each test run
@@ -24,10 +37,12 @@ def product():
     unique_barcode = f"123456789-{uuid.uuid4().hex[:8]}"
     return Product.objects.create(name="Laptop", price=1000, barcode=unique_barcode)
 
+
 @pytest.fixture
 def sales_point():
     return SalesPoint.objects.create(name="Main Store")
 
+
 @pytest.fixture
 def invoice(admin, sales_point, product):
     invoice = Invoice.objects.create(
@@ -44,6 +59,7 @@ def invoice(admin, sales_point, product):
     )
     return invoice
 
+
 @pytest.mark.django_db
 def test_create_invoice(api_client, admin, sales_point, product):
     """Test de creación de factura"""
@@ -58,6 +74,7 @@ def test_create_invoice(api_client, admin, sales_point, product):
     assert response.status_code == status.HTTP_201_CREATED
     assert Invoice.objects.count() == 1
 
+
 @pytest.mark.django_db
 def test_get_invoice_list(api_client, admin, invoice):
     """Test de obtención de lista de facturas"""
@@ -66,6 +83,7 @@ def test_get_invoice_list(api_client, admin, invoice):
     assert response.status_code == status.HTTP_200_OK
     assert len(response.data) == 1
 
+
 @pytest.mark.django_db
 def test_get_invoice_detail(api_client, admin, invoice):
     """Test de obtención de detalles de factura"""
@@ -74,6 +92,7 @@ def test_get_invoice_detail(api_client, admin, invoice):
     assert response.status_code == status.HTTP_200_OK
     assert response.data["invoice_number"] == invoice.invoice_number
 
+
 @pytest.mark.django_db
 def test_update_invoice_status(api_client, admin, invoice):
     """Test de actualización de estado de factura"""
@@ -83,6 +102,7 @@ def test_update_invoice_status(api_client, admin, invoice):
     invoice.refresh_from_db()
     assert invoice.status == "procesada"
 
+
 @pytest.fixture
 def invoice_return(invoice, product, sales_point):
     invoice.status = "procesada"
@@ -95,6 +115,7 @@ def invoice_return(invoice, product, sales_point):
         reason="Producto defectuoso"
     )
 
+
 @pytest.mark.django_db
 def test_create_invoice_return(api_client, admin, invoice, product, sales_point):
     """Test de creación de devolución de factura"""
@@ -112,6 +133,7 @@ def test_create_invoice_return(api_client, admin, invoice, product, sales_point)
     assert response.status_code == status.HTTP_201_CREATED
     assert InvoiceReturn.objects.count() == 1
 
+
 @pytest.mark.django_db
 def test_get_invoice_returns(api_client, admin, invoice_return):
     """Test de obtención de lista de devoluciones"""
@@ -120,10 +142,149 @@ def test_get_invoice_returns(api_client, admin, invoice_return):
     assert response.status_code == status.HTTP_200_OK
     assert len(response.data) == 1
 
+
 @pytest.mark.django_db
 def test_get_invoice_return_detail(api_client, admin, invoice_return):
     """Test de obtención de detalles de devolución"""
     api_client.force_authenticate(admin)
     response = api_client.get(reverse("invoice-returns-detail", args=[invoice_return.id]))
     assert response.status_code == status.HTTP_200_OK
-    assert response.data["quantity"] == 5
\ No newline at end of file
+    assert response.data["quantity"] == 5
+
+
+@pytest.mark.django_db
+def test_process_and_revert_invoice_stock(admin, invoice, product, sales_point):
+    """Test de procesamiento y anulación de factura con devoluciones parciales"""
+    invoice.update_stock()
+    invoice.status = "procesada"
+    invoice.save()
+    stock = Stock.objects.get(product=product, sales_point=sales_point)
+    assert stock.quantity == 10
+
+    InvoiceReturn.objects.create(invoice=invoice, product=product, sales_point=sales_point, quantity=3, reason="Defecto")
+    stock.refresh_from_db()
+    assert stock.quantity == 7
+
+    invoice.revert_stock()
+    stock.refresh_from_db()
+    assert stock.quantity == 0
+    assert StockMovement.objects.filter(product=product, sales_point=sales_point).count() == 3
+
+
+@pytest.mark.django_db
+def test_large_invoice_processing_query_count(api_client, admin, sales_point, django_assert_max_num_queries):
+    """Test de que procesar una factura grande no depende del número de líneas"""
+    invoice = Invoice.objects.create(supplier="Bulk Supplier", user=admin, sales_point=sales_point)
+    products = Product.objects.bulk_create([Product(name=f"Cable {i}", price=10) for i in range(300)])
+    InvoiceItem.objects.bulk_create([
+        InvoiceItem(invoice=invoice, product=p, quantity=5, cost_per_item=2) for p in products
+    ])
+    Stock.objects.create(product=products[0], sales_point=sales_point, quantity=1)
+
+    api_client.force_authenticate(admin)
+    with django_assert_max_num_queries(20):
+        response = api_client.patch(reverse("invoice-update-status", args=[invoice.id]), {"status": "procesada"}, format="json")
+    assert response.status_code == status.HTTP_200_OK
+    assert Stock.objects.filter(product__in=products, sales_point=sales_point).count() == 300
+    assert Stock.objects.get(product=products[0], sales_point=sales_point).quantity == 6
+    assert StockMovement.objects.filter(sales_point=sales_point).count() == 300
+
+    with django_assert_max_num_queries(20):
+        response = api_client.patch(reverse("invoice-update-status", args=[invoice.id]), {"status": "anulada"}, format="json")
+    assert response.status_code == status.HTTP_200_OK
+    assert Stock.objects.get(product=products[0], sales_point=sales_point).quantity == 1
+
+
+@pytest.mark.django_db
+def test_invoice_serializer_update_applies_only_net_stock_changes(admin, sales_point, django_assert_max_num_queries):
+    """Test de edición de una factura procesada: solo se aplican las diferencias por producto"""
+    products = Product.objects.bulk_create([Product(name=f"Charger {i}", price=15) for i in range(50)])
+    serializer = InvoiceSerializer(data={
+        "supplier": "Chargers Inc",
+        "sales_point_id": sales_point.id,
+        "items": [{"product_id": p.id, "quantity": 4, "cost_per_item": "3.00"} for p in products],
+    })
+    serializer.is_valid(raise_exception=True)
+    invoice = serializer.save(user=admin)
+    assert invoice.items.count() == 50
+    invoice.update_stock()
+    invoice.status = "procesada"
+    invoice.save()
+
+    items = [{"product_id": p.id, "quantity": 4, "cost_per_item": "3.00"} for p in products[1:]]
+    items[0]["quantity"] = 9
+    serializer = InvoiceSerializer(invoice, data={"items": items}, partial=True)
+    serializer.is_valid(raise_exception=True)
+    with django_assert_max_num_queries(20):
+        serializer.save()
+
+    stocks = dict(Stock.objects.filter(sales_point=sales_point, product__in=products).values_list("product_id", "quantity"))
+    assert stocks[products[0].id] == 0
+    assert stocks[products[1].id] == 9
+    assert stocks[products[2].id] == 4
+    assert not invoice.items.filter(product=products[0]).exists()
+    assert invoice.items.get(product=products[1]).quantity == 9
+
+
+@pytest.mark.django_db
+def test_invoice_numbers_are_sequential_within_a_day(admin, sales_point, settings):
+    """Test de numeración: facturas creadas en el mismo segundo reciben números distintos y consecutivos"""
+    first = Invoice.objects.create(supplier="A", user=admin, sales_point=sales_point)
+    second = Invoice.objects.create(supplier="B", user=admin, sales_point=sales_point)
+    prefix, day, first_value = first.invoice_number.rsplit("-", 2)
+    assert second.invoice_number == f"{prefix}-{day}-{int(first_value) + 1:05d}"
+
+    batch = reserve_invoice_numbers(3)
+    assert len(set(batch)) == 3
+    assert int(batch[0].rsplit("-", 1)[1]) == int(first_value) + 2
+
+    # The counter is committed on its own: another transaction can take the row while this one is open
+    other = connections.create_connection(DEFAULT_DB_ALIAS)
+    try:
+        with other.cursor() as cursor:
+            cursor.execute(
+                "SELECT last_value FROM purchases_invoicenumbercounter WHERE day = %s AND prefix = %s FOR UPDATE NOWAIT",
+                [timezone.localdate(), prefix],
+            )
+            assert cursor.fetchall() == [(int(first_value) + 4,)]
+    finally:
+        other.close()
+
+    settings.INVOICE_NUMBER_PER_SALES_POINT = True
+    third = Invoice.objects.create(supplier="C", user=admin, sales_point=sales_point)
+    assert third.invoice_number.startswith(f"INV{sales_point.id}-{day}-")
+
+
+@pytest.mark.django_db
+def test_reorder_suggestions_create_draft_invoices(admin, sales_point, settings, django_assert_max_num_queries):
+    """Test de reposición: la demanda reciente define el punto de pedido y genera facturas pendientes"""
+    pytest.importorskip("numpy")
+    settings.REORDER_HISTORY_DAYS = 28
+    settings.REORDER_SHORT_WINDOW_DAYS = 7
+    settings.REORDER_LEAD_TIME_DAYS = 7
+    settings.REORDER_COVER_DAYS = 14
+    settings.REORDER_SERVICE_LEVEL_Z = 0
+    fast, slow, idle = [Product.objects.create(name=f"Reorder {name}", price=10) for name in ("fast", "slow", "idle")]
+    for product, quantity in ((fast, 5), (slow, 100), (idle, 0)):
+        Stock.objects.create(product=product, sales_point=sales_point, quantity=quantity)
+    yesterday = local_day(timezone.now()) - timedelta(days=1)
+    DailySalesFact.objects.bulk_create([
+        DailySalesFact(day=yesterday - timedelta(days=offset), sales_point=sales_point, product=product,
+                       quantity=quantity, revenue=0, cogs=0, order_count=1)
+        for offset in range(14)
+        for product, quantity in ((fast, 10), (slow, 1))
+    ])
+    received = Invoice.objects.create(supplier="Tech Supplier", user=admin, sales_point=sales_point)
+    InvoiceItem.objects.create(invoice=received, product=fast, quantity=1, cost_per_item=12)
+    Invoice.objects.filter(id=received.id).update(status="procesada")
+
+    with django_assert_max_num_queries(3):
+        suggestions = suggest_reorders()
+    # fast: demand max(70/7, 140/28) = 10/day -> reorder point 70, order up to 70 + 140
+    assert suggestions == [{"sales_point_id": sales_point.id, "product_id": fast.id, "quantity": 205, "reorder_point": 70.0}]
+
+    [draft] = create_reorder_invoices(admin, suggestions)
+    assert (draft.status, draft.supplier, draft.sales_point_id) == ("pendiente", settings.REORDER_SUPPLIER, sales_point.id)
+    assert list(draft.items.values_list("product_id", "quantity", "cost_per_item")) == [(fast.id, 205, Decimal("12.00"))]
+    # Pending lines count as on order, so the next run does not reorder again
+    assert generate_reorder_invoices(admin.id) == []
@@ -48,7 +48,8 @@ class InvoiceUpdateStatusView(generics.UpdateAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        return Invoice.objects.all() if user.is_staff else Invoice.objects.filter(sales_point__sellers=user)
+        base_queryset = Invoice.objects.select_related('user', 'sales_point').prefetch_related("items__product")
+        return base_queryset if user.is_staff else base_queryset.filter(sales_point__sellers=user)
 
     def update(self, request, *args, **kwargs):
         invoice = self.get_object()
@@ -60,7 +61,7 @@ class InvoiceUpdateStatusView(generics.UpdateAPIView):
         with transaction.atomic():
             if invoice.status == "procesada" and new_status == "anulada":
                 invoice.revert_stock()
-            elif invoice.status == "pendiente" and new_status == "procesada" and invoice.items.exists():
+            elif invoice.status == "pendiente" and new_status == "procesada" and invoice.items.all():
                 invoice.update_stock()
             invoice.status = new_status
             invoice.save()
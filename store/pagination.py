@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the product catalog.
+
+    Pages are ordered by the primary key, which is unique and immutable, so
+    every page is a single index range scan regardless of how deep the client
+    walks and no product is skipped or repeated when new products are added.
+    """
+    ordering = "id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
@@ -43,7 +43,41 @@ def test_list_products(authenticated_client):
     response = client.get(url)
 
     assert response.status_code == 200
-    assert any(p["name"] == "iPhone 13" for p in response.json())
+    assert any(p["name"] == "iPhone 13" for p in response.json()["results"])
+
+
+@pytest.mark.django_db
+def test_list_products_cursor_pagination(authenticated_client):
+    """
+    ✅ Тест курсорной пагинации каталога и наличия только для товаров страницы.
+    """
+    client, user = authenticated_client
+
+    category = Category.objects.create(name="Tablets")
+    sales_point = user.sales_points.first()
+    products = [
+        Product.objects.create(name=f"Tablet {i}", category=category, price=100 + i, barcode=f"tab-{uuid.uuid4().hex[:8]}")
+        for i in range(3)
+    ]
+    Stock.objects.create(product=products[0], sales_point=sales_point, quantity=5)
+
+    url = reverse("store:product-list")
+    seen = []
+    next_url = f"{url}?page_size=2"
+    while next_url:
+        response = client.get(next_url)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["results"]) <= 2
+        seen.extend(page["results"])
+        next_url = page["next"]
+
+    seen_ids = [p["id"] for p in seen]
+    assert seen_ids == sorted(seen_ids)
+    assert len(seen_ids) == len(set(seen_ids))
+    by_id = {p["id"]: p for p in seen}
+    assert by_id[products[0].id]["availability"] == "available"
+    assert by_id[products[1].id]["availability"] == "on_order"
 
 
 @pytest.mark.django_db
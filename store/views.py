@@ -1,10 +1,11 @@
 from rest_framework import generics, permissions
 from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied
-from django.db.models import F, Q, Sum
+from django.db.models import F, Q
 from store.models import Product, Category
 from store.serializers import ProductSerializer, CategorySerializer
-from inventory.models import Stock, StockMovement
+from store.pagination import ProductCursorPagination
+from inventory.models import Stock, StockMovement, ProductAvailability
 from inventory.serializers import StockMovementSerializer
 from rest_framework.throttling import ScopedRateThrottle
 
@@ -32,34 +33,28 @@ class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 class ProductListView(generics.ListCreateAPIView):
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
     throttle_classes = [ScopedRateThrottle]
     throttle_scope = "product_list"
 
     def get_queryset(self):
         return Product.objects.all()
 
-    def get_serializer_context(self):
+    def paginate_queryset(self, queryset):
         """
-        This is the final, correct fix. This method ensures that the serializer
-        always receives the necessary context, regardless of where it's called from.
+        Remember the ids of the current page so that availability is only
+        aggregated for the products that are actually serialized.
         """
-        # Start with the default context
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            self.page_product_ids = [product.id for product in page]
+        return page
+
+    def get_serializer_context(self):
         context = super().get_serializer_context()
-        
-        # Get all product IDs from the queryset that will be listed
-        product_ids = self.get_queryset().values_list('id', flat=True)
-        
-        # Calculate the available stock for all products in a single query.
-        stocks = Stock.objects.filter(product_id__in=product_ids)\
-            .values('product_id')\
-            .annotate(available_stock=Sum(F('quantity') - F('reserved_quantity')))
-            
-        # Create the stock map
-        stock_map = {s['product_id']: s['available_stock'] for s in stocks}
-        
-        # Add the stock map to the context
-        context['product_stock_map'] = stock_map
-        
+
+        product_ids = getattr(self, 'page_product_ids', [])
+        context['product_stock_map'] = ProductAvailability.objects.available_map(product_ids) if product_ids else {}
         return context
 
     def get_permissions(self):
@@ -80,11 +75,7 @@ class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
         context = super().get_serializer_context()
         product_id = self.kwargs.get('pk') # Get product ID from URL
         if product_id:
-            stocks = Stock.objects.filter(product_id=product_id)\
-                .values('product_id')\
-                .annotate(available_stock=Sum(F('quantity') - F('reserved_quantity')))
-            stock_map = {s['product_id']: s['available_stock'] for s in stocks}
-            context['product_stock_map'] = stock_map
+            context['product_stock_map'] = ProductAvailability.objects.available_map([product_id])
         return context
 
     def get_permissions(self):